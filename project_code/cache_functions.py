@@ -0,0 +1,188 @@
+import darts
+import hashlib
+import inspect
+import json
+import numpy as np
+import os
+import shutil
+import time
+
+from darts.models.forecasting.torch_forecasting_model import TorchForecastingModel
+
+
+def get_data_fingerprint(*series) -> str:
+    """Returns a sha256 digest of the values, time index and component names of the given TimeSeries."""
+    digest = hashlib.sha256()
+
+    for ts in series:
+        if ts is None:
+            digest.update(b'none')
+            continue
+
+        digest.update(np.ascontiguousarray(ts.values(copy=False)).tobytes())
+        digest.update(str(ts.values(copy=False).dtype).encode())
+        digest.update(f'{ts.start_time()}|{ts.end_time()}|{ts.freq_str}'.encode())
+        digest.update('|'.join(ts.components).encode())
+
+    return digest.hexdigest()
+
+def _config_default(obj):
+    """json fallback for model parameters: classes and functions by name, other objects by their simple attributes."""
+    if inspect.isclass(obj) or inspect.isfunction(obj):
+        return f'{obj.__module__}.{obj.__qualname__}'
+
+    # e.g. Lightning callbacks: keep the settings (patience, monitor, profile, ...) but skip
+    # private attributes, tensors and references such as an Optuna trial
+    simple_types = (str, int, float, bool, type(None), list, tuple, dict)
+    attributes = {key: value for key, value in vars(obj).items()
+                  if not key.startswith('_') and isinstance(value, simple_types)} if hasattr(obj, '__dict__') else {}
+
+    return {'type': f'{type(obj).__module__}.{type(obj).__qualname__}', **attributes}
+
+def get_model_config(model) -> dict:
+    """Returns the resolved configuration of an unfitted darts model."""
+    return {
+        'class': f'{type(model).__module__}.{type(model).__qualname__}',
+        'params': dict(model.model_params),
+        'darts_version': darts.__version__
+    }
+
+def get_model_cache_key(model, seed, cutoff_date, has_outliers, data_fingerprint, **extra) -> str:
+    """
+    Returns the content address of a fitted model: a sha256 digest of the resolved model configuration,
+    seed, cutoff date, outlier flag, data fingerprint and any extra settings that influence fitting.
+    """
+    config = {
+        'model': get_model_config(model),
+        'seed': seed,
+        'cutoff_date': str(cutoff_date),
+        'has_outliers': bool(has_outliers),
+        'data_fingerprint': data_fingerprint,
+        'extra': extra
+    }
+
+    config_json = json.dumps(config, sort_keys=True, default=_config_default)
+
+    return hashlib.sha256(config_json.encode()).hexdigest()
+
+def get_cache_entry_path(cache_directory, cache_key) -> str:
+    return os.path.join(cache_directory, cache_key[:2], cache_key)
+
+def _get_model_file_name(model) -> str:
+    return 'model.pt' if isinstance(model, TorchForecastingModel) else 'model.pkl'
+
+def load_cached_model(cache_directory, cache_key, model):
+    """
+    Returns the cached fitted model and its metadata, or (None, None) on a cache miss. The model argument
+    is the unfitted model, used to determine the model class. Hits refresh the entry's last-used time.
+    """
+    entry_path = get_cache_entry_path(cache_directory, cache_key)
+    model_path = os.path.join(entry_path, _get_model_file_name(model))
+    metadata_path = os.path.join(entry_path, 'metadata.json')
+
+    if not (os.path.exists(model_path) and os.path.exists(metadata_path)):
+        return None, None
+
+    # cache entries are written by save_cached_model, so they can be loaded as trusted where darts asks
+    load_kwargs = {'trusted': True} if 'trusted' in inspect.signature(type(model).load).parameters else {}
+
+    try:
+        fitted_model = type(model).load(model_path, **load_kwargs)
+    except Exception as e:
+        print(f'Unable to load cached model {cache_key}, it will be refitted')
+        print(e)
+        return None, None
+
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+
+    metadata['last_used'] = time.time()
+    write_json_atomic(metadata, metadata_path)
+
+    return fitted_model, metadata
+
+def save_cached_model(cache_directory, cache_key, model, metadata: dict):
+    """Saves a fitted model and its metadata (e.g. training time) under the given cache key."""
+    entry_path = get_cache_entry_path(cache_directory, cache_key)
+    tmp_path = f'{entry_path}.tmp{os.getpid()}'
+
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    model.save(os.path.join(tmp_path, _get_model_file_name(model)))
+
+    metadata = {**metadata, 'created': time.time(), 'last_used': time.time()}
+    write_json_atomic(metadata, os.path.join(tmp_path, 'metadata.json'))
+
+    # publish the entry in one step so readers never see a partially written model
+    if os.path.exists(entry_path):
+        shutil.rmtree(entry_path)
+    os.replace(tmp_path, entry_path)
+
+def write_json_atomic(data, file):
+    """Writes data as json to a temporary file and renames it into place, so the file is never seen half-written."""
+    tmp_file = f'{file}.tmp{os.getpid()}'
+
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_file, file)
+
+def get_model_cache_entries(cache_directory) -> list:
+    """Returns [{'key', 'path', 'size_bytes', 'last_used'}] for every complete entry in the cache."""
+    entries = []
+
+    if not os.path.exists(cache_directory):
+        return entries
+
+    for prefix in os.listdir(cache_directory):
+        prefix_path = os.path.join(cache_directory, prefix)
+        if not os.path.isdir(prefix_path):
+            continue
+
+        for cache_key in os.listdir(prefix_path):
+            entry_path = os.path.join(prefix_path, cache_key)
+            metadata_path = os.path.join(entry_path, 'metadata.json')
+
+            if '.tmp' in cache_key or not os.path.exists(metadata_path):
+                continue
+
+            with open(metadata_path) as f:
+                last_used = json.load(f).get('last_used', os.path.getmtime(metadata_path))
+
+            size_bytes = sum(os.path.getsize(os.path.join(entry_path, file)) for file in os.listdir(entry_path))
+            entries.append({'key': cache_key, 'path': entry_path, 'size_bytes': size_bytes, 'last_used': last_used})
+
+    return entries
+
+def evict_model_cache(cache_directory, max_size_gb=None, max_age_days=None) -> list:
+    """
+    Removes entries unused for more than max_age_days, then the least recently used entries until the
+    cache fits in max_size_gb. Returns the evicted cache keys.
+    """
+    entries = sorted(get_model_cache_entries(cache_directory), key=lambda entry: entry['last_used'])
+    evicted = []
+
+    if max_age_days is not None:
+        oldest_allowed = time.time() - max_age_days * 86400
+        evicted += [entry for entry in entries if entry['last_used'] < oldest_allowed]
+        entries = [entry for entry in entries if entry['last_used'] >= oldest_allowed]
+
+    if max_size_gb is not None:
+        total_size = sum(entry['size_bytes'] for entry in entries)
+
+        while entries and total_size > max_size_gb * 1024**3:
+            entry = entries.pop(0)
+            total_size -= entry['size_bytes']
+            evicted.append(entry)
+
+    for entry in evicted:
+        shutil.rmtree(entry['path'], ignore_errors=True)
+
+    if evicted:
+        print(f'Evicted {len(evicted)} cached models from {cache_directory}')
+
+    return [entry['key'] for entry in evicted]
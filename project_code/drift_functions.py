@@ -0,0 +1,281 @@
+import json
+import numpy as np
+import os
+import pandas as pd
+from scipy.special import kolmogorov
+from scipy.stats import ks_2samp
+
+from project_code import cache_functions as cf
+from project_code import processing_functions as pf
+from project_code import sweep_functions as sf
+
+
+def get_psi(reference, current, n_bins=5) -> float:
+    """Returns the population stability index of current against reference over n_bins reference quantile bins."""
+    reference = np.asarray(reference, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    reference, current = reference[~np.isnan(reference)], current[~np.isnan(current)]
+
+    edges = np.unique(np.quantile(reference, np.linspace(0, 1, n_bins + 1)[1:-1]))
+    n_bins = len(edges) + 1
+
+    # additive smoothing keeps empty bins of short windows from dominating the index
+    reference_share = (np.bincount(np.searchsorted(edges, reference), minlength=n_bins) + 0.5) / (len(reference) + 0.5 * n_bins)
+    current_share = (np.bincount(np.searchsorted(edges, current), minlength=n_bins) + 0.5) / (len(current) + 0.5 * n_bins)
+
+    return float(np.sum((current_share - reference_share) * np.log(current_share / reference_share)))
+
+def get_effective_sample_size(values) -> float:
+    """
+    Returns the number of independent observations equivalent to an autocorrelated series (AR(1) approximation),
+    from the lag-1 autocorrelation around a linear trend so that a seasonal ramp is not counted as persistence.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    positions = np.arange(len(values))
+    centered = values - np.polyval(np.polyfit(positions, values, 1), positions)
+    denominator = np.sum(centered**2)
+    lag1 = np.sum(centered[1:] * centered[:-1]) / denominator if denominator > 0 else 0.0
+    lag1 = min(max(lag1, 0.0), 0.99)
+
+    return len(values) * (1 - lag1) / (1 + lag1)
+
+def get_ks_test(reference, current) -> tuple:
+    """
+    Returns the two-sample Kolmogorov-Smirnov statistic and its asymptotic p-value with both sample sizes
+    reduced to their effective sizes, as consecutive days of weather are far from independent and the plain
+    test flags drift in almost every window.
+    """
+    statistic = ks_2samp(reference, current).statistic
+    n_reference, n_current = get_effective_sample_size(reference), get_effective_sample_size(current)
+    effective_n = n_reference * n_current / (n_reference + n_current)
+
+    return statistic, float(kolmogorov(np.sqrt(effective_n) * statistic))
+
+def get_psi_noise(reference, current, n_bins=5) -> float:
+    """
+    Returns the PSI expected from sampling noise alone, (n_bins - 1) * (1 / n_reference + 1 / n_current) with
+    effective sample sizes: 0.4-0.6 for 5 bins and 30 autocorrelated days, above the usual 0.25 threshold.
+    """
+    return (n_bins - 1) * (1 / get_effective_sample_size(reference) + 1 / get_effective_sample_size(current))
+
+def get_seasonal_reference(df: pd.DataFrame, current_index: pd.DatetimeIndex, margin_days=15) -> pd.DataFrame:
+    """
+    Returns the rows of df before current_index that fall in the same days of the year (plus or minus
+    margin_days), so seasonal data is compared with the same season of earlier years rather than the whole year.
+    """
+    history = df[df.index < current_index.min()]
+    current_days = np.unique(current_index.dayofyear)
+
+    # circular day-of-year distance to the nearest current day
+    distance = np.abs(history.index.dayofyear.to_numpy()[:, np.newaxis] - current_days[np.newaxis, :])
+    distance = np.minimum(distance, 365 - distance).min(axis=1)
+
+    return history[distance <= margin_days]
+
+def get_drift_report(df: pd.DataFrame, as_of=None, current_days=30, columns=None, seasonal=True, margin_days=15,
+                     ks_alpha=0.01, psi_threshold=0.25, psi_bins=5) -> pd.DataFrame:
+    """
+    Tests each column of a daily_aggregations data frame (target and covariates) for distribution drift: the
+    last current_days up to as_of (default: the last date) against the same season of earlier years (all
+    earlier data if not seasonal). A column has drifted if the two-sample Kolmogorov-Smirnov test (see
+    get_ks_test) rejects at ks_alpha and its population stability index over psi_bins quantile bins exceeds
+    psi_threshold beyond the sampling noise of the window (get_psi_noise).
+    """
+    as_of = pd.Timestamp(as_of) if as_of is not None else df.index.max()
+    columns = list(columns) if columns is not None else list(df.select_dtypes('number').columns)
+
+    current = df[(df.index > as_of - pd.Timedelta(days=current_days)) & (df.index <= as_of)]
+    reference = get_seasonal_reference(df, current.index, margin_days) if seasonal else df[df.index < current.index.min()]
+
+    rows = []
+    for column in columns:
+        reference_values, current_values = reference[column].dropna(), current[column].dropna()
+
+        if len(reference_values) < 2 or len(current_values) < 2:
+            rows.append({'column': column, 'ks_statistic': np.nan, 'ks_pvalue': np.nan, 'psi': np.nan,
+                         'psi_noise': np.nan, 'drifted': False})
+            continue
+
+        ks_statistic, ks_pvalue = get_ks_test(reference_values, current_values)
+        psi = get_psi(reference_values, current_values, psi_bins)
+        psi_noise = get_psi_noise(reference_values, current_values, psi_bins)
+
+        rows.append({'column': column, 'ks_statistic': round(ks_statistic, 4), 'ks_pvalue': ks_pvalue,
+                     'psi': round(psi, 4), 'psi_noise': round(psi_noise, 4),
+                     'drifted': bool(ks_pvalue < ks_alpha and psi - psi_noise > psi_threshold)})
+
+    return pd.DataFrame(rows).set_index('column')
+
+def get_rolling_errors(forecasts: pd.DataFrame, as_of=None, window_days=30, metric='rmse') -> pd.DataFrame:
+    """
+    Returns per model id, forecast horizon and outlier flag the error (metric 'rmse' or 'mae') of the stored
+    forecasts (evaluation_functions.load_forecasts) over the last window_days of actuals up to as_of, the
+    error over all earlier dates and their ratio.
+    """
+    forecasts = forecasts.dropna(subset=['actual'])
+    as_of = pd.Timestamp(as_of) if as_of is not None else forecasts['date'].max()
+    forecasts = forecasts[forecasts['date'] <= as_of]
+
+    errors = forecasts['actual'] - forecasts['prediction']
+    errors = errors**2 if metric == 'rmse' else errors.abs()
+    is_recent = forecasts['date'] > as_of - pd.Timedelta(days=window_days)
+
+    rolling_errors = forecasts.assign(recent=errors.where(is_recent), baseline=errors.where(~is_recent)).groupby(
+        ['model_id', 'forecast_horizon', 'has_outliers']).agg(recent_error=('recent', 'mean'),
+                                                               baseline_error=('baseline', 'mean'),
+                                                               n_recent=('recent', 'count'))
+
+    if metric == 'rmse':
+        rolling_errors[['recent_error', 'baseline_error']] = np.sqrt(rolling_errors[['recent_error', 'baseline_error']])
+
+    rolling_errors['error_ratio'] = rolling_errors['recent_error'] / rolling_errors['baseline_error']
+
+    return rolling_errors.reset_index()
+
+def get_cell_model_id(cell: dict) -> str:
+    """Returns the forecast store model id of a sweep cell, i.e. its pf.get_model moniker without the horizon."""
+    if cell['model_name'] == 'nbeats':
+        return f"{cell['model_name']}_{cell['model_type']}_{cell['version']}"
+    if cell['model_type'] == 'default' and cell['model_name'] in pf.non_ml_models:
+        return cell['model_name']
+
+    return f"{cell['model_name']}_{cell['model_type']}"
+
+def get_schedule_key(cell: dict) -> str:
+    return f"{get_cell_model_id(cell)}_fh{cell['fh']}_outliers-{cell['has_outliers']}"
+
+class RetrainingScheduler:
+    """
+    Decides which sweep cells to refit on a given day instead of retraining everything on every cutoff.
+    A cell is refitted if it was never fitted, if the target or covariates drifted (get_drift_report) in a way
+    they had not yet on the day it was last fitted, if its rolling forecast error grew by error_ratio_threshold
+    over its earlier error (get_rolling_errors) or if it was last fitted more than max_days_between_refits ago.
+    Drift is assessed on the data each cell trains on (the outlier or clean data), so a lasting shift triggers
+    one refit rather than one every day. Tuned models whose error grew by research_ratio_threshold get a new
+    hyperparameter search first, if a research function is given. The last fit date of every cell is kept in
+    state_file (json).
+    """
+    def __init__(self, state_file, current_days=30, ks_alpha=0.01, psi_threshold=0.25, error_window_days=30,
+                 error_ratio_threshold=1.2, research_ratio_threshold=1.5, max_days_between_refits=None,
+                 drift_columns=None):
+        self.state_file = state_file
+        self.current_days = current_days
+        self.ks_alpha = ks_alpha
+        self.psi_threshold = psi_threshold
+        self.error_window_days = error_window_days
+        self.error_ratio_threshold = error_ratio_threshold
+        self.research_ratio_threshold = research_ratio_threshold
+        self.max_days_between_refits = max_days_between_refits
+        self.drift_columns = drift_columns
+
+        self.state = {}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+
+    def get_decisions(self, cells: list, df_outliers: pd.DataFrame, df_clean: pd.DataFrame,
+                      forecasts: pd.DataFrame = None, as_of=None, research=True) -> pd.DataFrame:
+        """
+        Returns one row per cell with its action ('skip', 'refit' or 'research') and the reasons. df_outliers
+        and df_clean are the daily_aggregations data up to as_of, forecasts the stored forecasts with their
+        actuals (optional). Without research, tuned cells due a new search are refitted instead.
+        """
+        frames = {True: df_outliers, False: df_clean}
+        as_of = pd.Timestamp(as_of) if as_of is not None else max(df.index.max() for df in frames.values())
+        drift_reports = {}
+
+        def get_drifted_columns(has_outliers, date) -> list:
+            # one report per frame and date, shared by the cells fitted on the same day
+            if (has_outliers, date) not in drift_reports:
+                drift_report = get_drift_report(frames[has_outliers], date, self.current_days, self.drift_columns,
+                                                ks_alpha=self.ks_alpha, psi_threshold=self.psi_threshold)
+                drift_reports[(has_outliers, date)] = drift_report.index[drift_report['drifted']].tolist()
+
+            return drift_reports[(has_outliers, date)]
+
+        error_ratios = {}
+        if forecasts is not None:
+            rolling_errors = get_rolling_errors(forecasts, as_of, self.error_window_days)
+            error_ratios = {(row.model_id, row.forecast_horizon, row.has_outliers): row.error_ratio
+                            for row in rolling_errors.itertuples()}
+
+        rows = []
+        for cell in cells:
+            last_fit = self.state.get(get_schedule_key(cell))
+            error_ratio = error_ratios.get((get_cell_model_id(cell), cell['fh'], cell['has_outliers']), np.nan)
+            is_research_due = cell['model_type'] == 'tuned' and error_ratio > self.research_ratio_threshold
+            reasons = []
+
+            # a drift the data already showed when the cell was last fitted is in its training data
+            drifted_columns = get_drifted_columns(cell['has_outliers'], as_of)
+            if drifted_columns and last_fit is not None:
+                drifted_at_fit = get_drifted_columns(cell['has_outliers'], pd.Timestamp(last_fit))
+                drifted_columns = [column for column in drifted_columns if column not in drifted_at_fit]
+
+            if last_fit is None:
+                reasons.append('never fitted')
+            if drifted_columns:
+                reasons.append(f"drift in {', '.join(drifted_columns)}")
+            if error_ratio > self.error_ratio_threshold or is_research_due:
+                reasons.append(f'error ratio {error_ratio:.2f}')
+            if (last_fit is not None and self.max_days_between_refits is not None
+                    and (as_of - pd.Timestamp(last_fit)).days > self.max_days_between_refits):
+                reasons.append(f'last fitted {last_fit}')
+
+            if research and is_research_due:
+                action = 'research'
+            else:
+                action = 'refit' if reasons else 'skip'
+
+            rows.append({**cell, 'action': action, 'reasons': '; '.join(reasons), 'error_ratio': error_ratio,
+                         'last_fit': last_fit})
+
+        return pd.DataFrame(rows)
+
+    def record_fit(self, cell: dict, as_of):
+        self.state[get_schedule_key(cell)] = str(pd.Timestamp(as_of).date())
+
+        state_directory = os.path.dirname(self.state_file)
+        if state_directory and not os.path.exists(state_directory):
+            os.makedirs(state_directory)
+        cf.write_json_atomic(self.state, self.state_file)
+
+    def run(self, cells: list, as_of, df_outliers, df_clean, forecasts: pd.DataFrame = None, research_function=None,
+            **sweep_kwargs) -> pd.DataFrame:
+        """
+        Refits the cells that need it at cutoff date as_of with sweep_functions.run_sweep; sweep_kwargs are its
+        arguments from hyperparameters on. Drift and errors are assessed on data up to as_of only; run_experiment
+        scores the refits on the days after it. research_function(cell) is called for cells due a new
+        hyperparameter search (e.g. a wrapper around hs.hyperparameter_search updating the hyperparameters passed
+        on to run_sweep) before they are refitted. Returns the decisions.
+        """
+        as_of = pd.Timestamp(as_of)
+        if forecasts is not None:
+            forecasts = forecasts[forecasts['date'] <= as_of]
+
+        decisions = self.get_decisions(cells, df_outliers[df_outliers.index <= as_of],
+                                       df_clean[df_clean.index <= as_of], forecasts, as_of,
+                                       research=research_function is not None)
+        due_cells = [({**cell, 'cutoff_date': str(as_of.date())}, action)
+                     for cell, action in zip(cells, decisions['action']) if action != 'skip']
+
+        if research_function is not None:
+            print(f'{as_of.date()}: {len(due_cells)} of {len(cells)} cells due for refit '
+                  f"({sum(action == 'research' for _, action in due_cells)} with hyperparameter search)")
+
+            for cell, action in due_cells:
+                if action == 'research':
+                    research_function(cell)
+
+        else:
+            print(f'{as_of.date()}: {len(due_cells)} of {len(cells)} cells due for refit')
+
+        if due_cells:
+            sf.run_sweep([cell for cell, _ in due_cells], df_outliers=df_outliers, df_clean=df_clean, **sweep_kwargs)
+
+            for cell, _ in due_cells:
+                marker = sf.get_cell_status(sweep_kwargs['manifest_directory'], cell)
+                if marker is not None and marker['status'] == 'completed':
+                    self.record_fit(cell, as_of)
+
+        return decisions
@@ -0,0 +1,450 @@
+import glob
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+
+
+key_columns = ['model_id', 'forecast_horizon', 'has_outliers', 'cutoff_date']
+
+
+def get_forecast_store_file(store_directory, cutoff_date, model_name_fh, has_outliers) -> str:
+    return os.path.join(store_directory, f'cutoff_date={cutoff_date}', f'{model_name_fh}_outliers-{has_outliers}.parquet')
+
+def get_quantile_column(quantile) -> str:
+    return f'q{quantile:g}'
+
+def get_quantile_columns(forecasts: pd.DataFrame) -> dict:
+    """Returns {quantile: column} of the quantile forecast columns of stored forecasts, in quantile order."""
+    quantiles = sorted(float(column[1:]) for column in forecasts.columns if re.fullmatch(r'q[0-9.e-]+', column))
+
+    return {quantile: get_quantile_column(quantile) for quantile in quantiles}
+
+def save_forecasts(store_directory, predictions, actuals, model_names, fh, cutoff_date, has_outliers,
+                   quantile_predictions=None) -> str:
+    """
+    Persists the predictions of one experiment with their matching actuals, one row per forecast step and
+    component, to {store_directory}cutoff_date={cutoff_date}/{model_name_fh}_outliers-{has_outliers}.parquet.
+    model_names is [model_name, model_name_proper, model_name_fh] as passed to run_experiment.
+    quantile_predictions ({quantile: array of shape (n_steps, n_components)}) are stored as q{quantile} columns.
+    """
+    model_name, model_name_proper, model_name_fh = model_names
+
+    prediction_values = predictions.values(copy=False)
+    actual_values = actuals.slice_intersect(predictions).values(copy=False)
+    n_steps, n_components = prediction_values.shape
+
+    forecasts = pd.DataFrame({
+        'model_name': model_name,
+        'model_name_proper': model_name_proper,
+        'model_name_fh': model_name_fh,
+        'model_id': model_name_fh.rsplit('_fh', 1)[0],
+        'forecast_horizon': fh,
+        'has_outliers': has_outliers,
+        'cutoff_date': str(cutoff_date),
+        'date': np.repeat(predictions.time_index, n_components),
+        'step': np.repeat(np.arange(1, n_steps + 1), n_components),
+        'component': np.tile(predictions.components, n_steps),
+        'prediction': prediction_values.ravel(),
+        'actual': actual_values.ravel()
+    })
+
+    for quantile, values in (quantile_predictions or {}).items():
+        forecasts[get_quantile_column(quantile)] = np.asarray(values, dtype=np.float64).ravel()
+
+    file = get_forecast_store_file(store_directory, cutoff_date, model_name_fh, has_outliers)
+    if not os.path.exists(os.path.dirname(file)):
+        os.makedirs(os.path.dirname(file))
+
+    forecasts.to_parquet(file, index=False)
+
+    return file
+
+def load_forecasts(store_directory, model_ids=None, forecast_horizons=None, cutoff_dates=None,
+                   has_outliers=None) -> pd.DataFrame:
+    """Returns the stored forecasts, optionally filtered, sorted by experiment and forecast step."""
+    if cutoff_dates is None:
+        files = glob.glob(os.path.join(store_directory, 'cutoff_date=*', '*.parquet'))
+    else:
+        files = [file for cutoff_date in cutoff_dates
+                 for file in glob.glob(os.path.join(store_directory, f'cutoff_date={cutoff_date}', '*.parquet'))]
+
+    if not files:
+        raise ValueError(f'No forecasts found in {store_directory}')
+
+    forecasts = pd.concat([pd.read_parquet(file) for file in sorted(files)], ignore_index=True)
+
+    if model_ids is not None:
+        forecasts = forecasts[forecasts['model_id'].isin(model_ids)]
+    if forecast_horizons is not None:
+        forecasts = forecasts[forecasts['forecast_horizon'].isin(forecast_horizons)]
+    if has_outliers is not None:
+        forecasts = forecasts[forecasts['has_outliers'] == has_outliers]
+
+    return forecasts.sort_values(key_columns + ['step', 'component']).reset_index(drop=True)
+
+def get_forecast_arrays(forecasts: pd.DataFrame, horizon=None):
+    """
+    Returns (keys, predictions, actuals) for forecasts of a single forecast horizon, where predictions and
+    actuals are (n_experiments, n_steps * n_components) arrays and keys the matching experiment rows.
+    horizon keeps only the first horizon steps, e.g. to score 28-day forecasts at 7 days.
+    """
+    if forecasts['forecast_horizon'].nunique() > 1:
+        raise ValueError('Forecasts of several horizons have different lengths, select one forecast horizon')
+
+    if horizon is not None:
+        forecasts = forecasts[forecasts['step'] <= horizon]
+
+    forecasts = forecasts.sort_values(key_columns + ['step', 'component'])
+    keys = forecasts.drop_duplicates(key_columns)[key_columns + ['model_name', 'model_name_proper']]
+    keys = keys.reset_index(drop=True)
+
+    predictions = forecasts['prediction'].to_numpy(dtype=np.float64).reshape(len(keys), -1)
+    actuals = forecasts['actual'].to_numpy(dtype=np.float64).reshape(len(keys), -1)
+
+    return keys, predictions, actuals
+
+def rmse_rows(actuals, predictions):
+    return np.sqrt(np.mean((actuals - predictions) ** 2, axis=1))
+
+def mae_rows(actuals, predictions):
+    return np.mean(np.abs(actuals - predictions), axis=1)
+
+def bias_rows(actuals, predictions):
+    return np.mean(predictions - actuals, axis=1)
+
+def mape_rows(actuals, predictions):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 * np.mean(np.abs((actuals - predictions) / actuals), axis=1)
+
+def smape_rows(actuals, predictions):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 200 * np.mean(np.abs(actuals - predictions) / (np.abs(actuals) + np.abs(predictions)), axis=1)
+
+error_metrics = {
+    'rmse': rmse_rows,
+    'mae': mae_rows,
+    'bias': bias_rows,
+    'mape': mape_rows,
+    'smape': smape_rows
+}
+
+def compute_metrics(forecasts: pd.DataFrame, metrics=('rmse', 'mae'), horizon=None, decimals=4) -> pd.DataFrame:
+    """
+    Scores every stored experiment without refitting. metrics are names in error_metrics or functions taking
+    (actuals, predictions) arrays of shape (n_experiments, n_steps) and returning one value per row.
+    horizon scores only the first horizon steps of each forecast.
+    """
+    metric_functions = {metric if isinstance(metric, str) else metric.__name__:
+                        error_metrics[metric] if isinstance(metric, str) else metric for metric in metrics}
+    scores = []
+
+    for _, horizon_forecasts in forecasts.groupby('forecast_horizon'):
+        keys, predictions, actuals = get_forecast_arrays(horizon_forecasts, horizon)
+
+        for metric_name, metric_function in metric_functions.items():
+            keys[metric_name] = np.round(metric_function(actuals, predictions), decimals)
+
+        scores.append(keys)
+
+    return pd.concat(scores, ignore_index=True)
+
+def pinball_rows(actuals, quantile_predictions, quantiles):
+    """
+    Returns the mean pinball loss per row and quantile, shape (n_rows, n_quantiles), of quantile_predictions of
+    shape (n_rows, n_steps, n_quantiles) against actuals of shape (n_rows, n_steps).
+    """
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    errors = actuals[:, :, np.newaxis] - quantile_predictions
+
+    return np.mean(np.maximum(quantiles * errors, (quantiles - 1) * errors), axis=1)
+
+def crps_rows_from_quantiles(actuals, quantile_predictions, quantiles):
+    """
+    Approximates the CRPS per row as twice the pinball loss integrated over the quantile levels (trapezoidal rule
+    over the given quantiles, which should span most of (0, 1)).
+    """
+    pinball = pinball_rows(actuals, quantile_predictions, quantiles)
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+
+    if len(quantiles) == 1:
+        return 2 * pinball[:, 0]
+
+    areas = (pinball[:, 1:] + pinball[:, :-1]) / 2 @ np.diff(quantiles)
+
+    return 2 * areas / (quantiles[-1] - quantiles[0])
+
+def crps_rows_from_samples(actuals, samples):
+    """
+    Returns the sample CRPS per row, E|X - y| - E|X - X'| / 2 averaged over the steps, of samples of shape
+    (n_rows, n_steps, n_samples). The pairwise term is computed from the sorted samples in O(n log n).
+    """
+    n_samples = samples.shape[2]
+    sorted_samples = np.sort(samples, axis=2)
+    weights = 2 * np.arange(1, n_samples + 1) - n_samples - 1
+
+    absolute_error = np.mean(np.abs(sorted_samples - actuals[:, :, np.newaxis]), axis=2)
+    spread = 2 * np.sum(sorted_samples * weights, axis=2) / n_samples**2
+
+    return np.mean(absolute_error - spread / 2, axis=1)
+
+def compute_probabilistic_metrics(forecasts: pd.DataFrame, horizon=None, decimals=4) -> pd.DataFrame:
+    """
+    Scores the stored quantile forecasts (experiments saved with quantile_predictions): the CRPS approximated
+    from the quantiles, the mean pinball loss over all quantiles, the pinball loss per quantile and the
+    coverage of the interval between the lowest and highest quantile. horizon scores only the first horizon
+    steps of each forecast.
+    """
+    quantile_columns = get_quantile_columns(forecasts)
+    if not quantile_columns:
+        raise ValueError('The forecasts have no quantile columns, run the experiments with quantiles')
+
+    forecasts = forecasts.dropna(subset=list(quantile_columns.values()))
+    quantiles = list(quantile_columns)
+    scores = []
+
+    for _, horizon_forecasts in forecasts.groupby('forecast_horizon'):
+        keys, _, actuals = get_forecast_arrays(horizon_forecasts, horizon)
+
+        if horizon is not None:
+            horizon_forecasts = horizon_forecasts[horizon_forecasts['step'] <= horizon]
+        horizon_forecasts = horizon_forecasts.sort_values(key_columns + ['step', 'component'])
+        quantile_predictions = horizon_forecasts[list(quantile_columns.values())].to_numpy(dtype=np.float64)
+        quantile_predictions = quantile_predictions.reshape(len(keys), -1, len(quantiles))
+
+        pinball = pinball_rows(actuals, quantile_predictions, quantiles)
+        keys['crps'] = np.round(crps_rows_from_quantiles(actuals, quantile_predictions, quantiles), decimals)
+        keys['pinball'] = np.round(pinball.mean(axis=1), decimals)
+
+        for i, column in enumerate(quantile_columns.values()):
+            keys[f'pinball_{column}'] = np.round(pinball[:, i], decimals)
+
+        if len(quantiles) > 1:
+            is_covered = (actuals >= quantile_predictions[:, :, 0]) & (actuals <= quantile_predictions[:, :, -1])
+            keys[f'coverage_{quantiles[0]:g}-{quantiles[-1]:g}'] = np.round(is_covered.mean(axis=1), decimals)
+
+        scores.append(keys)
+
+    return pd.concat(scores, ignore_index=True)
+
+def get_inverse_error_weights(scores: pd.DataFrame, metric='rmse', by='model_id') -> dict:
+    """Returns ensemble weights proportional to the inverse mean error of each model, summing to 1."""
+    inverse_errors = 1 / scores.groupby(by)[metric].mean()
+
+    return (inverse_errors / inverse_errors.sum()).to_dict()
+
+def ensemble_forecasts(forecasts: pd.DataFrame, members=None, weights=None, model_id='ensemble',
+                       model_name_proper='Ensemble') -> pd.DataFrame:
+    """
+    Returns the weighted mean forecast of the member models (model ids, default all) for every experiment
+    where all members have forecasts, in the stored forecast format so it can be scored with compute_metrics
+    or concatenated to the stored forecasts. weights maps model ids to weights; default is a simple average.
+    Quantile forecasts are not combined.
+    """
+    members = list(members) if members is not None else sorted(forecasts['model_id'].unique())
+    weights = weights or {member: 1 for member in members}
+    weight_vector = np.array([weights[member] for member in members], dtype=np.float64)
+    weight_vector = weight_vector / weight_vector.sum()
+
+    index_columns = ['forecast_horizon', 'has_outliers', 'cutoff_date', 'date', 'step', 'component']
+
+    member_forecasts = forecasts[forecasts['model_id'].isin(members)]
+    predictions = member_forecasts.pivot_table(index=index_columns, columns='model_id',
+                                               values='prediction').reindex(columns=members).dropna()
+    actuals = member_forecasts.groupby(index_columns)['actual'].first().loc[predictions.index]
+
+    ensemble = predictions.index.to_frame(index=False)
+    ensemble['prediction'] = predictions.to_numpy() @ weight_vector
+    ensemble['actual'] = actuals.to_numpy()
+    ensemble['model_name'] = model_id
+    ensemble['model_name_proper'] = model_name_proper
+    ensemble['model_id'] = model_id
+    ensemble['model_name_fh'] = model_id + '_fh' + ensemble['forecast_horizon'].astype(str)
+
+    return ensemble[[column for column in forecasts.columns if column in ensemble.columns]]
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy: values are counted in logarithmic buckets, so any
+    quantile is returned within relative_accuracy of an actual value. Memory grows with the log of the
+    value range, not the number of values.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self._gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+
+        for store, store_values in [(self.positive, values[values > 0]), (self.negative, -values[values < 0])]:
+            buckets, counts = np.unique(np.ceil(np.log(store_values) / self._log_gamma).astype(np.int64),
+                                        return_counts=True)
+            for bucket, count in zip(buckets.tolist(), counts.tolist()):
+                store[bucket] = store.get(bucket, 0) + count
+
+        self.zero_count += int(np.sum(values == 0))
+        self.count += len(values)
+
+    def merge(self, other):
+        for store, other_store in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for bucket, count in other_store.items():
+                store[bucket] = store.get(bucket, 0) + count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+
+        # (sign, bucket) in ascending order of value: negative buckets by descending magnitude, zeros, positive
+        buckets = ([(-1, bucket, count) for bucket, count in sorted(self.negative.items(), reverse=True)]
+                   + [(0, 0, self.zero_count)] + [(1, bucket, count) for bucket, count in sorted(self.positive.items())])
+        rank = q * (self.count - 1)
+        seen = 0
+
+        for sign, bucket, count in buckets:
+            seen += count
+            if seen > rank:
+                return sign * 2 * self._gamma ** bucket / (self._gamma + 1)
+
+    def to_dict(self) -> dict:
+        return {'relative_accuracy': self.relative_accuracy, 'positive': self.positive, 'negative': self.negative,
+                'zero_count': self.zero_count, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        sketch = cls(data['relative_accuracy'])
+        sketch.positive = {int(bucket): count for bucket, count in data['positive'].items()}
+        sketch.negative = {int(bucket): count for bucket, count in data['negative'].items()}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        return sketch
+
+class ResultsAggregator:
+    """
+    Incrementally maintained aggregates (count, mean and a median sketch) of the error metrics of run_experiment
+    result rows, keyed by model id, model type, outlier flag and forecast horizon. Rows can be added one at a
+    time or in batches across any number of cutoffs, and error tables are built from the aggregates only.
+    """
+    group_columns = ['model_id', 'model_type', 'has_outliers', 'forecast_horizon']
+
+    def __init__(self, metrics=('rmse', 'mae'), relative_accuracy=0.01):
+        self.metrics = list(metrics)
+        self.relative_accuracy = relative_accuracy
+        self.aggregates = {}
+        self.model_names_proper = {}
+
+    def update(self, rows):
+        """Adds result rows: a results dict of lists, a list of row dicts or a DataFrame."""
+        rows = pd.DataFrame(rows)
+        if rows.empty:
+            return
+
+        rows = rows.assign(model_id=rows['model_name_fh'].str.rsplit('_fh', n=1).str[0])
+        self.model_names_proper.update(zip(rows['model_id'], rows['model_name_proper']))
+
+        for key, group in rows.groupby(self.group_columns):
+            key = tuple(value.item() if hasattr(value, 'item') else value for value in key)
+
+            if key not in self.aggregates:
+                self.aggregates[key] = {metric: {'count': 0, 'sum': 0.0, 'sketch': QuantileSketch(self.relative_accuracy)}
+                                        for metric in self.metrics}
+
+            for metric in self.metrics:
+                values = group[metric].to_numpy(dtype=np.float64)
+                values = values[~np.isnan(values)]
+                aggregate = self.aggregates[key][metric]
+                aggregate['count'] += len(values)
+                aggregate['sum'] += float(values.sum())
+                aggregate['sketch'].add(values)
+
+    def get_summary(self, metric='rmse') -> pd.DataFrame:
+        """Returns one row per key with the count, mean and median of the metric."""
+        summary = pd.DataFrame([{**dict(zip(self.group_columns, key)),
+                                 'count': aggregate[metric]['count'],
+                                 'mean': aggregate[metric]['sum'] / aggregate[metric]['count'] if aggregate[metric]['count'] else np.nan,
+                                 'median': aggregate[metric]['sketch'].quantile(0.5)}
+                                for key, aggregate in self.aggregates.items()])
+
+        summary.insert(1, 'model_name_proper', summary['model_id'].map(self.model_names_proper))
+
+        return summary
+
+    def get_error_table(self, metric='rmse', horizons=None, statistic='mean', outlier_split=True, decimals=4):
+        """
+        Returns the error table of generate_error_table straight from the aggregates: one row per model and
+        outlier flag, one FH-{h} column per horizon (default: all recorded horizons) holding the mean or median
+        metric over all cutoffs, and the median and mean over the horizon columns.
+        """
+        summary = self.get_summary(metric)
+        horizons = sorted(summary['forecast_horizon'].unique()) if horizons is None else list(horizons)
+
+        error_table = summary[summary['forecast_horizon'].isin(horizons)]\
+                        .pivot_table(index=['has_outliers', 'model_id', 'model_type'], columns='forecast_horizon',
+                                     values=statistic)\
+                        .reindex(columns=horizons)
+        error_table.columns = [f'FH-{horizon}' for horizon in horizons]
+        error_table = error_table.sort_index(level=['has_outliers', 'model_id'], ascending=[False, True]).reset_index()
+
+        horizon_columns = [f'FH-{horizon}' for horizon in horizons]
+        error_table['Median'] = error_table[horizon_columns].median(axis=1)
+        error_table['Mean'] = error_table[horizon_columns].mean(axis=1)
+        error_table = error_table.round(decimals)
+
+        if outlier_split:
+            return (error_table[error_table['has_outliers'] == True].reset_index(drop=True),
+                    error_table[error_table['has_outliers'] == False].reset_index(drop=True))
+        return error_table
+
+    def merge(self, other):
+        """Adds the aggregates of another ResultsAggregator, e.g. one filled by another worker."""
+        for key, aggregates in other.aggregates.items():
+            if key not in self.aggregates:
+                self.aggregates[key] = {metric: {'count': 0, 'sum': 0.0, 'sketch': QuantileSketch(self.relative_accuracy)}
+                                        for metric in self.metrics}
+
+            for metric in self.metrics:
+                self.aggregates[key][metric]['count'] += aggregates[metric]['count']
+                self.aggregates[key][metric]['sum'] += aggregates[metric]['sum']
+                self.aggregates[key][metric]['sketch'].merge(aggregates[metric]['sketch'])
+
+        self.model_names_proper.update(other.model_names_proper)
+
+    def save(self, file):
+        data = {
+            'metrics': self.metrics,
+            'relative_accuracy': self.relative_accuracy,
+            'model_names_proper': self.model_names_proper,
+            'aggregates': [{'key': list(key),
+                            **{metric: {'count': aggregate[metric]['count'], 'sum': aggregate[metric]['sum'],
+                                        'sketch': aggregate[metric]['sketch'].to_dict()}
+                               for metric in self.metrics}}
+                           for key, aggregate in self.aggregates.items()]
+        }
+
+        with open(file, 'w') as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, file):
+        with open(file) as f:
+            data = json.load(f)
+
+        aggregator = cls(data['metrics'], data['relative_accuracy'])
+        aggregator.model_names_proper = data['model_names_proper']
+
+        for entry in data['aggregates']:
+            aggregator.aggregates[tuple(entry['key'])] = {
+                metric: {'count': entry[metric]['count'], 'sum': entry[metric]['sum'],
+                         'sketch': QuantileSketch.from_dict(entry[metric]['sketch'])}
+                for metric in aggregator.metrics}
+
+        return aggregator
@@ -0,0 +1,214 @@
+from concurrent.futures import ProcessPoolExecutor
+from darts import TimeSeries
+from darts.utils.timeseries_generation import datetime_attribute_timeseries as dt_attr
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+from statsmodels.tsa.seasonal import STL
+
+
+def get_calendar_features(index: pd.DatetimeIndex) -> pd.DataFrame:
+    """Returns cyclic day-of-year, month (0-11) and meteorological season (0 = DJF, ..., 3 = SON) encodings."""
+    day_of_year = dt_attr(index, attribute='day_of_year', cyclic=True, dtype=np.float32)
+    month = dt_attr(index, attribute='month', dtype=np.float32)
+
+    features = pd.DataFrame(day_of_year.values(copy=False), index=index, columns=list(day_of_year.components))
+    features['month'] = month.values(copy=False)[:, 0]
+    features['season'] = (index.month % 12) // 3
+
+    return features
+
+def build_feature_store(df: pd.DataFrame, columns=None, rolling_windows=(7, 30), lags=(1, 7)) -> dict:
+    """
+    Precomputes the covariate features of one station's daily data (date index) once: the raw columns (default
+    all but the target), calendar encodings, trailing rolling means and standard deviations of each column and
+    lagged 7-day means. Returns {'index', 'names', 'groups', 'values', 'fingerprint'} where values is a contiguous
+    float32 array (n_dates, n_features) aligned to the index, for get_feature_ts to select from by name.
+    Calendar features are known in advance and can be used as future covariates, the others are past covariates.
+    Rolling statistics use the available days at the start of the series. Lagged means are forward filled and,
+    in the first lag days, fall back to the latest weekly mean of that day, so that no feature looks ahead.
+    """
+    settings = get_feature_settings(df, columns, rolling_windows, lags)
+    raw = df[settings['columns']].astype(np.float64)
+
+    groups = {'raw': raw}
+    groups['calendar'] = get_calendar_features(df.index)
+
+    rolling = []
+    for window in rolling_windows:
+        window_rolling = raw.rolling(window, min_periods=1)
+        rolling.append(window_rolling.mean().add_suffix(f'_roll{window}_mean'))
+        rolling.append(window_rolling.std().fillna(0).add_suffix(f'_roll{window}_std'))
+    groups['rolling'] = pd.concat(rolling, axis=1)
+
+    weekly_mean = raw.rolling(7, min_periods=1).mean()
+    groups['lagged'] = pd.concat([weekly_mean.shift(lag).ffill().fillna(weekly_mean.ffill())
+                                  .add_suffix(f'_roll7_mean_lag{lag}') for lag in lags], axis=1)
+
+    features = pd.concat(groups.values(), axis=1)
+
+    return {
+        'index': df.index,
+        'names': list(features.columns),
+        'groups': {group: list(group_features.columns) for group, group_features in groups.items()},
+        'values': np.ascontiguousarray(features.to_numpy(dtype=np.float32)),
+        'fingerprint': get_df_fingerprint(df, **settings)
+    }
+
+def get_feature_settings(df: pd.DataFrame, columns=None, rolling_windows=(7, 30), lags=(1, 7)) -> dict:
+    """Returns the resolved build_feature_store settings, columns defaulting to all but the target."""
+    columns = list(columns) if columns is not None else [column for column in df.columns if column != 'sunshine_hr']
+
+    # version changes with the feature definitions, so that stores cached by earlier versions are rebuilt
+    return {'columns': columns, 'rolling_windows': list(rolling_windows), 'lags': list(lags), 'version': 2}
+
+def get_df_fingerprint(df: pd.DataFrame, **settings) -> str:
+    """Returns a sha256 digest of the values, index and columns of df and the given settings."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(df.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(df.index.values.astype('datetime64[ns]').tobytes())
+    digest.update(json.dumps([list(map(str, df.columns)), settings], sort_keys=True, default=str).encode())
+
+    return digest.hexdigest()
+
+def save_feature_store(store: dict, file):
+    np.savez(file, values=store['values'], index=store['index'].values.astype('datetime64[ns]'),
+             names=np.array(store['names']), groups=json.dumps(store['groups']), fingerprint=store['fingerprint'])
+
+def load_feature_store(file) -> dict:
+    with np.load(file) as data:
+        return {
+            'index': pd.DatetimeIndex(data['index'], name='date', freq='infer'),
+            'names': data['names'].tolist(),
+            'groups': json.loads(str(data['groups'])),
+            'values': np.ascontiguousarray(data['values']),
+            'fingerprint': str(data['fingerprint'])
+        }
+
+def get_feature_store(df: pd.DataFrame, cache_file=None, **kwargs) -> dict:
+    """
+    Returns the feature store of df, loaded from cache_file (.npz) if it was built from the same data and
+    settings, else built and saved there. kwargs are passed on to build_feature_store.
+    """
+    if cache_file is not None and os.path.exists(cache_file):
+        store = load_feature_store(cache_file)
+
+        if store['fingerprint'] == get_df_fingerprint(df, **get_feature_settings(df, **kwargs)):
+            return store
+
+    store = build_feature_store(df, **kwargs)
+
+    if cache_file is not None:
+        cache_directory = os.path.dirname(cache_file)
+        if cache_directory and not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+        save_feature_store(store, cache_file)
+
+    return store
+
+def get_feature_stores(df_outliers, df_clean, cache_directory=None, **kwargs) -> dict:
+    """Returns the feature stores of the outlier and clean data, keyed by has_outliers as used by train_test_split."""
+    return {
+        has_outliers: get_feature_store(
+            df, os.path.join(cache_directory, f'features_outliers-{has_outliers}.npz') if cache_directory else None,
+            **kwargs)
+        for has_outliers, df in [(True, df_outliers), (False, df_clean)]
+    }
+
+def get_feature_names(store: dict, groups=('raw',)) -> list:
+    """Returns the names of the features in the given groups ('raw', 'calendar', 'rolling', 'lagged')."""
+    return [name for group in groups for name in store['groups'][group]]
+
+def get_feature_ts(store: dict, names: list, start=None, end=None) -> TimeSeries:
+    """Returns the named features as a float32 TimeSeries, optionally sliced to [start, end]."""
+    positions = [store['names'].index(name) for name in names]
+    start_position = store['index'].searchsorted(pd.Timestamp(start)) if start is not None else None
+    end_position = store['index'].searchsorted(pd.Timestamp(end), side='right') if end is not None else None
+
+    return TimeSeries.from_times_and_values(store['index'][start_position:end_position],
+                                            store['values'][start_position:end_position, positions],
+                                            columns=names)
+
+def get_decomposition_key(series: pd.Series, period, **stl_kwargs) -> str:
+    """Returns the cache key of an STL decomposition: a sha256 digest of the series, period and STL settings."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(series.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(series.index.values.astype('datetime64[ns]').tobytes())
+    digest.update(json.dumps({'period': period, **stl_kwargs}, sort_keys=True, default=str).encode())
+
+    return digest.hexdigest()
+
+def decompose(series: pd.Series, period, **stl_kwargs) -> pd.DataFrame:
+    """Returns the observed, trend, seasonal and resid components of a statsmodels STL fit."""
+    decomposition = STL(series, period=period, **stl_kwargs).fit()
+
+    return pd.DataFrame({'observed': decomposition.observed, 'trend': decomposition.trend,
+                         'seasonal': decomposition.seasonal, 'resid': decomposition.resid}, index=series.index)
+
+def _decompose_job(job):
+    series, period, stl_kwargs = job
+    return decompose(series, period, **stl_kwargs)
+
+def get_decompositions(frames: dict, columns=None, periods=(7, 365), cache_directory=None, n_workers=None,
+                       mp_context='spawn', **stl_kwargs) -> dict:
+    """
+    Returns STL decompositions for every (series name, column, period) combination of frames, a dict of
+    DataFrames with a date index (e.g. one per station), keyed by that tuple. Decompositions are read from
+    cache_directory when the data and settings are unchanged; the rest are fitted in a process pool of n_workers
+    (default: CPU count) and cached as parquet.
+    """
+    keys, jobs, cache_files = [], [], []
+    decompositions = {}
+
+    for series_name, df in frames.items():
+        for column in (columns if columns is not None else df.columns):
+            for period in periods:
+                series = df[column].astype(np.float64)
+                cache_file = None
+
+                if cache_directory is not None:
+                    cache_file = os.path.join(cache_directory, f'{get_decomposition_key(series, period, **stl_kwargs)}.parquet')
+
+                    if os.path.exists(cache_file):
+                        decompositions[(series_name, column, period)] = pd.read_parquet(cache_file)
+                        continue
+
+                keys.append((series_name, column, period))
+                jobs.append((series, period, stl_kwargs))
+                cache_files.append(cache_file)
+
+    n_workers = min(n_workers or os.cpu_count(), len(jobs))
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(mp_context)) as executor:
+            results = list(executor.map(_decompose_job, jobs, chunksize=max(1, len(jobs) // (4 * n_workers))))
+    else:
+        results = [_decompose_job(job) for job in jobs]
+
+    if cache_directory is not None and not os.path.exists(cache_directory):
+        os.makedirs(cache_directory)
+
+    for key, decomposition, cache_file in zip(keys, results, cache_files):
+        decompositions[key] = decomposition
+
+        if cache_file is not None:
+            # write then rename, so parallel sweeps never read a partial file
+            tmp_file = f'{cache_file}.tmp{os.getpid()}'
+            decomposition.to_parquet(tmp_file)
+            os.replace(tmp_file, cache_file)
+
+    return decompositions
+
+def get_decomposition(df: pd.DataFrame, column, period, cache_directory=None, **stl_kwargs) -> pd.DataFrame:
+    """Returns the (cached) STL decomposition of one column."""
+    return get_decompositions({None: df}, [column], [period], cache_directory, n_workers=1, **stl_kwargs)[(None, column, period)]
+
+def get_seasonally_adjusted_df(df: pd.DataFrame, columns, period, cache_directory=None, **stl_kwargs) -> pd.DataFrame:
+    """Returns the columns with their (cached) STL seasonal component removed, e.g. as trend-adjusted covariates."""
+    decompositions = get_decompositions({None: df}, columns, [period], cache_directory, **stl_kwargs)
+
+    return pd.DataFrame({f'{column}_adjusted': df[column] - decompositions[(None, column, period)]['seasonal']
+                         for column in columns}, index=df.index)
@@ -7,11 +7,17 @@ import logging
 logging.disable(logging.CRITICAL)
 
 import datetime
+from concurrent.futures import as_completed, ProcessPoolExecutor
 from IPython.display import display
 import json
+import multiprocessing
 import numpy as np
+import os
 import pandas as pd
 from project_code import processing_functions as pf
+from project_code import feature_functions as ff
+from project_code import telemetry_functions as tf
+import socket
 import time
 
 from darts.dataprocessing.transformers import Scaler
@@ -28,16 +34,35 @@ import torch
 
 
 def get_error_score(model, fh:int, common_inputs: dict, mode: str='hyperparam_search', 
-                    error_metric: str='rmse', scaled_inputs=True):
+                    error_metric: str='rmse', scaled_inputs=True, n_folds: int=5, step: int=None,
+                    executor=None, n_workers: int=None, trial: optuna.Trial=None, telemetry=None):
     
-    """Generates an error score based on the given inputs."""
+    """
+    Generates an error score based on the given inputs.
+
+    mode='hyperparam_search' fits on the training data and scores the first fh points of the test data.
+    mode='cv' averages n_folds expanding-window folds whose origins are spaced step points apart (default fh),
+    the last fold being the single holdout above. mode='experiments' uses the same engine with origins moving
+    forward through the test data from the cutoff, which requires 'target_full'/'cov_full' in the scaled and
+    unscaled data (see get_common_inputs). Folds run in the given executor (see get_fold_executor), or in a
+    temporary pool of n_workers processes; if a trial is given, the running mean is reported after each
+    fold so that Optuna can prune the trial early. A telemetry_functions.TelemetryExporter is kept informed of
+    the fold pool's utilization and queue depth.
+    """
+
+    fit_kwargs = {}
+    cpu_callback = pf.get_callback(model, pf.CPUPerformanceCallback)
+
+    if cpu_callback is not None:
+        fit_kwargs['dataloader_kwargs'] = cpu_callback.dataloader_kwargs
 
     if mode == 'hyperparam_search':
 
         if scaled_inputs == True:
             model.fit(
                     series=common_inputs['scaled_data']['target_train'],
-                    past_covariates=common_inputs['scaled_data']['cov_train']
+                    past_covariates=common_inputs['scaled_data']['cov_train'],
+                    **fit_kwargs
                     )
             predictions = model.predict(
                                         n=fh,
@@ -51,6 +76,7 @@ def get_error_score(model, fh:int, common_inputs: dict, mode: str='hyperparam_se
             model.fit(
                     series=common_inputs['unscaled_data']['target_train'],
                     past_covariates=common_inputs['unscaled_data']['cov_train'],
+                    **fit_kwargs
                     )
             predictions = model.predict(n=fh,
                                         series=common_inputs['unscaled_data']['target_train'],
@@ -62,24 +88,231 @@ def get_error_score(model, fh:int, common_inputs: dict, mode: str='hyperparam_se
         elif error_metric == 'mae':
             score = mae(predictions, common_inputs['target_test'][:fh])
 
-    elif mode == 'experiments':
-        pass #TODO: incorporate model evaluation function for experiments in future version
+    elif mode in ['cv', 'experiments']:
+        n_train = len(common_inputs['unscaled_data']['target_train'])
+        origins = get_fold_origins(n_train, fh, n_folds, step, mode)
+
+        if mode == 'experiments':
+            n_available = len(common_inputs['unscaled_data'].get('target_full', []))
+            if origins[-1] + fh > n_available:
+                raise ValueError(f'The experiments mode needs {origins[-1] + fh} points of target_full/cov_full, '
+                                 f'{n_available} available. Build common_inputs with get_common_inputs.')
+
+        fold_scores = score_folds(model, origins, fh, common_inputs, error_metric, scaled_inputs,
+                                  executor, n_workers, trial, telemetry)
+        score = float(np.mean(fold_scores))
+
+    else:
+        raise ValueError(f'Invalid mode: {mode}. Please indicate "hyperparam_search", "cv" or "experiments".')
 
     return score
 
+def get_common_inputs(cutoff_date, df_outliers=None, df_clean=None, has_outliers=False, batch_sizes=None,
+                      feature_stores=None, feature_names=None):
+    """
+    Returns the common inputs for the objectives and get_error_score: scaled and unscaled training data
+    (scalers fitted on the training data only), the target scaler and the test target. The full series
+    ('target_full', 'cov_full') are included for get_error_score(mode='experiments'). feature_stores and
+    feature_names select precomputed covariates, see pf.train_test_split. Cross-validation folds refit the
+    scalers on their own training points, see score_fold.
+    """
+    df = df_outliers if has_outliers else df_clean
+
+    if feature_stores is not None and feature_names is None:
+        feature_names = ff.get_feature_names(feature_stores[has_outliers])
+
+    target_train, target_test, cov_train = pf.train_test_split(cutoff_date, df_outliers, df_clean, has_outliers,
+                                                               feature_stores, feature_names)
+    target_full = target_train.append(target_test)
+
+    if feature_stores is None:
+        cov_full = pf.get_covariate_ts(df)
+    else:
+        cov_full = ff.get_feature_ts(feature_stores[has_outliers], feature_names)
+
+    target_scaler = Scaler()
+    cov_scaler = Scaler()
+    target_scaler.fit(target_train)
+    cov_scaler.fit(cov_train)
+
+    return {
+        'scaled_data': {
+            'target_train': target_scaler.transform(target_train),
+            'cov_train': cov_scaler.transform(cov_train),
+            'target_full': target_scaler.transform(target_full),
+            'cov_full': cov_scaler.transform(cov_full),
+            'target_scaler': target_scaler
+        },
+        'unscaled_data': {
+            'target_train': target_train,
+            'cov_train': cov_train,
+            'target_full': target_full,
+            'cov_full': cov_full
+        },
+        'target_test': target_test,
+        'batch_sizes': batch_sizes
+    }
+
+def get_fold_origins(n_train: int, fh: int, n_folds: int=5, step: int=None, mode: str='cv') -> list:
+    """
+    Returns the training lengths (forecast origins) of the expanding-window folds. In 'cv' mode the folds end
+    at the training cutoff; in 'experiments' mode they start there and move forward through the test data.
+    """
+    step = fh if step is None else step
+
+    if mode == 'cv':
+        origins = [n_train - (n_folds - 1 - fold) * step for fold in range(n_folds)]
+    elif mode == 'experiments':
+        origins = [n_train + fold * step for fold in range(n_folds)]
+
+    if origins[0] <= 0:
+        raise ValueError(f'Not enough training data for {n_folds} folds with a step of {step}.')
+
+    return origins
+
+def get_fold_data(common_inputs: dict) -> dict:
+    """Returns the series shared by every fold: the unscaled model inputs and the actuals."""
+    data = common_inputs['unscaled_data']
+
+    return {
+        'actuals': data.get('target_full', data['target_train'].append(common_inputs['target_test'])),
+        'target': data.get('target_full', data['target_train']),
+        'cov': data.get('cov_full', data['cov_train'])
+    }
+
+_worker_fold_data = None
+
+def _init_fold_worker(fold_data: dict, n_threads: int):
+    """Stores the shared fold data once per worker process and sizes its torch thread pool."""
+    global _worker_fold_data
+    _worker_fold_data = fold_data
+    torch.set_num_threads(n_threads)
+
+def _score_fold_in_worker(model, origin, fh, error_metric, scaled_inputs):
+    return score_fold(model, _worker_fold_data, origin, fh, error_metric, scaled_inputs,
+                      n_threads=torch.get_num_threads())
+
+def get_fold_executor(common_inputs: dict, n_workers: int=None, mp_context: str='spawn'):
+    """
+    Returns a process pool whose workers hold the fold data, so that it is transferred once per worker
+    rather than once per fold. The cores are split evenly between the workers' torch thread pools.
+    """
+    n_cores = os.cpu_count() or 1
+    n_workers = min(n_cores, 4) if n_workers is None else n_workers
+    n_threads = max(1, n_cores // n_workers)
+
+    return ProcessPoolExecutor(max_workers=n_workers,
+                               mp_context=multiprocessing.get_context(mp_context),
+                               initializer=_init_fold_worker,
+                               initargs=(get_fold_data(common_inputs), n_threads))
+
+def score_fold(model, fold_data: dict, origin: int, fh: int, error_metric: str='rmse', scaled_inputs=True,
+               n_threads: int=None) -> float:
+    """
+    Fits an untrained copy of the model on the first origin points and scores the following fh points. With
+    scaled_inputs, the scalers are fitted on the fold's training points only, so no fold sees later data.
+    """
+    fold_model = model.untrained_model()
+
+    fit_kwargs = {}
+    cpu_callback = pf.get_callback(fold_model, pf.CPUPerformanceCallback)
+
+    if cpu_callback is not None:
+        if n_threads is not None:
+            cpu_callback.profile = {**cpu_callback.profile, 'num_threads': n_threads}
+        fit_kwargs['dataloader_kwargs'] = cpu_callback.dataloader_kwargs
+
+    series = fold_data['target'][:origin]
+    past_covariates = fold_data['cov'][:origin]
+
+    if scaled_inputs:
+        target_scaler, cov_scaler = Scaler(), Scaler()
+        series = target_scaler.fit_transform(series)
+        past_covariates = cov_scaler.fit_transform(past_covariates)
+
+    fold_model.fit(series=series, past_covariates=past_covariates, **fit_kwargs)
+    predictions = fold_model.predict(n=fh, series=series, past_covariates=past_covariates)
+
+    if scaled_inputs:
+        predictions = target_scaler.inverse_transform(predictions)
+
+    actuals = fold_data['actuals'][origin:origin + fh]
+
+    if error_metric == 'rmse':
+        return float(rmse(actuals, predictions))
+    elif error_metric == 'mae':
+        return float(mae(actuals, predictions))
+
+def score_folds(model, origins: list, fh: int, common_inputs: dict, error_metric: str='rmse', scaled_inputs=True,
+                executor=None, n_workers: int=None, trial: optuna.Trial=None, telemetry=None) -> list:
+    """Scores the folds concurrently and returns the fold scores in origin order."""
+    if executor is None and n_workers == 1:
+        fold_data = get_fold_data(common_inputs)
+        fold_scores = []
+
+        for origin in origins:
+            fold_scores.append(score_fold(model, fold_data, origin, fh, error_metric, scaled_inputs))
+            report_fold_scores(trial, fold_scores)
+
+        return fold_scores
+
+    own_executor = executor is None
+    if own_executor:
+        executor = get_fold_executor(common_inputs, n_workers)
+
+    try:
+        futures = {executor.submit(_score_fold_in_worker, model, origin, fh, error_metric, scaled_inputs): origin
+                   for origin in origins}
+        scores_by_origin = {}
+
+        if telemetry is not None:
+            telemetry.report_pool('folds', executor._max_workers, len(futures))
+
+        try:
+            for future in as_completed(futures):
+                scores_by_origin[futures[future]] = future.result()
+                if telemetry is not None:
+                    telemetry.report_pool('folds', executor._max_workers, len(futures) - len(scores_by_origin))
+                report_fold_scores(trial, list(scores_by_origin.values()))
+        except optuna.TrialPruned:
+            for future in futures:
+                future.cancel()
+            raise
+
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+    return [scores_by_origin[origin] for origin in origins]
+
+def report_fold_scores(trial, fold_scores: list):
+    """Reports the running mean fold score to Optuna and raises TrialPruned if the trial should stop."""
+    if trial is None:
+        return
+
+    step = len(fold_scores)
+    trial.report(float(np.mean(fold_scores)), step=step)
+
+    if trial.should_prune():
+        raise optuna.TrialPruned(f'Trial was pruned after {step} folds.')
+
 def objective_nbeats(trial: optuna.Trial, common_inputs:dict,  version: str, fh: int, 
-                  model_name_fh: str, error_metric: str, seed: int) -> float: 
+                  model_name_fh: str, error_metric: str, seed: int, performance_profile=None,
+                  cv_kwargs=None) -> float: 
     
     """N-BEATS hyperparameter search objective""" 
 
+    # with cross-validation, pruning happens between folds in get_error_score
     pruner = pf.PyTorchLightningPruningCallback(trial, monitor='val_loss')
-    callbacks = [pruner]
+    callbacks = [pruner] if cv_kwargs is None else []
 
     if torch.cuda.is_available():
         pl_trainer_kwargs = {
             'accelerator': 'gpu',
             'callbacks': callbacks,
         }
+    elif performance_profile is not None:
+        pl_trainer_kwargs = pf.get_cpu_trainer_kwargs('nbeats', performance_profile, callbacks=callbacks)
     else:
         pl_trainer_kwargs = {'callbacks': callbacks}
 
@@ -105,24 +338,29 @@ def objective_nbeats(trial: optuna.Trial, common_inputs:dict,  version: str, fh:
 
     model = NBEATSModel(**nbeats_params)
 
-    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs, mode='hyperparam_search', 
-                    error_metric=error_metric, scaled_inputs=False)
+    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs,
+                    mode='hyperparam_search' if cv_kwargs is None else 'cv',
+                    error_metric=error_metric, scaled_inputs=False, trial=trial, **(cv_kwargs or {}))
 
     return score
 
 def objective_rnn(trial: optuna.Trial,  common_inputs:dict,  version: str, fh: int, 
-                  model_name_fh: str, error_metric: str, seed: int) -> float:  
+                  model_name_fh: str, error_metric: str, seed: int, performance_profile=None,
+                  cv_kwargs=None) -> float:  
 
     """Recurrent Neural Network hyperparameter search objective"""
 
+    # with cross-validation, pruning happens between folds in get_error_score
     pruner = pf.PyTorchLightningPruningCallback(trial, monitor='val_loss')
-    callbacks = [pruner]
+    callbacks = [pruner] if cv_kwargs is None else []
 
     if torch.cuda.is_available():
         pl_trainer_kwargs = {
             'accelerator': 'gpu',
             'callbacks': callbacks,
         }
+    elif performance_profile is not None:
+        pl_trainer_kwargs = pf.get_cpu_trainer_kwargs(version.lower(), performance_profile, callbacks=callbacks)
     else:
         pl_trainer_kwargs = {'callbacks': callbacks}
 
@@ -144,13 +382,15 @@ def objective_rnn(trial: optuna.Trial,  common_inputs:dict,  version: str, fh: i
                     }
 
     model = BlockRNNModel(**rnn_params)
-    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs, mode='hyperparam_search', 
-                    error_metric=error_metric, scaled_inputs=True) 
+    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs,
+                    mode='hyperparam_search' if cv_kwargs is None else 'cv',
+                    error_metric=error_metric, scaled_inputs=True, trial=trial, **(cv_kwargs or {}))
     
     return score
 
 def objective_rf(trial: optuna.Trial,  common_inputs:dict, fh: int, 
-                  model_name_fh: str, error_metric: str, seed: int) -> float:
+                  model_name_fh: str, error_metric: str, seed: int,
+                  cv_kwargs=None) -> float:
 
     """Random Forest hyperparameter search objective""" 
 
@@ -163,12 +403,14 @@ def objective_rf(trial: optuna.Trial,  common_inputs:dict, fh: int,
                     }
 
     model = RandomForest(**rf_params)
-    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs, mode='hyperparam_search', 
-                    error_metric=error_metric, scaled_inputs=True)
+    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs,
+                    mode='hyperparam_search' if cv_kwargs is None else 'cv',
+                    error_metric=error_metric, scaled_inputs=True, trial=trial, **(cv_kwargs or {}))
     return score
 
 def objective_xgb(trial: optuna.Trial,  common_inputs:dict, fh: int, 
-                  model_name_fh: str, error_metric: str, seed: int) -> float: 
+                  model_name_fh: str, error_metric: str, seed: int,
+                  cv_kwargs=None) -> float: 
 
     """XGBoost hyperparameter search objective""" 
 
@@ -179,13 +421,15 @@ def objective_xgb(trial: optuna.Trial,  common_inputs:dict, fh: int,
                     }
 
     model = XGBModel(**xgb_params)
-    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs, mode='hyperparam_search', 
-                    error_metric=error_metric, scaled_inputs=True) 
+    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs,
+                    mode='hyperparam_search' if cv_kwargs is None else 'cv',
+                    error_metric=error_metric, scaled_inputs=True, trial=trial, **(cv_kwargs or {}))
                 
     return score
 
 def objective_lgbm(trial: optuna.Trial,  common_inputs:dict, fh: int, 
-                  model_name_fh: str, error_metric: str, seed: int) -> float:
+                  model_name_fh: str, error_metric: str, seed: int,
+                  cv_kwargs=None) -> float:
 
     """LightGBM hyperparameter search objective""" 
 
@@ -197,13 +441,28 @@ def objective_lgbm(trial: optuna.Trial,  common_inputs:dict, fh: int,
                     }
 
     model = LightGBMModel(**lgbm_params)
-    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs, mode='hyperparam_search', 
-                    error_metric=error_metric, scaled_inputs=True) 
+    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs,
+                    mode='hyperparam_search' if cv_kwargs is None else 'cv',
+                    error_metric=error_metric, scaled_inputs=True, trial=trial, **(cv_kwargs or {}))
                 
     return score
 
 def hyperparameter_search(fh, model_name, common_inputs, n_trials, results_dict,
-                          results_directory, hyperparam_file, version=None, error_metric='rmse', seed=None):
+                          results_directory, hyperparam_file, version=None, error_metric='rmse', seed=None,
+                          performance_profile=None, autotune_kwargs=None, cv_kwargs=None, figure_queue=None,
+                          telemetry=None):
+    """
+    Runs an Optuna study for the given model and forecast horizon and records the best parameters.
+    performance_profile='cpu' (or a dict of pf.get_cpu_profile overrides) applies the CPU training
+    profile to the neural models on machines without a GPU. If autotune_kwargs is given (a dict of
+    autotune_batch_sizes arguments, possibly empty), the neural models' batch size choices are first
+    pruned to those that fit in memory and train at a competitive throughput. If cv_kwargs is given
+    (n_folds, step, n_workers, mp_context), trials are scored by expanding-window cross-validation with
+    the folds running in a process pool that is shared across the study. With a
+    render_functions.FigureQueue, the optimization history figure is exported in the background instead of
+    blocking on kaleido. With a telemetry_functions.TelemetryExporter, trial throughput, pruning, the best score,
+    stage latencies and the fold pool's load are published while the study runs.
+    """
 
     if model_name == 'nbeats':
         model_name_fh = f'optuna_{model_name}_{version}_fh{fh}'
@@ -216,22 +475,53 @@ def hyperparameter_search(fh, model_name, common_inputs, n_trials, results_dict,
 
     study = optuna.create_study(direction='minimize')
 
+    callbacks = [tf.OptunaTelemetryCallback(telemetry, model_name_fh)] if telemetry is not None else []
+
+    if telemetry is not None:
+        telemetry.log_event('study_started', study=model_name_fh, n_trials=n_trials)
+
+    if autotune_kwargs is not None and model_name in ['nbeats', 'nhits', 'lstm', 'gru']:
+        with tf.stage(telemetry, 'autotune', study=model_name_fh):
+            batch_sizes = autotune_batch_sizes(model_name, fh, common_inputs, version=version,
+                                               performance_profile=performance_profile, **autotune_kwargs)
+        common_inputs = {**common_inputs, 'batch_sizes': batch_sizes}
+
+    if cv_kwargs is not None:
+        cv_kwargs = dict(cv_kwargs)
+        fold_executor = get_fold_executor(common_inputs, cv_kwargs.pop('n_workers', None),
+                                          cv_kwargs.pop('mp_context', 'spawn'))
+        objective_cv_kwargs = {**cv_kwargs, 'executor': fold_executor, 'telemetry': telemetry}
+    else:
+        fold_executor = None
+        objective_cv_kwargs = None
+
     if model_name in ['lstm', 'gru']:
         version = version.upper()
-        func = lambda trial: objective_rnn(trial, common_inputs, version, fh, model_name_fh, error_metric, seed) 
+        func = lambda trial: objective_rnn(trial, common_inputs, version, fh, model_name_fh, error_metric, seed,
+                                           performance_profile, cv_kwargs=objective_cv_kwargs)
     elif model_name == 'nbeats':
-        func = lambda trial: objective_nbeats(trial, common_inputs, version, fh, model_name_fh, error_metric, seed) 
+        func = lambda trial: objective_nbeats(trial, common_inputs, version, fh, model_name_fh, error_metric, seed,
+                                              performance_profile, cv_kwargs=objective_cv_kwargs)
     elif model_name == 'rf':
-        func = lambda trial: objective_rf(trial, common_inputs, fh, model_name_fh, error_metric, seed) 
+        func = lambda trial: objective_rf(trial, common_inputs, fh, model_name_fh, error_metric, seed,
+                                            cv_kwargs=objective_cv_kwargs) 
     elif model_name == 'xgboost': 
-        func = lambda trial: objective_xgb(trial, common_inputs, fh, model_name_fh, error_metric, seed) 
+        func = lambda trial: objective_xgb(trial, common_inputs, fh, model_name_fh, error_metric, seed,
+                                            cv_kwargs=objective_cv_kwargs) 
     elif model_name == 'lgbm':
-        func = lambda trial: objective_lgbm(trial, common_inputs, fh, model_name_fh, error_metric, seed)
+        func = lambda trial: objective_lgbm(trial, common_inputs, fh, model_name_fh, error_metric, seed,
+                                            cv_kwargs=objective_cv_kwargs)
     elif model_name == 'nhits': 
-        func = lambda trial: objective_nhits(trial, common_inputs, fh, model_name_fh, error_metric, seed) 
-     
+        func = lambda trial: objective_nhits(trial, common_inputs, fh, model_name_fh, error_metric, seed,
+                                             performance_profile, cv_kwargs=objective_cv_kwargs)
+
+    try:
+        with tf.stage(telemetry, 'optimize', study=model_name_fh):
+            study.optimize(func, n_trials=n_trials, callbacks=callbacks)
+    finally:
+        if fold_executor is not None:
+            fold_executor.shutdown(cancel_futures=True)
 
-    study.optimize(func, n_trials=n_trials)
     end_time = time.perf_counter()
     operation_runtime = round((end_time - start_time)/60, 2)
 
@@ -253,23 +543,37 @@ def hyperparameter_search(fh, model_name, common_inputs, n_trials, results_dict,
             yaxis_title="RMSE",
             showlegend=True
             )
-    fig.write_image(f'{results_directory}figures/{model_name_fh}_trial_history.png')
+    figure_file = f'{results_directory}figures/{model_name_fh}_trial_history.png'
+
+    if figure_queue is not None:
+        figure_queue.submit_figure(figure_file, fig)
+    else:
+        with tf.stage(telemetry, 'write_figure', study=model_name_fh):
+            fig.write_image(figure_file)
+
+    if telemetry is not None:
+        telemetry.log_event('study_finished', study=model_name_fh, best_value=study.best_value,
+                            minutes=operation_runtime)
 
     print(f'\nHyperparameter search for {model_name_fh} completed.\n')
 
 def objective_nhits(trial: optuna.Trial, common_inputs:dict, fh: int,
-                  model_name_fh: str, error_metric: str, seed: int) -> float:
+                  model_name_fh: str, error_metric: str, seed: int, performance_profile=None,
+                  cv_kwargs=None) -> float:
 
     """N-HiTS hyperparameter search objective"""
 
+    # with cross-validation, pruning happens between folds in get_error_score
     pruner = pf.PyTorchLightningPruningCallback(trial, monitor='val_loss')
-    callbacks = [pruner]
+    callbacks = [pruner] if cv_kwargs is None else []
 
     if torch.cuda.is_available():
         pl_trainer_kwargs = {
             'accelerator': 'gpu',
             'callbacks': callbacks,
         }
+    elif performance_profile is not None:
+        pl_trainer_kwargs = pf.get_cpu_trainer_kwargs('nhits', performance_profile, callbacks=callbacks)
     else:
         pl_trainer_kwargs = {'callbacks': callbacks}
 
@@ -293,7 +597,219 @@ def objective_nhits(trial: optuna.Trial, common_inputs:dict, fh: int,
 
     model = NHiTSModel(**nhits_params)
 
-    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs, mode='hyperparam_search',
-                    error_metric=error_metric, scaled_inputs=True)
+    score = get_error_score(model=model, fh=fh, common_inputs=common_inputs,
+                    mode='hyperparam_search' if cv_kwargs is None else 'cv',
+                    error_metric=error_metric, scaled_inputs=True, trial=trial, **(cv_kwargs or {}))
 
     return score
+
+class ThroughputCallback(Callback):
+    """PyTorch Lightning callback that times each training batch and counts the samples processed."""
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.batch_samples = []
+        self.batch_times = []
+        self._start = None
+
+    @property
+    def samples_per_sec(self) -> float:
+        # the first batch includes warm-up costs (allocations, compilation) and is excluded when possible
+        samples = self.batch_samples[1:] if len(self.batch_samples) > 1 else self.batch_samples
+        times = self.batch_times[1:] if len(self.batch_times) > 1 else self.batch_times
+        return sum(samples) / sum(times) if sum(times) > 0 else 0.0
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx) -> None:
+        self._start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx) -> None:
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+        # darts batch containers vary between versions, so count against the loader's (nominal) batch size
+        self.batch_times.append(time.perf_counter() - self._start)
+        self.batch_samples.append(trainer.train_dataloader.batch_size)
+
+def get_probe_model(model_name, fh, input_chunk_length, batch_size, version=None, model_kwargs=None,
+                    pl_trainer_kwargs=None):
+    """Returns an unfitted neural model with the given architecture, set up for a single training epoch."""
+
+    params = {
+        'input_chunk_length': input_chunk_length,
+        'output_chunk_length': fh,
+        'batch_size': batch_size,
+        'n_epochs': 1,
+        'pl_trainer_kwargs': pl_trainer_kwargs,
+        **(model_kwargs or {})
+    }
+
+    if model_name == 'nbeats':
+        return NBEATSModel(generic_architecture=True if version == 'generic' else False, **params)
+    elif model_name in ['lstm', 'gru']:
+        return BlockRNNModel(model=model_name.upper(), **params)
+    elif model_name == 'nhits':
+        return NHiTSModel(**params)
+    else:
+        raise ValueError(f'Batch size profiling is only supported for neural models, not {model_name}.')
+
+def profile_batch_size(model_name, fh, common_inputs, batch_size, input_chunk_length, version=None,
+                       model_kwargs=None, n_batches=20, performance_profile=None):
+    """Trains for up to n_batches batches and returns the throughput (samples/sec) and peak memory (MB)."""
+
+    throughput_callback = ThroughputCallback()
+    callbacks = [throughput_callback]
+
+    if torch.cuda.is_available():
+        pl_trainer_kwargs = {
+            'accelerator': 'gpu',
+            'callbacks': callbacks,
+        }
+    elif performance_profile is not None:
+        pl_trainer_kwargs = pf.get_cpu_trainer_kwargs(model_name, performance_profile, callbacks=callbacks)
+    else:
+        pl_trainer_kwargs = {'callbacks': callbacks}
+
+    pl_trainer_kwargs.update({
+        'limit_train_batches': n_batches + 1,
+        'enable_progress_bar': False,
+        'enable_model_summary': False,
+    })
+
+    model = get_probe_model(model_name, fh, input_chunk_length, batch_size, version, model_kwargs, pl_trainer_kwargs)
+
+    fit_kwargs = {}
+    cpu_callback = pf.get_callback(model, pf.CPUPerformanceCallback)
+
+    if cpu_callback is not None:
+        fit_kwargs['dataloader_kwargs'] = cpu_callback.dataloader_kwargs
+
+    try:
+        with pf.PeakMemoryMonitor() as monitor:
+            model.fit(series=common_inputs['scaled_data']['target_train'],
+                      past_covariates=common_inputs['scaled_data']['cov_train'],
+                      verbose=False,
+                      **fit_kwargs)
+
+    except (MemoryError, RuntimeError) as e:
+        # torch.cuda.OutOfMemoryError and CPU allocation failures are RuntimeErrors
+        if isinstance(e, RuntimeError) and 'out of memory' not in str(e).lower():
+            raise
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return {'fits': False, 'samples_per_sec': 0.0, 'peak_memory_mb': None}
+
+    peak_memory_mb = monitor.peak_cuda_mb if monitor.peak_cuda_mb is not None else monitor.peak_mb
+
+    return {
+        'fits': True,
+        'samples_per_sec': round(throughput_callback.samples_per_sec, 1),
+        'peak_memory_mb': round(peak_memory_mb, 1)
+    }
+
+def get_batch_size_profile(model_name, fh, common_inputs, batch_sizes, input_chunk_length=84, version=None,
+                           model_kwargs=None, n_batches=20, performance_profile=None, cache_file=None,
+                           refresh=False):
+    """
+    Returns {batch_size: {'fits', 'samples_per_sec', 'peak_memory_mb'}} for the given architecture and
+    input length on the current machine. Measurements are cached per host in cache_file (json) and only
+    missing batch sizes are probed, unless refresh=True. Batch sizes above one that ran out of memory
+    are marked as not fitting without being probed.
+    """
+
+    profile_key = '|'.join([model_name, str(version), f'icl={input_chunk_length}', f'fh={fh}',
+                            json.dumps(model_kwargs or {}, sort_keys=True), str(performance_profile)])
+    host = socket.gethostname()
+
+    if cache_file and os.path.exists(cache_file):
+        cache = pf.read_json_file(cache_file)
+    else:
+        cache = {}
+
+    host_cache = cache.setdefault(host, {})
+    profile = {} if refresh else host_cache.get(profile_key, {})
+    out_of_memory = False
+
+    for batch_size in sorted(batch_sizes):
+        if str(batch_size) in profile:
+            out_of_memory = out_of_memory or not profile[str(batch_size)]['fits']
+            continue
+
+        if out_of_memory:
+            profile[str(batch_size)] = {'fits': False, 'samples_per_sec': 0.0, 'peak_memory_mb': None}
+            continue
+
+        profile[str(batch_size)] = profile_batch_size(model_name, fh, common_inputs, batch_size, input_chunk_length,
+                                                      version, model_kwargs, n_batches, performance_profile)
+        out_of_memory = not profile[str(batch_size)]['fits']
+
+    host_cache[profile_key] = profile
+
+    if cache_file:
+        pf.post_results(cache, cache_file, 'w')
+
+    return {int(batch_size): values for batch_size, values in profile.items() if int(batch_size) in batch_sizes}
+
+def select_batch_sizes(profile, memory_budget_mb=None, min_relative_throughput=0.5):
+    """
+    Returns the batch sizes from a profile that fit within the memory budget and reach at least
+    min_relative_throughput of the best throughput, ordered by batch size.
+    """
+    if memory_budget_mb is None:
+        memory_budget_mb = pf.get_memory_budget_mb()
+
+    viable = {batch_size: values for batch_size, values in profile.items()
+              if values['fits'] and values['peak_memory_mb'] <= memory_budget_mb}
+
+    if not viable:
+        return []
+
+    best_throughput = max(values['samples_per_sec'] for values in viable.values())
+
+    return sorted(batch_size for batch_size, values in viable.items()
+                  if values['samples_per_sec'] >= min_relative_throughput * best_throughput)
+
+def autotune_batch_sizes(model_name, fh, common_inputs, batch_sizes=None, input_chunk_length=84, version=None,
+                         model_kwargs=None, memory_budget_mb=None, min_relative_throughput=0.5, n_batches=20,
+                         performance_profile=None, cache_file=None, refresh=False):
+    """
+    Profiles the candidate batch sizes (defaults to common_inputs['batch_sizes']) and returns those worth
+    searching over. input_chunk_length defaults to the top of the search space, i.e. the worst case for memory.
+    """
+    if batch_sizes is None:
+        batch_sizes = common_inputs['batch_sizes']
+
+    profile = get_batch_size_profile(model_name, fh, common_inputs, batch_sizes, input_chunk_length, version,
+                                     model_kwargs, n_batches, performance_profile, cache_file, refresh)
+    selected = select_batch_sizes(profile, memory_budget_mb, min_relative_throughput)
+
+    if not selected:
+        selected = [min(batch_sizes)]
+        print(f'No batch size passed the autotuning checks for {model_name} (fh={fh}), falling back to {selected}')
+
+    pruned = sorted(set(batch_sizes) - set(selected))
+    if pruned:
+        print(f'Autotuning pruned batch sizes {pruned} for {model_name} (fh={fh})')
+
+    return selected
+
+def get_fastest_batch_size(model_name, fh, common_inputs, batch_sizes=None, input_chunk_length=None, version=None,
+                           model_kwargs=None, memory_budget_mb=None, n_batches=20, performance_profile=None,
+                           cache_file=None, refresh=False):
+    """
+    Returns the viable batch size with the highest measured throughput, e.g. for the batch_size_override
+    of the default models in pf.get_model. input_chunk_length defaults to the default models' fh * 2.
+    """
+    if batch_sizes is None:
+        batch_sizes = common_inputs['batch_sizes']
+    if input_chunk_length is None:
+        input_chunk_length = fh * 2
+
+    profile = get_batch_size_profile(model_name, fh, common_inputs, batch_sizes, input_chunk_length, version,
+                                     model_kwargs, n_batches, performance_profile, cache_file, refresh)
+    selected = select_batch_sizes(profile, memory_budget_mb, min_relative_throughput=0)
+
+    if not selected:
+        return min(batch_sizes)
+
+    return max(selected, key=lambda batch_size: profile[batch_size]['samples_per_sec'])
@@ -0,0 +1,443 @@
+import inspect
+import json
+import numpy as np
+import os
+import pandas as pd
+import time
+import torch
+
+from darts.models.forecasting.torch_forecasting_model import TorchForecastingModel
+from sklearn.multioutput import MultiOutputRegressor
+
+from project_code import inference_runtime as ir
+
+try:
+    # newer darts modules take a PLModuleInput instead of an (x_past, x_static) tuple
+    from darts.utils.data.torch_datasets.utils import PLModuleInput
+except ImportError:
+    PLModuleInput = None
+
+
+class WindowForecastModule(torch.nn.Module):
+    """
+    Wraps the torch module of a fitted darts model so that it takes one float32 tensor of past windows
+    (batch, input_chunk_length, n_target_components + n_covariates) and returns the point forecasts
+    (batch, output_chunk_length, n_target_components), with no darts objects on the call path.
+    """
+    def __init__(self, module, n_target_components, n_covariates):
+        super().__init__()
+        self.module = module
+        self.n_target_components = n_target_components
+        self.n_covariates = n_covariates
+
+    def forward(self, windows):
+        if PLModuleInput is not None:
+            x_in = PLModuleInput(
+                past_target=windows[:, :, :self.n_target_components],
+                past_covariates=windows[:, :, self.n_target_components:] if self.n_covariates else None)
+        else:
+            x_in = (windows, None)
+
+        output = self.module(x_in)
+        prediction = output.prediction if hasattr(output, 'prediction') else output
+
+        # drop the likelihood parameter dimension
+        return prediction[..., 0]
+
+def get_scaling_params(scaler, n_components):
+    """
+    Returns (scale, min) float64 arrays such that x_scaled = x * scale + min for a fitted darts Scaler
+    wrapping a MinMaxScaler or StandardScaler, or the identity if scaler is None.
+    """
+    if scaler is None:
+        return np.ones(n_components), np.zeros(n_components)
+
+    transformer = scaler._fitted_params[0]
+
+    if hasattr(transformer, 'min_'):
+        scale, offset = transformer.scale_, transformer.min_
+    elif hasattr(transformer, 'mean_'):
+        scale = 1 / transformer.scale_
+        offset = -transformer.mean_ * scale
+    else:
+        raise ValueError(f'Unsupported scaler {type(transformer).__name__}, expected MinMaxScaler or StandardScaler')
+
+    return np.asarray(scale, dtype=np.float64), np.asarray(offset, dtype=np.float64)
+
+def get_inference_windows(target, covariates, input_chunk_length, output_chunk_length, n_windows=64):
+    """
+    Returns the last n_windows past windows (n_windows, input_chunk_length, n_target + n_covariates) of the
+    series whose following output_chunk_length target values are known, along with those values.
+    """
+    target_values = target.values(copy=False).astype(np.float32)
+    features = target_values
+
+    if covariates is not None:
+        covariate_values = covariates.slice_intersect(target).values(copy=False).astype(np.float32)
+        features = np.concatenate([target_values, covariate_values], axis=1)
+
+    last_end = len(target_values) - output_chunk_length
+    ends = np.arange(max(input_chunk_length, last_end - n_windows + 1), last_end + 1)
+
+    window_index = ends[:, np.newaxis] + np.arange(-input_chunk_length, 0)
+    actual_index = ends[:, np.newaxis] + np.arange(output_chunk_length)
+
+    return features[window_index], target_values[actual_index]
+
+def export_inference_artifact(model, artifact_path, target, covariates=None, target_scaler=None, cov_scaler=None,
+                              export_format='torchscript', quantize=False, n_windows=64) -> dict:
+    """
+    Exports a fitted darts torch model (N-BEATS, N-HiTS, LSTM, GRU, ...) as a standalone TorchScript or ONNX
+    artifact plus a json sidecar with its chunk lengths and scaling, for serving with
+    inference_runtime.load_inference_artifact. quantize applies dynamic int8 quantization to the linear and
+    recurrent layers. target and covariates are the unscaled training series; their last n_windows windows are
+    used to report the accuracy of the artifact against the original model and the actuals, and its cold
+    load time.
+    """
+    if not isinstance(model, TorchForecastingModel):
+        raise ValueError(f'Only torch models can be exported, got {type(model).__name__}')
+
+    if export_format not in ['torchscript', 'onnx']:
+        raise ValueError(f"Invalid export format {export_format}, expected 'torchscript' or 'onnx'")
+
+    artifact_dir = os.path.dirname(artifact_path)
+    if artifact_dir and not os.path.exists(artifact_dir):
+        os.makedirs(artifact_dir)
+
+    n_target_components = target.n_components
+    n_covariates = covariates.n_components if covariates is not None else 0
+
+    target_scale, target_min = get_scaling_params(target_scaler, n_target_components)
+    cov_scale, cov_min = get_scaling_params(cov_scaler, n_covariates)
+    feature_scale = np.concatenate([target_scale, cov_scale])
+    feature_min = np.concatenate([target_min, cov_min])
+
+    windows, actuals = get_inference_windows(target, covariates, model.input_chunk_length,
+                                             model.output_chunk_length, n_windows)
+    scaled_windows = torch.from_numpy(np.ascontiguousarray(windows * feature_scale + feature_min, dtype=np.float32))
+
+    module = WindowForecastModule(model.model, n_target_components, n_covariates).float().cpu().eval()
+
+    with torch.inference_mode():
+        reference = (module(scaled_windows).numpy() - target_min) / target_scale
+
+    # Lightning modules raise on trainer access while traced unless flagged as being scripted
+    has_jit_flag = hasattr(model.model, '_jit_is_scripting')
+    if has_jit_flag:
+        model.model._jit_is_scripting = True
+
+    start_time = time.perf_counter()
+
+    try:
+        if export_format == 'torchscript':
+            export_module = module
+            if quantize:
+                export_module = torch.ao.quantization.quantize_dynamic(
+                    module, {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+
+            with torch.no_grad():
+                traced_module = torch.jit.trace(export_module, scaled_windows[:1])
+            torch.jit.save(traced_module, artifact_path)
+
+        else:
+            fp32_path = f'{artifact_path}.fp32' if quantize else artifact_path
+            # the TorchScript-based exporter, where torch defaults to the dynamo one
+            onnx_kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+            torch.onnx.export(module, (scaled_windows[:1],), fp32_path, input_names=['windows'],
+                              output_names=['forecasts'],
+                              dynamic_axes={'windows': {0: 'batch'}, 'forecasts': {0: 'batch'}}, **onnx_kwargs)
+
+            if quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(fp32_path, artifact_path, weight_type=QuantType.QInt8)
+                os.remove(fp32_path)
+
+    finally:
+        if has_jit_flag:
+            model.model._jit_is_scripting = False
+
+    export_time = time.perf_counter() - start_time
+
+    metadata = {
+        'format': export_format,
+        'quantized': quantize,
+        'model_class': type(model).__name__,
+        'input_chunk_length': model.input_chunk_length,
+        'output_chunk_length': model.output_chunk_length,
+        'n_target_components': n_target_components,
+        'n_covariates': n_covariates,
+        'target_components': list(target.components),
+        'covariate_components': list(covariates.components) if covariates is not None else [],
+        'feature_scale': feature_scale.tolist(),
+        'feature_min': feature_min.tolist()
+    }
+
+    with open(ir.get_metadata_path(artifact_path), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+    artifact, load_time_ms = ir.load_inference_artifact(artifact_path)
+    forecasts = artifact.predict(windows)
+
+    def get_rmse(predicted):
+        return float(np.sqrt(np.mean((predicted - actuals) ** 2)))
+
+    report = {
+        'artifact_path': artifact_path,
+        'format': export_format,
+        'quantized': quantize,
+        'size_kb': round(os.path.getsize(artifact_path) / 1024, 1),
+        'export_time': round(export_time, 3),
+        'load_time_ms': load_time_ms,
+        'n_windows': len(windows),
+        'max_abs_delta': float(np.max(np.abs(forecasts - reference))),
+        'rmse_original': round(get_rmse(reference), 4),
+        'rmse_artifact': round(get_rmse(forecasts), 4)
+    }
+    report['rmse_delta'] = round(report['rmse_artifact'] - report['rmse_original'], 4)
+
+    return report
+
+def compare_inference_artifacts(model, artifact_path_prefix, target, covariates=None, target_scaler=None,
+                                cov_scaler=None, export_formats=('torchscript',), n_windows=64):
+    """
+    Exports the model in every format with and without quantization and returns one report row per artifact,
+    to choose which one to serve. Artifacts are written to {artifact_path_prefix}_{format}[_int8].{extension}.
+    """
+    extensions = {'torchscript': 'pt', 'onnx': 'onnx'}
+    reports = []
+
+    for export_format in export_formats:
+        for quantize in [False, True]:
+            suffix = '_int8' if quantize else ''
+            artifact_path = f'{artifact_path_prefix}_{export_format}{suffix}.{extensions[export_format]}'
+            reports.append(export_inference_artifact(model, artifact_path, target, covariates, target_scaler,
+                                                     cov_scaler, export_format, quantize, n_windows))
+
+    return pd.DataFrame(reports)
+
+def _get_sklearn_trees(estimator):
+    """Returns the node arrays of a fitted sklearn forest or decision tree, values averaged over the trees."""
+    tree_estimators = estimator.estimators_ if hasattr(estimator, 'estimators_') else [estimator]
+    trees = []
+
+    for tree_estimator in tree_estimators:
+        tree = tree_estimator.tree_
+        is_leaf = tree.children_left == -1
+        default_left = (tree.missing_go_to_left.astype(bool) if hasattr(tree, 'missing_go_to_left')
+                        else np.zeros_like(is_leaf))
+
+        trees.append({
+            'feature': np.where(is_leaf, 0, tree.feature),
+            'threshold': np.where(is_leaf, np.inf, tree.threshold),
+            'left': tree.children_left,
+            'right': tree.children_right,
+            'default_left': default_left,
+            'value': tree.value[:, :, 0] / len(tree_estimators),
+            'outputs': np.arange(tree.value.shape[1])
+        })
+
+    return trees, np.zeros(tree_estimators[0].tree_.value.shape[1]), 'float32'
+
+def _get_lightgbm_trees(estimator):
+    """Returns the node arrays of a fitted LightGBM regressor, flattened depth first from its json dump."""
+    trees = []
+
+    for tree_info in estimator.booster_.dump_model()['tree_info']:
+        nodes = {name: [] for name in ['feature', 'threshold', 'left', 'right', 'default_left', 'value']}
+        stack = [(tree_info['tree_structure'], None, None)]
+
+        while stack:
+            node, parent, side = stack.pop()
+            index = len(nodes['feature'])
+
+            if parent is not None:
+                nodes[side][parent] = index
+
+            if 'leaf_value' in node:
+                node_values = [0, np.inf, index, index, False, node['leaf_value']]
+            else:
+                if node['decision_type'] != '<=':
+                    raise ValueError(f"Unsupported LightGBM split type {node['decision_type']}, "
+                                     'only numerical splits can be compiled')
+
+                node_values = [node['split_feature'], node['threshold'], -1, -1, node['default_left'], 0.0]
+                stack.append((node['right_child'], index, 'right'))
+                stack.append((node['left_child'], index, 'left'))
+
+            for name, value in zip(nodes, node_values):
+                nodes[name].append(value)
+
+        trees.append({**{name: np.asarray(values) for name, values in nodes.items()},
+                      'value': np.asarray(nodes['value'], dtype=np.float64)[:, np.newaxis],
+                      'outputs': np.array([0])})
+
+    return trees, np.zeros(1), 'float64'
+
+def _get_xgboost_trees(estimator):
+    """Returns the node arrays of a fitted XGBoost regressor, read from its json model."""
+    learner = json.loads(estimator.get_booster().save_raw('json'))['learner']
+    gradient_booster = learner['gradient_booster']
+
+    if gradient_booster['name'] != 'gbtree':
+        raise ValueError(f"Unsupported XGBoost booster {gradient_booster['name']}, only gbtree can be compiled")
+
+    base_score = np.atleast_1d(np.asarray(json.loads(learner['learner_model_param']['base_score']), dtype=np.float64))
+    trees = []
+
+    for tree, output in zip(gradient_booster['model']['trees'], gradient_booster['model']['tree_info']):
+        left = np.asarray(tree['left_children'])
+        is_leaf = left == -1
+        split_conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+
+        trees.append({
+            'feature': np.where(is_leaf, 0, tree['split_indices']),
+            # XGBoost goes left if x < split, i.e. if x <= the next float32 below split
+            'threshold': np.where(is_leaf, np.inf, np.nextafter(split_conditions, np.float32(-np.inf))),
+            'left': left,
+            'right': np.asarray(tree['right_children']),
+            'default_left': np.asarray(tree['default_left'], dtype=bool),
+            'value': np.where(is_leaf, split_conditions, 0).astype(np.float64)[:, np.newaxis],
+            'outputs': np.array([output])
+        })
+
+    return trees, base_score, 'float32'
+
+def _get_estimator_trees(estimator):
+    if hasattr(estimator, 'booster_'):
+        return _get_lightgbm_trees(estimator)
+    elif hasattr(estimator, 'get_booster'):
+        return _get_xgboost_trees(estimator)
+    elif hasattr(estimator, 'tree_') or hasattr(getattr(estimator, 'estimators_', [None])[0], 'tree_'):
+        return _get_sklearn_trees(estimator)
+
+    raise ValueError(f'Unsupported estimator {type(estimator).__name__}, expected a random forest, '
+                     'XGBoost or LightGBM regressor')
+
+def compile_tree_model(model, target_scaler=None, cov_scaler=None):
+    """
+    Compiles a fitted darts RandomForest, XGBModel or LightGBMModel (target and past covariate lags,
+    multi_models=True) into an inference_runtime.CompiledTreeEnsemble. Pass the scalers the model was
+    trained with so that the compiled model takes raw values.
+    """
+    if 'future' in model.lags or getattr(model, 'component_lags', None):
+        raise ValueError('Only models with target and past covariate lags shared by all components can be compiled')
+
+    if not getattr(model, 'multi_models', True) or getattr(model, 'output_chunk_shift', 0):
+        raise ValueError('Only models with multi_models=True and no output chunk shift can be compiled')
+
+    target_lags = model.lags['target']
+    covariate_lags = model.lags.get('past', [])
+    n_target_components = sum('_target_lag' in name for name in model.lagged_feature_names) // len(target_lags)
+    n_covariates = (sum('_pastcov_lag' in name for name in model.lagged_feature_names) // len(covariate_lags)
+                    if covariate_lags else 0)
+    n_outputs = model.output_chunk_length * n_target_components
+
+    # darts fits one estimator per output step (and component) unless the estimator is natively multi-output
+    if isinstance(model.model, MultiOutputRegressor):
+        estimators = list(zip(model.model.estimators_, np.arange(n_outputs)[:, np.newaxis]))
+    else:
+        estimators = [(model.model, np.arange(n_outputs))]
+
+    trees, bias = [], np.zeros(n_outputs)
+
+    for estimator, estimator_outputs in estimators:
+        estimator_trees, estimator_bias, feature_dtype = _get_estimator_trees(estimator)
+        bias[estimator_outputs] += estimator_bias
+
+        for tree in estimator_trees:
+            tree['outputs'] = estimator_outputs[tree['outputs']]
+        trees += estimator_trees
+
+    node_counts = np.array([len(tree['feature']) for tree in trees])
+    roots = np.concatenate([[0], np.cumsum(node_counts)[:-1]])
+
+    value = np.zeros((node_counts.sum(), n_outputs))
+    for root, tree in zip(roots, trees):
+        value[root:root + len(tree['feature']), tree['outputs']] = tree['value']
+
+    arrays = {
+        'feature': np.concatenate([tree['feature'] for tree in trees]).astype(np.int64),
+        'threshold': np.concatenate([tree['threshold'] for tree in trees]).astype(np.float64),
+        'left': np.concatenate([root + tree['left'] for root, tree in zip(roots, trees)]).astype(np.int64),
+        'right': np.concatenate([root + tree['right'] for root, tree in zip(roots, trees)]).astype(np.int64),
+        'default_left': np.concatenate([tree['default_left'] for tree in trees]).astype(bool),
+        'value': value,
+        'roots': roots.astype(np.int64),
+        'bias': bias
+    }
+
+    # leaves point to themselves so that the traversal can run a fixed number of steps
+    is_leaf = np.isinf(arrays['threshold'])
+    arrays['left'][is_leaf] = np.flatnonzero(is_leaf)
+    arrays['right'][is_leaf] = np.flatnonzero(is_leaf)
+
+    # children always come after their parent, so depths settle in max_depth passes
+    depth = np.zeros(len(is_leaf), dtype=np.int64)
+    internal = np.flatnonzero(~is_leaf)
+    while True:
+        new_depth = depth.copy()
+        new_depth[arrays['left'][internal]] = depth[internal] + 1
+        new_depth[arrays['right'][internal]] = depth[internal] + 1
+        if np.array_equal(new_depth, depth):
+            break
+        depth = new_depth
+
+    target_scale, target_min = get_scaling_params(target_scaler, n_target_components)
+    cov_scale, cov_min = get_scaling_params(cov_scaler, n_covariates)
+
+    metadata = {
+        'model_class': type(model).__name__,
+        'target_lags': list(target_lags),
+        'covariate_lags': list(covariate_lags),
+        'output_chunk_length': model.output_chunk_length,
+        'n_target_components': n_target_components,
+        'n_covariates': n_covariates,
+        'n_trees': len(trees),
+        'max_depth': int(depth.max()),
+        'feature_dtype': feature_dtype,
+        'feature_scale': np.concatenate([target_scale, cov_scale]).tolist(),
+        'feature_min': np.concatenate([target_min, cov_min]).tolist()
+    }
+
+    return ir.CompiledTreeEnsemble(arrays, metadata)
+
+def validate_compiled_tree_model(model, compiled_model, target, covariates=None, target_scaler=None,
+                                 cov_scaler=None, n_origins=50) -> dict:
+    """
+    Compares the compiled model with darts' historical forecasts (retrain=False) of the original model over the
+    last n_origins full-horizon origins of the unscaled series, and times both.
+    """
+    output_chunk_length = model.output_chunk_length
+    first_origin = len(target) - output_chunk_length - n_origins + 1
+    origins = np.arange(first_origin, len(target) - output_chunk_length + 1)
+
+    scaled_target = target_scaler.transform(target) if target_scaler is not None else target
+    scaled_covariates = covariates
+    if covariates is not None and cov_scaler is not None:
+        scaled_covariates = cov_scaler.transform(covariates)
+
+    start_time = time.perf_counter()
+    forecasts = model.historical_forecasts(series=scaled_target, past_covariates=scaled_covariates,
+                                           start=target.time_index[first_origin],
+                                           forecast_horizon=output_chunk_length, stride=1, retrain=False,
+                                           last_points_only=False, verbose=False)
+    if target_scaler is not None:
+        forecasts = [target_scaler.inverse_transform(forecast) for forecast in forecasts]
+    darts_time = time.perf_counter() - start_time
+
+    darts_predictions = np.stack([forecast.values() for forecast in forecasts])
+
+    covariate_values = covariates.slice_intersect(target).values() if covariates is not None else None
+
+    start_time = time.perf_counter()
+    compiled_predictions = compiled_model.predict(target.values(), covariate_values, origins)[0]
+    compiled_time = time.perf_counter() - start_time
+
+    return {
+        'n_origins': len(origins),
+        'max_abs_delta': float(np.max(np.abs(compiled_predictions - darts_predictions))),
+        'darts_time': round(darts_time, 4),
+        'compiled_time': round(compiled_time, 4),
+        'speedup': round(darts_time / compiled_time, 1)
+    }
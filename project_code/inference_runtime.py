@@ -0,0 +1,202 @@
+import json
+import numpy as np
+import os
+import time
+
+# Deliberately free of darts and Lightning imports: artifacts written by inference_functions are served
+# with numpy plus either torch (TorchScript) or onnxruntime (ONNX), which are imported on load.
+
+
+def get_metadata_path(artifact_path) -> str:
+    return f'{os.path.splitext(artifact_path)[0]}.json'
+
+class InferenceArtifact:
+    """
+    A loaded inference artifact. predict takes raw (unscaled) float32 windows of shape
+    (batch, input_chunk_length, n_target_components + n_covariates), target columns first, and returns
+    unscaled forecasts of shape (batch, output_chunk_length, n_target_components).
+    """
+    def __init__(self, artifact_path, num_threads=None):
+        with open(get_metadata_path(artifact_path)) as f:
+            self.metadata = json.load(f)
+
+        self.input_chunk_length = self.metadata['input_chunk_length']
+        self.output_chunk_length = self.metadata['output_chunk_length']
+        self.n_target_components = self.metadata['n_target_components']
+        self.n_features = self.n_target_components + self.metadata['n_covariates']
+
+        # scaling as in sklearn's MinMaxScaler: x_scaled = x * scale + min
+        self._feature_scale = np.asarray(self.metadata['feature_scale'], dtype=np.float32)
+        self._feature_min = np.asarray(self.metadata['feature_min'], dtype=np.float32)
+        self._target_scale = self._feature_scale[:self.n_target_components]
+        self._target_min = self._feature_min[:self.n_target_components]
+
+        if self.metadata['format'] == 'torchscript':
+            import torch
+
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+
+            self._module = torch.jit.load(artifact_path, map_location='cpu')
+            self._module.eval()
+            self._run = self._run_torchscript
+
+        elif self.metadata['format'] == 'onnx':
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+
+            self._session = onnxruntime.InferenceSession(artifact_path, options, providers=['CPUExecutionProvider'])
+            self._input_name = self._session.get_inputs()[0].name
+            self._run = self._run_onnx
+
+        else:
+            raise ValueError(f"Unknown artifact format {self.metadata['format']}")
+
+    def _run_torchscript(self, windows):
+        import torch
+
+        with torch.inference_mode():
+            return self._module(torch.from_numpy(windows)).numpy()
+
+    def _run_onnx(self, windows):
+        return self._session.run(None, {self._input_name: windows})[0]
+
+    def predict(self, windows) -> np.ndarray:
+        windows = np.asarray(windows, dtype=np.float32)
+        single_window = windows.ndim == 2
+
+        if single_window:
+            windows = windows[np.newaxis]
+
+        if windows.shape[1:] != (self.input_chunk_length, self.n_features):
+            raise ValueError(f'Expected windows of shape (batch, {self.input_chunk_length}, {self.n_features}), '
+                             f'got {windows.shape}')
+
+        scaled_windows = np.ascontiguousarray(windows * self._feature_scale + self._feature_min, dtype=np.float32)
+        forecasts = (self._run(scaled_windows) - self._target_min) / self._target_scale
+
+        return forecasts[0] if single_window else forecasts
+
+def load_inference_artifact(artifact_path, num_threads=None):
+    """Loads an exported artifact and returns (InferenceArtifact, load time in ms)."""
+    start_time = time.perf_counter()
+    artifact = InferenceArtifact(artifact_path, num_threads=num_threads)
+    load_time_ms = (time.perf_counter() - start_time) * 1000
+
+    return artifact, round(load_time_ms, 2)
+
+def _min_max_scale(values, scale, offset):
+    """
+    Scales like sklearn's MinMaxScaler, which rounds each step to the dtype of the values. Trees split on
+    exact feature values, so float32 series must be scaled exactly as they were for training.
+    """
+    dtype = values.dtype if values.dtype in [np.float32, np.float64] else np.float64
+
+    return ((values * scale).astype(dtype) + offset).astype(dtype)
+
+class CompiledTreeEnsemble:
+    """
+    A tree ensemble (random forest or gradient boosting) flattened into NumPy node arrays, predicting every
+    output step of a darts regression model for a batch of series and forecast origins in one vectorized
+    traversal. Built by inference_functions.compile_tree_model. Leaves point to themselves, so all samples
+    can walk all trees for max_depth steps; node values already include the tree weights.
+    """
+    array_names = ['feature', 'threshold', 'left', 'right', 'default_left', 'value', 'roots', 'bias']
+
+    def __init__(self, arrays: dict, metadata: dict):
+        for name in self.array_names:
+            setattr(self, name, arrays[name])
+
+        self.metadata = metadata
+        self.target_lags = np.asarray(metadata['target_lags'], dtype=np.int64)
+        self.covariate_lags = np.asarray(metadata['covariate_lags'], dtype=np.int64)
+        self.output_chunk_length = metadata['output_chunk_length']
+        self.n_target_components = metadata['n_target_components']
+
+        self._feature_scale = np.asarray(metadata['feature_scale'], dtype=np.float64)
+        self._feature_min = np.asarray(metadata['feature_min'], dtype=np.float64)
+
+    def predict_features(self, features, chunk_size=None) -> np.ndarray:
+        """Returns the raw model outputs (n_samples, n_outputs) for a lagged feature matrix (n_samples, n_features)."""
+        features = np.asarray(features, dtype=np.float64)
+
+        # sklearn and XGBoost compare float32 features, LightGBM float64
+        if self.metadata['feature_dtype'] == 'float32':
+            features = features.astype(np.float32).astype(np.float64)
+
+        n_trees, n_outputs = len(self.roots), len(self.bias)
+        chunk_size = chunk_size or max(1, 2**22 // (n_trees * n_outputs))
+        predictions = np.empty((len(features), n_outputs))
+
+        for start in range(0, len(features), chunk_size):
+            chunk = features[start:start + chunk_size]
+            rows = np.arange(len(chunk))[:, np.newaxis]
+            nodes = np.broadcast_to(self.roots, (len(chunk), n_trees))
+
+            for _ in range(self.metadata['max_depth']):
+                values = chunk[rows, self.feature[nodes]]
+                go_left = (values <= self.threshold[nodes]) | (np.isnan(values) & self.default_left[nodes])
+                nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+            predictions[start:start + chunk_size] = self.bias + self.value[nodes].sum(axis=1)
+
+        return predictions
+
+    def get_lagged_features(self, target, covariates=None, origins=None) -> np.ndarray:
+        """
+        Returns the scaled lagged features (n_series, n_origins, n_features) in darts' order: target lags, then
+        past covariate lags, each lag-major. target is (n_series, n_times, n_target_components) or a single
+        (n_times, n_target_components) series, covariates the same on the same time axis. origins are the
+        positions of the first forecast step, defaulting to right after the end of the series.
+        """
+        target = np.asarray(target)
+        if target.ndim == 2:
+            target = target[np.newaxis]
+
+        n_series, n_times = target.shape[:2]
+        origins = np.atleast_1d(np.asarray(origins if origins is not None else n_times, dtype=np.int64))
+
+        n_target = self.n_target_components
+        target = _min_max_scale(target, self._feature_scale[:n_target], self._feature_min[:n_target])
+        features = [target[:, origins[:, np.newaxis] + self.target_lags].reshape(n_series, len(origins), -1)]
+
+        if len(self.covariate_lags):
+            covariates = np.asarray(covariates)
+            if covariates.ndim == 2:
+                covariates = covariates[np.newaxis]
+
+            covariates = _min_max_scale(covariates, self._feature_scale[n_target:], self._feature_min[n_target:])
+            features.append(covariates[:, origins[:, np.newaxis] + self.covariate_lags].reshape(n_series, len(origins), -1))
+
+        return np.concatenate(features, axis=-1)
+
+    def predict(self, target, covariates=None, origins=None) -> np.ndarray:
+        """
+        Returns unscaled forecasts (n_series, n_origins, output_chunk_length, n_target_components) from raw
+        target and covariate values; see get_lagged_features for the shapes.
+        """
+        features = self.get_lagged_features(target, covariates, origins)
+        n_series, n_origins, n_features = features.shape
+
+        predictions = self.predict_features(features.reshape(-1, n_features))
+        predictions = predictions.reshape(n_series, n_origins, self.output_chunk_length, self.n_target_components)
+
+        n_target = self.n_target_components
+        return (predictions - self._feature_min[:n_target]) / self._feature_scale[:n_target]
+
+    def save(self, path):
+        """Saves the node arrays to path (.npz) and the metadata to a json sidecar."""
+        np.savez(path, **{name: getattr(self, name) for name in self.array_names})
+
+        with open(get_metadata_path(path), 'w') as f:
+            json.dump(self.metadata, f, indent=4)
+
+def load_compiled_tree_ensemble(path) -> CompiledTreeEnsemble:
+    with open(get_metadata_path(path)) as f:
+        metadata = json.load(f)
+
+    with np.load(path) as arrays:
+        return CompiledTreeEnsemble({name: arrays[name] for name in CompiledTreeEnsemble.array_names}, metadata)
@@ -0,0 +1,295 @@
+from darts import TimeSeries
+from darts.metrics import rmse
+from darts.models import ExponentialSmoothing
+from darts.models.forecasting.baselines import NaiveDrift, NaiveMean, NaiveMovingAverage, NaiveSeasonal
+from darts.models.forecasting.forecasting_model import GlobalForecastingModel, LocalForecastingModel
+from darts.utils.serialization import add_safe_globals
+from darts.utils.utils import ModelMode, SeasonalityMode
+import numpy as np
+import time
+
+
+def get_fourier_terms(positions, period, n_harmonics) -> np.ndarray:
+    """Returns the sin and cos terms of the first n_harmonics harmonics of period at the given positions."""
+    angles = 2 * np.pi * np.outer(positions, np.arange(1, n_harmonics + 1)) / period
+    return np.hstack([np.sin(angles), np.cos(angles)])
+
+def fit_holt_grid(values, alphas, betas, phis=(1.0,)):
+    """
+    Fits Holt's linear (optionally damped) trend method to values for every combination of the smoothing
+    parameters at once: the state recursion runs over time with the parameter grid as a vector. Returns the
+    (alpha, beta, phi) with the lowest one-step-ahead SSE and the final level and trend.
+    """
+    alpha, beta, phi = [grid.ravel() for grid in np.meshgrid(alphas, betas, phis, indexing='ij')]
+
+    # initial states as in statsmodels' 'estimated' heuristic: first value and average first-week slope
+    n_init = min(len(values), 8)
+    level = np.full(len(alpha), values[0], dtype=np.float64)
+    trend = np.full(len(alpha), (values[n_init - 1] - values[0]) / max(n_init - 1, 1), dtype=np.float64)
+    sse = np.zeros(len(alpha))
+
+    for value in values[1:]:
+        forecast = level + phi * trend
+        error = value - forecast
+        sse += error**2
+        level = forecast + alpha * error
+        trend = phi * trend + alpha * beta * error
+
+    best = np.argmin(sse)
+
+    return {'alpha': alpha[best], 'beta': beta[best], 'phi': phi[best], 'level': level[best],
+            'trend': trend[best], 'sse': sse[best]}
+
+class FastETS(LocalForecastingModel):
+    def __init__(self, seasonal_periods: int = 365, n_harmonics: int = 10, damped: bool = False,
+                 alphas=None, betas=None, phis=None, min_train_length: int | None = None):
+        """
+        Fast additive ETS for long seasonal periods (e.g. 365 days), a drop-in for
+        ExponentialSmoothing(trend=ADDITIVE, seasonal=ADDITIVE, seasonal_periods=365). Rather than smoothing
+        365 seasonal states, the seasonality is a least-squares fit of n_harmonics Fourier terms (plus a linear
+        trend), and Holt's trend method is fitted to the deseasonalized series by a vectorized grid search over
+        the smoothing parameters. Forecasts are the Holt trend plus the Fourier seasonality projected forward.
+        """
+        super().__init__(min_train_length=min_train_length)
+        self.seasonal_periods = seasonal_periods
+        self.n_harmonics = n_harmonics
+        self.damped = damped
+        self.alphas = np.asarray(alphas if alphas is not None else np.linspace(0.01, 0.99, 50))
+        self.betas = np.asarray(betas if betas is not None else [0.0, 0.001, 0.01, 0.05, 0.1, 0.2, 0.5])
+        self.phis = np.asarray(phis if phis is not None else ([0.8, 0.9, 0.95, 0.98, 0.995] if damped else [1.0]))
+        self.seasonal_coefficients = None
+        self.params = None
+
+    def fit(self, series: TimeSeries, verbose: bool | None = None):
+        super().fit(series, verbose=verbose)
+        self._assert_univariate(series)
+        values = self.training_series.values(copy=False)[:, 0].astype(np.float64)
+        positions = np.arange(len(values))
+
+        fourier_terms = get_fourier_terms(positions, self.seasonal_periods, self.n_harmonics)
+        design = np.hstack([np.ones((len(values), 1)), positions[:, np.newaxis], fourier_terms])
+        coefficients = np.linalg.lstsq(design, values, rcond=None)[0]
+        self.seasonal_coefficients = coefficients[2:]
+
+        deseasonalized = values - fourier_terms @ self.seasonal_coefficients
+        self.params = fit_holt_grid(deseasonalized, self.alphas, self.betas, self.phis)
+
+        return self
+
+    def predict(self, n: int, num_samples: int = 1, verbose: bool | None = None, show_warnings: bool = True,
+                random_state: int | None = None):
+        super().predict(n, num_samples, verbose=verbose, show_warnings=show_warnings)
+
+        steps = np.arange(1, n + 1)
+        damped_steps = np.cumsum(self.params['phi'] ** steps)
+        positions = len(self.training_series) - 1 + steps
+        seasonal = get_fourier_terms(positions, self.seasonal_periods, self.n_harmonics) @ self.seasonal_coefficients
+
+        forecast = self.params['level'] + damped_steps * self.params['trend'] + seasonal
+
+        return self._build_forecast_series(forecast[:, np.newaxis].astype(self.training_series.dtype))
+
+    def update(self, new_series: TimeSeries):
+        """Advances the level and trend over observations that directly follow the training series, without refitting."""
+        positions = len(self.training_series) + np.arange(len(new_series))
+        seasonal = get_fourier_terms(positions, self.seasonal_periods, self.n_harmonics) @ self.seasonal_coefficients
+        alpha, beta, phi = self.params['alpha'], self.params['beta'], self.params['phi']
+        level, trend = self.params['level'], self.params['trend']
+
+        for value in new_series.values(copy=False)[:, 0] - seasonal:
+            forecast = level + phi * trend
+            error = value - forecast
+            level = forecast + alpha * error
+            trend = phi * trend + alpha * beta * error
+
+        self.params = {**self.params, 'level': level, 'trend': trend}
+        self.training_series = self.training_series.append(new_series)
+
+        return self
+
+    @property
+    def supports_multivariate(self) -> bool:
+        return False
+
+    @property
+    def supports_probabilistic_prediction(self) -> bool:
+        return False
+
+    @property
+    def _target_window_lengths(self) -> tuple[int, int]:
+        return self._min_train_input_length(2 * self.n_harmonics + 3), 0
+
+def validate_fast_ets(train: TimeSeries, test: TimeSeries = None, n: int = None, seasonal_periods=365, **kwargs) -> dict:
+    """
+    Fits FastETS (kwargs) and the statsmodels Holt-Winters ExponentialSmoothing it replaces on train and returns
+    their fit times, the RMSE between their n-step forecasts and, if test is given, the RMSE of each against it.
+    """
+    n = n or (len(test) if test is not None else seasonal_periods)
+    report = {}
+
+    for name, model in [('statsmodels', ExponentialSmoothing(trend=ModelMode.ADDITIVE, seasonal=SeasonalityMode.ADDITIVE,
+                                                             seasonal_periods=seasonal_periods)),
+                        ('fast', FastETS(seasonal_periods=seasonal_periods, **kwargs))]:
+        start_time = time.perf_counter()
+        model.fit(train)
+        report[f'{name}_fit_seconds'] = round(time.perf_counter() - start_time, 3)
+
+        report[f'{name}_forecast'] = model.predict(n)
+        if test is not None:
+            report[f'{name}_rmse'] = round(rmse(test[:n], report[f'{name}_forecast']), 4)
+
+    report['forecast_rmse_delta'] = round(rmse(report['statsmodels_forecast'], report['fast_forecast']), 4)
+    report['speedup'] = round(report['statsmodels_fit_seconds'] / max(report['fast_fit_seconds'], 1e-6), 1)
+
+    return report
+
+def get_ets_state(model: ExponentialSmoothing) -> dict:
+    """Returns the smoothing parameters and final level, trend and seasonal states of a fitted additive Holt-Winters model."""
+    results = model.model
+    params = results.params
+    m = model.seasonal_periods
+
+    return {
+        'alpha': params['smoothing_level'],
+        'beta': params['smoothing_trend'] if results.trend is not None else 0.0,
+        'gamma': params['smoothing_seasonal'] if results.season is not None else 0.0,
+        'phi': params['damping_trend'] if model.damped else 1.0,
+        'level': results.level[-1],
+        'trend': results.trend[-1] if results.trend is not None else 0.0,
+        'season': np.asarray(results.season[-m:]) if results.season is not None else np.zeros(1)
+    }
+
+def update_ets_state(state: dict, values) -> dict:
+    """Advances an additive Holt-Winters state (see get_ets_state) over new observations, as statsmodels' recursion does."""
+    alpha, beta, gamma, phi = state['alpha'], state['beta'], state['gamma'], state['phi']
+    level, trend = state['level'], state['trend']
+    season = list(state['season'])
+
+    for value in values:
+        seasonal = season[-len(state['season'])]
+        new_level = alpha * (value - seasonal) + (1 - alpha) * (level + phi * trend)
+        season.append(gamma * (value - level - phi * trend) + (1 - gamma) * seasonal)
+        trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        level = new_level
+
+    return {**state, 'level': level, 'trend': trend, 'season': np.asarray(season[-len(state['season']):])}
+
+def forecast_ets_state(state: dict, n: int) -> np.ndarray:
+    steps = np.arange(1, n + 1)
+    damped_steps = np.cumsum(state['phi'] ** steps)
+
+    return state['level'] + damped_steps * state['trend'] + state['season'][(steps - 1) % len(state['season'])]
+
+class OnlineForecaster:
+    """
+    Keeps a fitted model current as new observations arrive: update ingests the new target (and covariate) points
+    and advances the model state in O(new points) instead of refitting, with a full refit on all data every
+    refit_every points (never if None). Supported state updates:
+    - naive baselines: mean, last season, moving-average window and drift end point
+    - ExponentialSmoothing ('ets') and FastETS ('ets_fast'): the level, trend and seasonal recursions
+    - global models (neural and regression): their state is the input window, so predict conditions on the
+      extended history, scaled with the scalers of the last full fit
+    Other models are refitted on every update. target_scaler and cov_scaler (darts Scalers) are fitted on full
+    fits, as in run_experiment; history records the action and time of every update.
+    """
+    def __init__(self, model, refit_every=None, target_scaler=None, cov_scaler=None):
+        self.model = model
+        self.refit_every = refit_every
+        self.target_scaler = target_scaler
+        self.cov_scaler = cov_scaler
+        self.target = None
+        self.covariates = None
+        self.points_since_refit = 0
+        self.history = []
+        self._ets_state = None
+
+    def fit(self, target: TimeSeries, covariates: TimeSeries = None):
+        """Fully fits the model (and scalers) on target and covariates."""
+        self.target, self.covariates = target, covariates
+
+        if isinstance(self.model, GlobalForecastingModel):
+            self._scaled_target = self.target_scaler.fit_transform(target) if self.target_scaler else target
+            self._scaled_covariates = (self.cov_scaler.fit_transform(covariates) if self.cov_scaler and covariates is not None
+                                       else covariates)
+            self.model.fit(series=self._scaled_target, past_covariates=self._scaled_covariates)
+        else:
+            self.model.fit(target)
+
+        if isinstance(self.model, ExponentialSmoothing):
+            self._ets_state = get_ets_state(self.model)
+
+        self.points_since_refit = 0
+
+        return self
+
+    def update(self, new_target: TimeSeries, new_covariates: TimeSeries = None) -> str:
+        """
+        Ingests observations that directly follow the current target (covariates covering the same dates) and
+        returns the action taken: 'update' (state advanced) or 'refit'.
+        """
+        start_time = time.perf_counter()
+
+        self.target = self.target.append(new_target)
+        if new_covariates is not None:
+            self.covariates = self.covariates.append(new_covariates)
+        self.points_since_refit += len(new_target)
+
+        if (self.refit_every is not None and self.points_since_refit >= self.refit_every) or not self._advance(
+                new_target, new_covariates):
+            self.fit(self.target, self.covariates)
+            action = 'refit'
+        else:
+            action = 'update'
+
+        self.history.append({'end_time': self.target.end_time(), 'n_points': len(new_target), 'action': action,
+                             'time_ms': round((time.perf_counter() - start_time) * 1000, 3)})
+
+        return action
+
+    def _advance(self, new_target, new_covariates) -> bool:
+        model = self.model
+        new_values = new_target.values(copy=False)
+
+        if isinstance(model, GlobalForecastingModel):
+            self._scaled_target = self._scaled_target.append(
+                self.target_scaler.transform(new_target) if self.target_scaler else new_target)
+            if new_covariates is not None:
+                self._scaled_covariates = self._scaled_covariates.append(
+                    self.cov_scaler.transform(new_covariates) if self.cov_scaler else new_covariates)
+            return True
+
+        if isinstance(model, FastETS):
+            model.update(new_target)
+            return True
+
+        if isinstance(model, ExponentialSmoothing):
+            self._ets_state = update_ets_state(self._ets_state, new_values[:, 0])
+        elif isinstance(model, NaiveMean):
+            n_previous = len(model.training_series)
+            model.mean_val = (model.mean_val * n_previous + new_values.sum(axis=0)) / (n_previous + len(new_values))
+        elif isinstance(model, NaiveSeasonal):
+            model.last_k_vals = np.concatenate([model.last_k_vals, new_values])[-model.K:]
+        elif isinstance(model, NaiveMovingAverage):
+            model.rolling_window = np.concatenate([model.rolling_window, new_values])[-model.input_chunk_length:]
+        elif not isinstance(model, NaiveDrift):
+            return False
+
+        # the forecast index and NaiveDrift's slope come from the training series
+        model.training_series = self.target
+
+        return True
+
+    def predict(self, n: int) -> TimeSeries:
+        """Returns the n-step forecast from the end of the current target."""
+        if isinstance(self.model, GlobalForecastingModel):
+            predictions = self.model.predict(n=n, series=self._scaled_target, past_covariates=self._scaled_covariates)
+            return self.target_scaler.inverse_transform(predictions) if self.target_scaler else predictions
+
+        if isinstance(self.model, ExponentialSmoothing):
+            forecast = forecast_ets_state(self._ets_state, n)
+            return self.model._build_forecast_series(forecast[:, np.newaxis].astype(self.target.dtype))
+
+        return self.model.predict(n)
+
+# fitted FastETS models only hold numpy state, so they can be loaded without trusted=True like darts' own models
+add_safe_globals([FastETS])
@@ -8,6 +8,8 @@ import optuna
 import os
 import pandas as pd
 import re
+import resource
+import threading
 import time
 import urllib.request
 import warnings
@@ -17,20 +19,26 @@ from darts.models import (BlockRNNModel, ExponentialSmoothing, LightGBMModel, NB
                           NHiTSModel, RandomForest, XGBModel)
 from darts.models.forecasting.baselines import NaiveDrift, NaiveMean, NaiveMovingAverage,  NaiveSeasonal
 from darts.utils.callbacks import TFMProgressBar
-from darts.utils.timeseries_generation import datetime_attribute_timeseries as dt_attr
+from darts.utils.likelihood_models import QuantileRegression
 from darts.utils.utils import ModelMode, SeasonalityMode
 import optuna
 import pytorch_lightning as pl
-from pytorch_lightning.callbacks import Callback, ModelCheckpoint
+from pytorch_lightning.callbacks import Callback, EarlyStopping, ModelCheckpoint
 from pytorch_lightning import LightningModule
 from pytorch_lightning import Trainer
 import torch
 from tqdm.notebook import tqdm
 
+from project_code import cache_functions as cf
+from project_code import evaluation_functions as ef
+from project_code import feature_functions as ff
+from project_code import inference_functions as inf
+from project_code import model_functions as mf
+
 # metrics
 from darts.metrics import mae, rmse
 
-non_ml_models = ['ets', 'naive_drift', 'naive_mean', 'naive_moving_average', 'naive_seasonal']
+non_ml_models = ['ets', 'ets_fast', 'naive_drift', 'naive_mean', 'naive_moving_average', 'naive_seasonal']
 
 
 def download_data(api_call: str, file_path: str, file_name: str):
@@ -100,7 +108,8 @@ def generate_df_summary(df: pd.DataFrame, name:str = None, describe_only: bool =
         print('------ Counts: ------\n')
         print(f'Rows: {df.shape[0]:,}') 
         print(f'Columns: {df.shape[1]:,}') 
-        print(f'Duplicate Rows = {df.duplicated().sum()} | % of Total Rows = {df.duplicated().sum()/df.shape[0]:.1%}') 
+        n_duplicates = df.duplicated().sum()
+        print(f'Duplicate Rows = {n_duplicates} | % of Total Rows = {n_duplicates/df.shape[0]:.1%}') 
         print('\n')
 
         print('------ Info: ------\n')
@@ -110,8 +119,11 @@ def generate_df_summary(df: pd.DataFrame, name:str = None, describe_only: bool =
         print('------ Missing Data Percentage: ------')
         display(df.isnull().sum()/len(df) * 100)   
 
-def daily_aggregations(dataframe: pd.DataFrame, convert_time: bool = True) -> pd.DataFrame:
-    """Aggregates the weather data at a daily level of granularity."""
+def daily_aggregations(dataframe: pd.DataFrame, convert_time: bool = True, dtype=np.float32) -> pd.DataFrame:
+    """
+    Aggregates the weather data at a daily level of granularity. The aggregates are computed in float64 and
+    stored as dtype (float32 by default, halving memory; None keeps float64), see storage_functions.
+    """
     
     df_copy = dataframe.copy()
 
@@ -148,11 +160,51 @@ def daily_aggregations(dataframe: pd.DataFrame, convert_time: bool = True) -> pd
 
     # reorder the columns to display sunshine_hr first
     reordered_columns = ['sunshine_hr'] + [col for col in daily_data if col != 'sunshine_hr']
-    
-    return daily_data[reordered_columns]
+    daily_data = daily_data[reordered_columns]
+
+    return daily_data.astype(dtype) if dtype is not None else daily_data
+
+def hourly_aggregations(dataframe: pd.DataFrame, convert_time: bool = True, max_gap_hours: int = 3) -> pd.DataFrame:
+    """
+    Prepares the hourly weather data for hourly forecasting: sunshine in hours per hour, humidity and
+    temperature as float32 on a regular hourly 'date' index, with gaps of up to max_gap_hours interpolated.
+    """
+    df_copy = dataframe[['time', 'sunshine_duration', 'relative_humidity_2m', 'temperature_2m']].copy()
+
+    if convert_time:
+        df_copy['time'] = pd.to_datetime(df_copy['time'])
+
+    df_copy = df_copy.set_index('time').rename_axis('date')
+    df_copy = df_copy[~df_copy.index.duplicated()].asfreq('h')
+
+    hourly_data = pd.DataFrame({
+        'sunshine_hr': df_copy['sunshine_duration'] / 3600,
+        'humidity': df_copy['relative_humidity_2m'],
+        'temp': df_copy['temperature_2m']
+    }).interpolate(limit=max_gap_hours, limit_area='inside')
+
+    return hourly_data.astype(np.float32)
+
+def get_clean_hourly_df(df):
+    """Caps outliers at +/- IQR*1.5 per month and hour of the day (hourly sunshine is always 0 at night)."""
+    groups = [df.index.month, df.index.hour]
+
+    Q1 = df.groupby(groups).transform(lambda values: values.quantile(0.25))
+    Q3 = df.groupby(groups).transform(lambda values: values.quantile(0.75))
+    IQR = Q3 - Q1
+
+    df_clean = df.clip(Q1 - 1.5*IQR, Q3 + 1.5*IQR, axis=None)
+    outlier_count = (df_clean != df).sum()
+
+    for col in df.columns:
+        print(f'Total outliers adjusted in the {col} column: {outlier_count[col]:,}')
+        print(f'Percent of total rows: {outlier_count[col]/len(df):.2%}')
+        print('\n')
+
+    return df_clean.astype(np.float32)
 
 def adjust_outliers(data, columns, granularity='month'):
-    """Caps outliers at +/- IQR*1.5 on the specified per-month or per-season basis."""
+    """Caps outliers at +/- IQR*1.5 on the specified per-month or per-season basis, keeping the column dtypes."""
     
     df_clean = data.copy()
     global_outlier_count = 0
@@ -198,6 +250,9 @@ def adjust_outliers(data, columns, granularity='month'):
             return None
 
 
+        # np.where promotes float32 columns to the float64 bounds
+        df_clean[col] = df_clean[col].astype(data[col].dtype)
+
         global_outlier_count += outlier_count
         print(f'Total outliers adjusted in the {col} column: {outlier_count:,}')
         print(f'Percent of total rows: {outlier_count/len(df_clean):.2%}')
@@ -285,10 +340,261 @@ def print_callback(study, trial):
   print(f"Current value: {trial.value}, Current params: {trial.params}")
   print(f"Current Best value: {study.best_value}, Best params: {study.best_trial.params}")
 
-def get_model(model_name, fh, hyperparams, seed, version=None,
-              model_type='default', n_epochs_override=None):
+def add_early_stopping(pl_trainer_kwargs, patience=10, min_delta=0.0, monitor='val_loss'):
+    """Returns a copy of the trainer kwargs with early stopping and best-weight restoration callbacks added."""
+    pl_trainer_kwargs = {} if pl_trainer_kwargs is None else dict(pl_trainer_kwargs)
+
+    callbacks = list(pl_trainer_kwargs.get('callbacks', []))
+    callbacks.append(EarlyStopping(monitor=monitor, patience=patience, min_delta=min_delta, mode='min'))
+    callbacks.append(RestoreBestWeightsCallback(monitor=monitor, min_delta=min_delta))
+    pl_trainer_kwargs['callbacks'] = callbacks
 
-    """Returns an unfitted model and a semi-unique moniker based on the given arguments, including model version in the case of N-BEATS."""
+    return pl_trainer_kwargs
+
+def get_callback(model, callback_type):
+    """Returns the first trainer callback of the given type attached to a darts model, or None."""
+    trainer_params = getattr(model, 'trainer_params', None) or {}
+
+    for callback in trainer_params.get('callbacks', []):
+        if isinstance(callback, callback_type):
+            return callback
+
+    return None
+
+def get_validation_split(target_train, cov_train, input_chunk_length, val_length=None, output_chunk_length=1):
+    """
+    Carves a validation tail off the training series and returns the fit() keyword arguments.
+    The validation series are extended backwards by input_chunk_length so that the first
+    validation target point can be predicted. Defaults to the last 10% of the training data.
+    Raises a ValueError unless the tail holds at least one output chunk and the rest at least one
+    training window (input_chunk_length + output_chunk_length points).
+    """
+    if val_length is None:
+        val_length = int(len(target_train) * 0.1)
+
+    max_val_length = len(target_train) - input_chunk_length - output_chunk_length
+    if not output_chunk_length <= val_length <= max_val_length:
+        raise ValueError(f'val_length must be between output_chunk_length ({output_chunk_length}) and '
+                         f'{max_val_length} for {len(target_train)} training points and an input_chunk_length of '
+                         f'{input_chunk_length}, got {val_length}')
+
+    fit_end = len(target_train) - val_length
+    val_start = fit_end - input_chunk_length
+
+    return {
+        'series': target_train[:fit_end],
+        'past_covariates': cov_train[:fit_end],
+        'val_series': target_train[val_start:],
+        'val_past_covariates': cov_train[val_start:],
+    }
+
+def cpu_supports_bf16():
+    """Returns True if the CPU advertises native bfloat16 instructions (AVX512-BF16 or AMX-BF16)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def get_cpu_profile(model_name=None, num_threads=None, num_interop_threads=None, bf16=None,
+                    compile_forward=None, num_loader_workers=None):
+    """
+    Returns the CPU training settings for the neural models. Settings left as None are derived from the
+    machine: the DataLoader gets a few workers on larger nodes, the remaining cores go to intra-op threads,
+    bfloat16 autocast is enabled when the CPU supports it natively, and torch.compile is used for the
+    feed-forward N-BEATS/N-HiTS stacks (recurrent models gain little from it).
+    """
+    n_cores = os.cpu_count() or 1
+
+    if num_loader_workers is None:
+        num_loader_workers = 0 if n_cores <= 4 else min(4, n_cores // 8 or 1)
+    if num_threads is None:
+        num_threads = max(1, n_cores - num_loader_workers)
+    if num_interop_threads is None:
+        num_interop_threads = max(1, min(4, n_cores // 4))
+    if bf16 is None:
+        bf16 = cpu_supports_bf16()
+    if compile_forward is None:
+        compile_forward = hasattr(torch, 'compile') and model_name in ['nbeats', 'nhits']
+
+    return {
+        'num_threads': num_threads,
+        'num_interop_threads': num_interop_threads,
+        'bf16': bf16,
+        'compile_forward': compile_forward,
+        'num_loader_workers': num_loader_workers,
+    }
+
+def get_cpu_trainer_kwargs(model_name, performance_profile='cpu', callbacks=None):
+    """Returns PyTorch Lightning trainer kwargs applying the CPU profile ('cpu' or a dict of get_cpu_profile overrides)."""
+    if performance_profile == 'cpu':
+        profile = get_cpu_profile(model_name)
+    elif isinstance(performance_profile, dict):
+        profile = get_cpu_profile(model_name, **performance_profile)
+    else:
+        raise ValueError(f'Invalid performance profile: {performance_profile}. Please indicate "cpu" or a dict of settings.')
+
+    pl_trainer_kwargs = {
+        'accelerator': 'cpu',
+        'callbacks': list(callbacks or []) + [CPUPerformanceCallback(profile)],
+    }
+
+    if profile['bf16']:
+        pl_trainer_kwargs['precision'] = 'bf16-mixed'
+
+    return pl_trainer_kwargs
+
+def get_hourly_lags(recent_hours=48, n_days=14) -> list:
+    """Returns sparse hourly lags: the last recent_hours plus the same hour on each of the previous n_days days."""
+    return sorted(set(range(-recent_hours, 0)) | {-24 * day for day in range(1, n_days + 1)})
+
+def get_chunk_lengths(fh, resolution='daily'):
+    """
+    Returns the default input_chunk_length and regression lags for a forecast horizon. Daily models look back
+    2 * fh days; hourly models (168/672-step horizons) look back at most two weeks, and the regression models
+    use sparse lags rather than thousands of dense ones.
+    """
+    if resolution == 'daily':
+        return fh * 2, fh * 2
+    elif resolution == 'hourly':
+        return min(fh * 2, 14 * 24), get_hourly_lags()
+
+    raise ValueError(f"Invalid resolution {resolution}, expected 'daily' or 'hourly'")
+
+def get_memory_budget_mb(fraction=0.8):
+    """Returns the given fraction of the GPU memory, if available, or of the physical memory in MB."""
+    if torch.cuda.is_available():
+        total_memory = torch.cuda.get_device_properties(0).total_memory
+    else:
+        total_memory = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+    return fraction * total_memory / 1024**2
+
+def get_memory_aware_batch_size(input_chunk_length, output_chunk_length, n_features=3, memory_budget_mb=None,
+                                activation_factor=256, min_batch_size=16, max_batch_size=1024):
+    """
+    Returns the largest power of two batch size whose estimated training footprint, float32 windows times an
+    activation_factor for the network's intermediate tensors and gradients, fits in memory_budget_mb (default
+    a quarter of the GPU or physical memory).
+    """
+    if memory_budget_mb is None:
+        memory_budget_mb = get_memory_budget_mb(0.25)
+
+    sample_mb = (input_chunk_length * n_features + output_chunk_length) * 4 * activation_factor / 1024**2
+    batch_size = 2 ** int(np.log2(max(memory_budget_mb / sample_mb, 1)))
+
+    return int(min(max(batch_size, min_batch_size), max_batch_size))
+
+def get_probabilistic_kwargs(model_name, quantiles=None) -> dict:
+    """
+    Returns the get_model constructor arguments that make a model forecast the given quantiles (0.5 is always
+    added, as the median is the point forecast): a quantile regression head for the neural models and one
+    quantile objective per level for LightGBM/XGBoost. Other models keep their point or sampled forecasts.
+    """
+    if quantiles is None:
+        return {}
+
+    quantiles = sorted(set(float(quantile) for quantile in quantiles) | {0.5})
+
+    if model_name in ['lstm', 'gru', 'nbeats', 'nhits']:
+        return {'likelihood': QuantileRegression(quantiles)}
+    if model_name in ['lgbm', 'xgboost']:
+        return {'likelihood': 'quantile', 'quantiles': quantiles}
+
+    return {}
+
+def get_future_covariate_kwargs(model_name, fh, future_covariates=False) -> dict:
+    """
+    Returns the get_model constructor arguments that make the regression models use future covariates over the
+    forecast horizon (lags 0 to fh - 1). BlockRNNModel takes future covariates as they are; N-BEATS, N-HiTS and
+    the statistical models do not support them.
+    """
+    if future_covariates and model_name in ['rf', 'xgboost', 'lgbm']:
+        return {'lags_future_covariates': (0, fh)}
+
+    return {}
+
+def get_future_covariate_ts(feature_stores, has_outliers, future_feature_names) -> TimeSeries:
+    """
+    Returns the future_feature_names of the feature store (see feature_functions.get_feature_stores) as future
+    covariates over the whole series. Only calendar features are known in advance, others raise a ValueError.
+    """
+    if feature_stores is None:
+        raise ValueError('future_feature_names requires feature_stores')
+
+    store = feature_stores[has_outliers]
+    unknown = [name for name in future_feature_names if name not in store['groups']['calendar']]
+    if unknown:
+        raise ValueError(f"Future covariates must be calendar features known in advance, not {unknown}")
+
+    return ff.get_feature_ts(store, list(future_feature_names))
+
+def predict_quantiles(model, fh, quantiles, series=None, past_covariates=None, target_scaler=None,
+                      num_samples=500, future_covariates=None) -> dict:
+    """
+    Returns {quantile: array of shape (fh, n_components)} of a fitted model's forecast, or None if the model is
+    deterministic. Quantile models (see get_probabilistic_kwargs) return all their quantiles from a single
+    forward pass via predict_likelihood_parameters, with no sampling. Other probabilistic models (e.g.
+    ExponentialSmoothing) draw num_samples paths in one batched predict call, from which all quantiles are
+    taken at once. Scaled forecasts are inverse transformed in one batch, the quantiles as samples of one series.
+    """
+    quantiles = sorted(float(quantile) for quantile in quantiles)
+    predict_kwargs = {} if series is None else {'series': series, 'past_covariates': past_covariates}
+    if future_covariates is not None:
+        predict_kwargs['future_covariates'] = future_covariates
+    likelihood = getattr(model, 'likelihood', None)
+
+    if likelihood is not None:
+        parameters = model.predict(n=fh, predict_likelihood_parameters=True, **predict_kwargs)
+        model_quantiles = (likelihood.quantiles if isinstance(likelihood, QuantileRegression)
+                           else model.model_params['quantiles'])
+        model_quantiles = [float(quantile) for quantile in model_quantiles]
+
+        missing = set(quantiles) - set(model_quantiles)
+        if missing:
+            raise ValueError(f'The model was built for quantiles {model_quantiles}, not {sorted(missing)}')
+
+        # components are ordered by target component, then quantile
+        n_components = parameters.width // len(model_quantiles)
+        values = parameters.values(copy=False).reshape(fh, n_components, len(model_quantiles))
+        samples = TimeSeries.from_times_and_values(parameters.time_index, values)
+
+        if target_scaler is not None:
+            samples = target_scaler.inverse_transform(samples)
+
+        values = samples.all_values(copy=False)
+        return {quantile: values[:, :, model_quantiles.index(quantile)] for quantile in quantiles}
+
+    if not model.supports_probabilistic_prediction:
+        return None
+
+    samples = model.predict(n=fh, num_samples=num_samples, **predict_kwargs)
+    if target_scaler is not None:
+        samples = target_scaler.inverse_transform(samples)
+
+    values = np.quantile(samples.all_values(copy=False), quantiles, axis=2)
+    return dict(zip(quantiles, values))
+
+def get_model(model_name, fh, hyperparams, seed, version=None,
+              model_type='default', n_epochs_override=None,
+              early_stopping=False, patience=10, min_delta=0.0, performance_profile=None,
+              batch_size_override=None, resolution='daily', quantiles=None, future_covariates=False):
+
+    """Returns an unfitted model and a semi-unique moniker based on the given arguments, including model version in the case of N-BEATS.
+    With early_stopping=True, the neural models stop once the validation loss plateaus for `patience` epochs and
+    restore their best weights; `n_epochs` then acts as an upper bound.
+    On machines without a GPU, performance_profile='cpu' (or a dict of get_cpu_profile overrides) applies the CPU
+    training profile to the neural models. batch_size_override replaces the darts default batch size of the
+    default neural models (e.g. with the fastest size found by hyperparam_search.autotune_batch_sizes).
+    resolution='hourly' gives the default models chunk lengths and lags that suit hourly data (see
+    get_chunk_lengths), daily seasonality for the baselines, single-model regression and, without a
+    batch_size_override, a memory-aware batch size.
+    quantiles (e.g. [0.05, 0.25, 0.5, 0.75, 0.95]) gives the neural models a quantile regression head and
+    LightGBM/XGBoost quantile objectives, see get_probabilistic_kwargs and predict_quantiles.
+    future_covariates=True gives the regression models future covariate lags over the horizon, see
+    get_future_covariate_kwargs; fit them with run_experiment(future_feature_names=...)."""
 
     if model_name == 'nbeats': 
         model_name_fh = f'{model_name}_{model_type}_{version}_fh{fh}' 
@@ -297,19 +603,26 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
     else:
         model_name_fh = f'{model_name}_fh{fh}'
 
+    input_chunk_length, lags = get_chunk_lengths(fh, resolution)
+    probabilistic_kwargs = get_probabilistic_kwargs(model_name, quantiles)
+    future_covariate_kwargs = get_future_covariate_kwargs(model_name, fh, future_covariates)
+    seasonal_periods = 365 if resolution == 'daily' else 24
+
     if model_name in non_ml_models:
         if model_name == 'ets':
             model = ExponentialSmoothing(trend=ModelMode.ADDITIVE,
                                         seasonal=SeasonalityMode.ADDITIVE,
-                                        seasonal_periods=365)    
+                                        seasonal_periods=seasonal_periods)    
+        if model_name == 'ets_fast':
+            model = mf.FastETS(seasonal_periods=seasonal_periods)
         if model_name == 'naive_drift':
             model = NaiveDrift()
         if model_name == 'naive_seasonal':
-            model = NaiveSeasonal(K=365)
+            model = NaiveSeasonal(K=seasonal_periods)
         if model_name == 'naive_mean':
             model = NaiveMean()
         if model_name == 'naive_moving_average':
-            model = NaiveMovingAverage(input_chunk_length=fh*2)
+            model = NaiveMovingAverage(input_chunk_length=input_chunk_length)
         
         return model, model_name_fh, n_epochs_override
 
@@ -320,12 +633,21 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
             pl_trainer_kwargs = {
                 'accelerator': 'gpu'
             }
+        elif performance_profile is not None:
+            pl_trainer_kwargs = get_cpu_trainer_kwargs(model_name, performance_profile)
         else:
             pl_trainer_kwargs = None
 
-        
+        if early_stopping:
+            pl_trainer_kwargs = add_early_stopping(pl_trainer_kwargs, patience=patience, min_delta=min_delta)
+
     hyp = hyperparams[model_name] 
 
+    if batch_size_override is None and resolution == 'hourly':
+        batch_size = get_memory_aware_batch_size(input_chunk_length, fh)
+    else:
+        batch_size = batch_size_override or 32
+
     if model_type == 'default':
 
         if model_name in ['lstm', 'gru']:
@@ -333,8 +655,10 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
             if n_epochs_override:
                 model = BlockRNNModel(
                     model = model_name.upper(),
-                    input_chunk_length = fh * 2,
+                    input_chunk_length = input_chunk_length,
                     output_chunk_length = fh,
+                    **probabilistic_kwargs,
+                    batch_size = batch_size,
                     n_epochs = n_epochs_override,
                     pl_trainer_kwargs = pl_trainer_kwargs,
                 )
@@ -342,8 +666,10 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
             else:
                 model = BlockRNNModel(
                     model = model_name.upper(),
-                    input_chunk_length = fh * 2,
+                    input_chunk_length = input_chunk_length,
                     output_chunk_length = fh,
+                    **probabilistic_kwargs,
+                    batch_size = batch_size,
                     pl_trainer_kwargs = pl_trainer_kwargs,
                 )
 
@@ -351,16 +677,20 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
 
             if n_epochs_override:
                 model = NBEATSModel(
-                    input_chunk_length = fh * 2,
+                    input_chunk_length = input_chunk_length,
                     output_chunk_length = fh,
+                    **probabilistic_kwargs,
+                    batch_size = batch_size,
                     generic_architecture = True if version == 'generic' else False,
                     n_epochs = n_epochs_override,
                     pl_trainer_kwargs = pl_trainer_kwargs
                 )
             else:
                 model = NBEATSModel(
-                    input_chunk_length = fh * 2,
+                    input_chunk_length = input_chunk_length,
                     output_chunk_length = fh,
+                    **probabilistic_kwargs,
+                    batch_size = batch_size,
                     generic_architecture = True if version == 'generic' else False,
                     pl_trainer_kwargs = pl_trainer_kwargs
                 )
@@ -369,38 +699,50 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
 
             if n_epochs_override:
                 model = NHiTSModel(
-                    input_chunk_length = fh * 2,
+                    input_chunk_length = input_chunk_length,
                     output_chunk_length = fh,
+                    **probabilistic_kwargs,
+                    batch_size = batch_size,
                     n_epochs = n_epochs_override,
                     pl_trainer_kwargs = pl_trainer_kwargs
                 )
             else:
                 model = NHiTSModel(
-                    input_chunk_length = fh * 2,
+                    input_chunk_length = input_chunk_length,
                     output_chunk_length = fh,
+                    **probabilistic_kwargs,
+                    batch_size = batch_size,
                     pl_trainer_kwargs = pl_trainer_kwargs
                 )
 
         elif model_name == 'rf':
             model = RandomForest(
-                lags = fh*2,
-                lags_past_covariates = fh*2,
-                output_chunk_length = fh
+                lags = lags,
+                lags_past_covariates = lags,
+                **future_covariate_kwargs,
+                output_chunk_length = fh,
+                multi_models = resolution == 'daily'
             )
 
         elif model_name == 'xgboost':
             model = XGBModel(
-                lags = fh*2,
-                lags_past_covariates = fh*2,
+                lags = lags,
+                lags_past_covariates = lags,
+                **future_covariate_kwargs,
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
+                multi_models = resolution == 'daily',
                 random_state=seed
             )
 
         elif model_name == 'lgbm':
             model = LightGBMModel(
-                lags = fh*2,
-                lags_past_covariates = fh*2,
+                lags = lags,
+                lags_past_covariates = lags,
+                **future_covariate_kwargs,
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
+                multi_models = resolution == 'daily',
                 verbose=-1,
                 random_state=seed
             )
@@ -413,6 +755,7 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
                 model = model_name.upper(),
                 input_chunk_length = hyp[fh]['parameters']['input_chunk_length'],
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
                 batch_size =  hyp[fh]['parameters']['batch_size'],
                 n_epochs = hyp[fh]['parameters']['n_epochs'] if n_epochs_override is None else n_epochs_override, 
                 hidden_dim = hyp[fh]['parameters']['hidden_dim'],
@@ -428,6 +771,7 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
                 random_state=seed,
                 input_chunk_length = hyp[version][fh]['parameters']['input_chunk_length'],
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
                 num_stacks = hyp[version][fh]['parameters']['num_stacks'],
                 num_blocks = hyp[version][fh]['parameters']['num_blocks'],
                 num_layers = hyp[version][fh]['parameters']['num_layers'],
@@ -447,6 +791,7 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
                 random_state=seed,
                 input_chunk_length = hyp[fh]['parameters']['input_chunk_length'],
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
                 num_stacks = hyp[fh]['parameters']['num_stacks'],
                 num_blocks = hyp[fh]['parameters']['num_blocks'],
                 num_layers = hyp[fh]['parameters']['num_layers'],
@@ -462,6 +807,7 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
             model = RandomForest(
                 lags = hyp[fh]['parameters']['lags'],
                 lags_past_covariates = hyp[fh]['parameters']['lags_past_covariates'],
+                **future_covariate_kwargs,
                 n_estimators = hyp[fh]['parameters']['n_estimators'],
                 max_depth = hyp[fh]['parameters']['max_depth'],
                 output_chunk_length = fh,
@@ -472,7 +818,9 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
             model = XGBModel(
                 lags = hyp[fh]['parameters']['lags'],
                 lags_past_covariates = hyp[fh]['parameters']['lags_past_covariates'],
+                **future_covariate_kwargs,
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
                 random_state=seed
             )
 
@@ -480,7 +828,9 @@ def get_model(model_name, fh, hyperparams, seed, version=None,
             model = LightGBMModel(
                 lags = hyp[fh]['parameters']['lags'],
                 lags_past_covariates = hyp[fh]['parameters']['lags_past_covariates'],
+                **future_covariate_kwargs,
                 output_chunk_length = fh,
+                **probabilistic_kwargs,
                 verbose=-1,
                 random_state=seed
             )
@@ -536,9 +886,32 @@ def get_reformatted_hyperparams(hyp_dict, forecast_horizons):
 
 def run_experiment(model, model_names, n_epochs_override, hyperparameters, cutoff_date, fh, 
                    df_outliers, df_clean, has_outliers, results,
-                   models_directory, results_directory, seed=None, verbose=True):
+                   models_directory, results_directory, seed=None, verbose=True, val_length=None,
+                   model_cache_directory=None, export_format=None, quantize=False, forecast_store_directory=None,
+                   feature_stores=None, feature_names=None, max_samples_per_ts=None, quantiles=None, num_samples=500,
+                   future_feature_names=None):
     
-    """Runs an experiment and saves the results to a file."""
+    """
+    Runs an experiment and saves the results to a file. Neural models built with early_stopping=True
+    are fitted against a validation tail of val_length points carved off the training data.
+    If model_cache_directory is given, fitted models are cached by a hash of their resolved configuration,
+    seed, cutoff date, outlier flag and training data, and a cached model skips straight to prediction
+    (its recorded training time is reported). See cache_functions.evict_model_cache for cleanup.
+    If export_format ('torchscript' or 'onnx') is given, neural models are also exported next to the fitted
+    model as a standalone inference artifact, int8-quantized if quantize, and its accuracy delta is printed.
+    If forecast_store_directory is given, the predictions and actuals are persisted there (see
+    evaluation_functions) so that new metrics and ensembles can be computed without refitting.
+    feature_stores and feature_names select precomputed past covariates, see train_test_split.
+    future_feature_names selects calendar features of feature_stores as future covariates (see
+    get_future_covariate_ts) for the models that support them: BlockRNNModel and the regression models built
+    with get_model(future_covariates=True).
+    max_samples_per_ts caps the training windows per epoch of the neural and regression models to the most
+    recent ones, e.g. for hourly data (24x the windows of daily data).
+    quantiles also forecasts those quantiles (see predict_quantiles; build the model with the same quantiles in
+    get_model), stores them with the forecasts and prints their CRPS and interval coverage. The point forecast of
+    quantile models is their 0.5 quantile, as their predict(n=fh) returns a random draw among the quantiles.
+    Returns the recorded results row as a dict.
+    """
     current_results = results.copy()
 
     model_name = model_names[0]
@@ -551,7 +924,17 @@ def run_experiment(model, model_names, n_epochs_override, hyperparameters, cutof
 
     print(f'\nRunning {model_name_fh} Experiments - Forecast Horizon: {fh} | Outlier Flag: {has_outliers}...\n') 
 
-    target_train, target_test, cov_train = train_test_split(cutoff_date, df_outliers, df_clean,  has_outliers=has_outliers)
+    target_train, target_test, cov_train = train_test_split(cutoff_date, df_outliers, df_clean,  has_outliers=has_outliers,
+                                                            feature_stores=feature_stores, feature_names=feature_names)
+    target_scaler, cov_scaler = None, None
+    unscaled_target_train, unscaled_cov_train = target_train, cov_train
+
+    future_cov = None
+    if future_feature_names is not None:
+        if model.supports_future_covariates:
+            future_cov = get_future_covariate_ts(feature_stores, has_outliers, future_feature_names)
+        else:
+            print(f'{model_name_fh} does not support future covariates, fitting without them')
 
     if model_name not in non_ml_models and model_name != 'nbeats':
         target_scaler = Scaler()
@@ -559,41 +942,137 @@ def run_experiment(model, model_names, n_epochs_override, hyperparameters, cutof
         cov_scaler = Scaler() 
         cov_train = cov_scaler.fit_transform(cov_train)
 
-    start_time = time.perf_counter()
+        if future_cov is not None:
+            future_scaler = Scaler()
+            future_scaler.fit(future_cov.split_after(pd.Timestamp(cutoff_date))[0])
+            future_cov = future_scaler.transform(future_cov)
 
-    if model_name in non_ml_models:
-        model.fit(series=target_train)
+    early_stopping_callback = get_callback(model, RestoreBestWeightsCallback)
+
+    if early_stopping_callback is not None:
+        fit_kwargs = get_validation_split(target_train, cov_train, model.input_chunk_length, val_length,
+                                          model.output_chunk_length)
+    else:
+        fit_kwargs = {'series': target_train, 'past_covariates': cov_train}
+
+    if future_cov is not None:
+        fit_kwargs['future_covariates'] = future_cov
+        if 'val_series' in fit_kwargs:
+            fit_kwargs['val_future_covariates'] = future_cov
+
+    if max_samples_per_ts is not None and model_name not in non_ml_models:
+        fit_kwargs['max_samples_per_ts'] = max_samples_per_ts
+
+    cpu_callback = get_callback(model, CPUPerformanceCallback)
+
+    if cpu_callback is not None:
+        fit_kwargs['dataloader_kwargs'] = cpu_callback.dataloader_kwargs
+
+    cached_model = None
 
-    elif model_name in ['nbeats', 'lstm', 'gru', 'nhits']:
-        if seed:
-            torch.manual_seed(seed)
-        if model_name == 'nbeats':
+    if model_cache_directory is not None:
+        data_fingerprint = cf.get_data_fingerprint(target_train, cov_train)
+        cache_key = cf.get_model_cache_key(model, seed, cutoff_date, has_outliers, data_fingerprint,
+                                           fh=fh, val_length=val_length if early_stopping_callback else None,
+                                           **({'future_feature_names': list(future_feature_names)}
+                                              if future_cov is not None else {}),
+                                           **({'max_samples_per_ts': max_samples_per_ts} if max_samples_per_ts else {}))
+        cached_model, cache_metadata = cf.load_cached_model(model_cache_directory, cache_key, model)
+
+    if cached_model is not None:
+        model = cached_model
+        training_time = cache_metadata['training_time']
+        epochs_trained = cache_metadata['epochs_trained']
+        print(f'Loaded cached fitted model {cache_key[:12]} for {model_name_fh}, skipping training')
+
+    else:
+        start_time = time.perf_counter()
+
+        if model_name in non_ml_models:
+            model.fit(series=target_train)
+
+        elif model_name in ['nbeats', 'lstm', 'gru', 'nhits']:
+            if seed:
+                torch.manual_seed(seed)
+            if model_name == 'nbeats':
+                model.fit(**fit_kwargs, verbose=verbose)
+            else:
+                model.fit(**fit_kwargs)
+                
+            model.save(f'{models_directory}cutoff_date={cutoff_date}/{model_name_fh}_fitted.pt') 
+
+        else:
             model.fit(series=target_train,
                         past_covariates=cov_train,
-                        verbose=verbose)
+                        future_covariates=future_cov,
+                        max_samples_per_ts=max_samples_per_ts)
+            model.save(f'{models_directory}cutoff_date={cutoff_date}/{model_name_fh}_fitted.pkl')
+
+        end_time = time.perf_counter()
+        training_time = round((end_time - start_time) / 60, 3)
+        epochs_trained = early_stopping_callback.epochs_trained if early_stopping_callback is not None else None
+
+        if model_cache_directory is not None:
+            cf.save_cached_model(model_cache_directory, cache_key, model,
+                                 {'model_name_fh': model_name_fh, 'training_time': training_time,
+                                  'epochs_trained': epochs_trained})
+
+    quantile_predictions = None
+    if quantiles is not None:
+        # the median is always forecast, see get_probabilistic_kwargs
+        requested_quantiles = set(float(quantile) for quantile in quantiles)
+        predicted_quantiles = sorted(requested_quantiles | {0.5})
+
+        if model_name in non_ml_models:
+            quantile_predictions = predict_quantiles(model, fh, predicted_quantiles, num_samples=num_samples)
         else:
-            model.fit(series=target_train,
-                        past_covariates=cov_train)
-            
-        model.save(f'{models_directory}cutoff_date={cutoff_date}/{model_name_fh}_fitted.pt') 
+            quantile_predictions = predict_quantiles(model, fh, predicted_quantiles, target_train, cov_train,
+                                                     target_scaler, num_samples, future_cov)
 
+    if quantile_predictions is not None and getattr(model, 'likelihood', None) is not None:
+        # predict(n=fh) of a quantile model returns a random draw from its quantiles, the median is the point forecast
+        predictions = TimeSeries.from_times_and_values(target_test[:fh].time_index, quantile_predictions[0.5],
+                                                       columns=target_test.components)
     else:
-        model.fit(series=target_train,
-                    past_covariates=cov_train)
-        model.save(f'{models_directory}cutoff_date={cutoff_date}/{model_name_fh}_fitted.pkl')
+        if model_name in non_ml_models:
+            predictions = model.predict(n=fh)
+        else:
+            predictions = model.predict(n=fh,
+                                        series=target_train,
+                                        past_covariates=cov_train,
+                                        future_covariates=future_cov)
 
-    end_time = time.perf_counter()
-    training_time = round((end_time - start_time) / 60, 3)
+        if model_name not in non_ml_models and model_name != 'nbeats':
+            predictions = target_scaler.inverse_transform(predictions)
 
-    if model_name in non_ml_models:
-        predictions = model.predict(n=fh)
-    else:
-        predictions = model.predict(n=fh,
-                                    series=target_train,
-                                    past_covariates=cov_train)
-        
-    if model_name not in non_ml_models and model_name != 'nbeats':
-        predictions = target_scaler.inverse_transform(predictions)
+    if quantiles is not None:
+        if quantile_predictions is None:
+            print(f'{model_name_fh} is deterministic, no quantile forecasts recorded')
+        else:
+            quantile_predictions = {quantile: values for quantile, values in quantile_predictions.items()
+                                    if quantile in requested_quantiles}
+            actual_values = target_test[:fh].values(copy=False)[np.newaxis, :, 0]
+            quantile_values = np.stack([values[:, 0] for values in quantile_predictions.values()], axis=-1)[np.newaxis]
+            crps = ef.crps_rows_from_quantiles(actual_values, quantile_values, list(quantile_predictions))[0]
+            coverage = np.mean((actual_values >= quantile_values[..., 0]) & (actual_values <= quantile_values[..., -1]))
+            print(f'{model_name_fh} quantile forecasts: CRPS {crps:.4f}, '
+                  f'{min(quantile_predictions):g}-{max(quantile_predictions):g} interval coverage {coverage:.0%}')
+
+    if export_format is not None and future_cov is not None:
+        print(f'Inference artifacts take past covariates only, {model_name_fh} was not exported')
+
+    elif export_format is not None and model_name in ['nbeats', 'lstm', 'gru', 'nhits']:
+        extension = 'pt' if export_format == 'torchscript' else 'onnx'
+        artifact_path = f"{path}{model_name_fh}_{export_format}{'_int8' if quantize else ''}.{extension}"
+        export_report = inf.export_inference_artifact(model, artifact_path, unscaled_target_train,
+                                                      unscaled_cov_train, target_scaler, cov_scaler,
+                                                      export_format=export_format, quantize=quantize)
+        print(f"Exported {artifact_path} ({export_report['size_kb']} KB, loads in {export_report['load_time_ms']} ms): "
+              f"RMSE delta {export_report['rmse_delta']}, max abs delta {export_report['max_abs_delta']:.4g}")
+
+    if forecast_store_directory is not None:
+        ef.save_forecasts(forecast_store_directory, predictions, target_test[:fh], model_names, fh,
+                          cutoff_date, has_outliers, quantile_predictions)
 
     rmse_score = round(rmse(predictions, target_test[:fh]), 4)
     mae_score = round(mae(predictions, target_test[:fh]), 4)
@@ -636,6 +1115,8 @@ def run_experiment(model, model_names, n_epochs_override, hyperparameters, cutof
         except NameError:
             n_epochs = np.nan
 
+    if early_stopping_callback is not None:
+        n_epochs = epochs_trained
 
     has_n_epochs_override = True if n_epochs_override else False
 
@@ -673,18 +1154,29 @@ def run_experiment(model, model_names, n_epochs_override, hyperparameters, cutof
     file_name = f'{path}{model_name}_cutoffdate={cutoff_date}_results.csv' 
     pd.DataFrame(results).to_csv(file_name, index=False)
 
-def train_test_split(cutoff_date, df_outliers=None, df_clean=None, has_outliers=False):
+    return {key: values[-1] for key, values in current_results.items()}
 
+def train_test_split(cutoff_date, df_outliers=None, df_clean=None, has_outliers=False, feature_stores=None,
+                     feature_names=None):
+    """
+    Splits the target and past covariates at the cutoff date. If feature_stores (from
+    feature_functions.get_feature_stores) is given, the past covariates are the feature_names selected from
+    the precomputed store (default: its raw group) instead of the raw columns.
+    """
     if has_outliers==False:
 
         target = create_timeseries(df_clean, 'sunshine_hr')
         # create past covariates as stacked timeseries of exogenous variables
-        past_cov = get_covariate_ts(df_clean)
+        past_cov = get_covariate_ts(df_clean) if feature_stores is None else None
 
     elif has_outliers == True:
 
         target = create_timeseries(df_outliers, 'sunshine_hr')
-        past_cov = get_covariate_ts(df_outliers)
+        past_cov = get_covariate_ts(df_outliers) if feature_stores is None else None
+
+    if feature_stores is not None:
+        feature_names = feature_names if feature_names is not None else ff.get_feature_names(feature_stores[has_outliers])
+        past_cov = ff.get_feature_ts(feature_stores[has_outliers], feature_names)
 
     # create training and testing datasets
     training_cutoff = pd.Timestamp(cutoff_date)
@@ -784,6 +1276,91 @@ class PyTorchLightningPruningCallback(Callback):
             message = "Trial was pruned at epoch {}.".format(epoch)
             raise optuna.TrialPruned(message)
 
+class RestoreBestWeightsCallback(Callback):
+    """
+    PyTorch Lightning callback that keeps a copy of the weights with the best monitored
+    validation score and loads them back once training ends (e.g. after early stopping).
+    The number of epochs actually trained is available as `epochs_trained` after fitting.
+    """
+
+    def __init__(self, monitor: str = 'val_loss', min_delta: float = 0.0) -> None:
+        super().__init__()
+
+        self.monitor = monitor
+        self.min_delta = min_delta
+        self.best_score = None
+        self.best_epoch = None
+        self.epochs_trained = 0
+        self._best_state = None
+
+    def on_fit_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self.best_score = None
+        self.best_epoch = None
+        self.epochs_trained = 0
+        self._best_state = None
+
+    def on_validation_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if trainer.sanity_checking:
+            return
+
+        current_score = trainer.callback_metrics.get(self.monitor)
+        if current_score is None:
+            return
+
+        current_score = float(current_score)
+        if self.best_score is None or current_score < self.best_score - self.min_delta:
+            self.best_score = current_score
+            self.best_epoch = pl_module.current_epoch
+            self._best_state = {k: v.detach().clone() for k, v in pl_module.state_dict().items()}
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self.epochs_trained = pl_module.current_epoch + 1
+
+    def on_fit_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if self._best_state is not None:
+            pl_module.load_state_dict(self._best_state)
+
+        # release the copy so it is not pickled along with the saved model
+        self._best_state = None
+
+class CPUPerformanceCallback(Callback):
+    """
+    PyTorch Lightning callback applying a CPU profile (see get_cpu_profile): configures the torch
+    intra/inter-op thread pools and compiles the module's forward pass for the duration of fit.
+    The DataLoader settings are exposed through `dataloader_kwargs` for the fit call.
+    """
+
+    def __init__(self, profile: dict) -> None:
+        super().__init__()
+
+        self.profile = profile
+
+    @property
+    def dataloader_kwargs(self) -> dict:
+        num_workers = self.profile['num_loader_workers']
+        return {'num_workers': num_workers, 'persistent_workers': num_workers > 0}
+
+    def setup(self, trainer: Trainer, pl_module: LightningModule, stage: str) -> None:
+        torch.set_num_threads(self.profile['num_threads'])
+
+        # the inter-op pool can only be sized before its first use in the process
+        try:
+            torch.set_num_interop_threads(self.profile['num_interop_threads'])
+        except RuntimeError:
+            pass
+
+    def on_fit_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if self.profile['compile_forward']:
+            pl_module.forward = torch.compile(pl_module.forward)
+
+    def on_fit_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        # drop the compiled wrapper so the module pickles and predicts eagerly
+        pl_module.__dict__.pop('forward', None)
+
+    def on_exception(self, trainer: Trainer, pl_module: LightningModule, exception: BaseException) -> None:
+        # on_fit_end is skipped when fit raises (e.g. a pruned Optuna trial)
+        pl_module.__dict__.pop('forward', None)
+
 def print_callback(study, trial):
   """Optional callback for sanity checks during Optuna trials."""
   print(f"Current value: {trial.value}, Current params: {trial.params}")
@@ -803,19 +1380,75 @@ def generate_cutoff_date(start_date: str, end_date:str, seed=None, n=1, replace=
     else:
         return final_dates
 
+def generate_stratified_cutoff_dates(start_date: str, end_date: str, n: int, seed=None, within='season',
+                                     exclude=None) -> list:
+    """
+    Generates n distinct cutoff dates from start_date to end_date (inclusive) stratified by year and by season
+    (within='season', DJF/MAM/JJA/SON) or month (within='month'): the seasons or months are cycled in a random
+    order and each pick takes the least used year, so every prefix of the returned list is as balanced as
+    possible and cutoffs can be added a few at a time (see sweep_functions.run_adaptive_sweep). exclude lists
+    dates that must not be picked, e.g. cutoffs already run.
+    """
+    rng = np.random.default_rng(seed)
+    all_dates = pd.date_range(start_date, end_date)
+    all_dates = all_dates[~all_dates.isin(pd.to_datetime(list(exclude or [])))]
+
+    if within == 'season':
+        periods = (all_dates.month.to_numpy() % 12) // 3
+    elif within == 'month':
+        periods = all_dates.month.to_numpy()
+    else:
+        raise ValueError(f"Invalid within {within}, expected 'season' or 'month'")
+
+    years = all_dates.year.to_numpy()
+    is_available = np.ones(len(all_dates), dtype=bool)
+    year_counts = {year: 0 for year in np.unique(years)}
+    period_order = []
+    final_dates = []
+
+    while len(final_dates) < min(n, len(all_dates)):
+        if not period_order:
+            period_order = list(rng.permutation(np.unique(periods[is_available])))
+        period = period_order.pop(0)
+
+        candidates = np.flatnonzero(is_available & (periods == period))
+        if len(candidates) == 0:
+            continue
+
+        # least used years first, ties broken at random
+        candidate_years = np.unique(years[candidates])
+        least_used = min(year_counts[year] for year in candidate_years)
+        year = rng.choice([year for year in candidate_years if year_counts[year] == least_used])
+
+        position = rng.choice(candidates[years[candidates] == year])
+        is_available[position] = False
+        year_counts[year] += 1
+        final_dates.append(all_dates[position].strftime('%Y-%m-%d'))
+
+    return final_dates
+
 def generate_error_table(df:pd.DataFrame, required_columns:list, index:list, 
-                          pivot_column='FH', error_metric='rmse', outlier_split=True):
-    """Generates a summary table for the given error metric. """ 
+                          pivot_column='FH', error_metric='rmse', outlier_split=True, horizons=None):
+    """
+    Generates a summary table for the given error metric. horizons are the forecast horizons to include as
+    ints or 'FH-{h}' labels, default all horizons in df. For large result sets see
+    evaluation_functions.ResultsAggregator, which builds the same table from incremental aggregates.
+    """ 
     required_columns = required_columns + [error_metric]
 
+    if horizons is None:
+        horizon_columns = sorted(df[pivot_column].unique(), key=lambda label: int(str(label).split('-')[-1]))
+    else:
+        horizon_columns = [horizon if isinstance(horizon, str) else f'FH-{horizon}' for horizon in horizons]
+
     error_table = df[required_columns]\
                         .pivot_table(index=index, columns=pivot_column, values=error_metric)\
-                        .loc[:, ['FH-1', 'FH-3', 'FH-7', 'FH-14', 'FH-28']]\
+                        .reindex(columns=horizon_columns)\
                         .sort_values(by=['has_outliers', 'model_name'], ascending=[False, True])\
                         .reset_index()
     
-    error_table['Median'] = error_table.iloc[:, 2:].median(axis=1)
-    error_table['Mean'] = round(error_table.iloc[:, 2:].mean(axis=1),4)
+    error_table['Median'] = error_table[horizon_columns].median(axis=1)
+    error_table['Mean'] = round(error_table[horizon_columns].mean(axis=1),4)
     
     if outlier_split:
         error_table_outliers = error_table[error_table['has_outliers'] == True]
@@ -824,8 +1457,10 @@ def generate_error_table(df:pd.DataFrame, required_columns:list, index:list,
     else:
         return error_table
 
-def get_naive_model_metrics(naive_models:list, forecast_horizons:list, train_data:TimeSeries,  test_data:TimeSeries):
-    """Generates average and median rmse and mae metrics for the given data and naive models. """
+def get_naive_model_metrics(naive_models:list, forecast_horizons:list, train_data:TimeSeries,  test_data:TimeSeries,
+                            resolution='daily'):
+    """Generates average and median rmse and mae metrics for the given data and naive models.
+    resolution sets the seasonal period and moving average window as in get_model. """
     
     results = {'model_name': [],
            'fh': [],
@@ -840,11 +1475,11 @@ def get_naive_model_metrics(naive_models:list, forecast_horizons:list, train_dat
             if model_name == 'naive_drift':
                 model = NaiveDrift()
             if model_name == 'naive_seasonal':
-                model = NaiveSeasonal(K=365)
+                model = NaiveSeasonal(K=365 if resolution == 'daily' else 24)
             if model_name == 'naive_mean':
                 model = NaiveMean()
             if model_name == 'naive_moving_average':
-                model = NaiveMovingAverage(input_chunk_length=fh*2)
+                model = NaiveMovingAverage(input_chunk_length=get_chunk_lengths(fh, resolution)[0])
 
             model.fit(train_data)
             predictions = model.predict(n=fh)
@@ -858,12 +1493,61 @@ def get_naive_model_metrics(naive_models:list, forecast_horizons:list, train_dat
             results['mae'].append(mae_score)
             
     results_df = pd.DataFrame(results)
-    avg_metrics = results_df.groupby(by=['model_name']).mean().reset_index()\
-                            .sort_values(by=['rmse', 'mae'])\
-                            .loc[:, ['model_name', 'rmse', 'mae']]
+    metrics = results_df.groupby(by=['model_name'])[['rmse', 'mae']].agg(['mean', 'median'])
 
-    median_metrics = results_df.groupby(by=['model_name']).median().reset_index()\
-                        .sort_values(by=['rmse', 'mae'])\
-                        .loc[:, ['model_name', 'rmse', 'mae']]
+    avg_metrics = metrics.xs('mean', axis=1, level=1).reset_index().sort_values(by=['rmse', 'mae'])
+    median_metrics = metrics.xs('median', axis=1, level=1).reset_index().sort_values(by=['rmse', 'mae'])
 
     return avg_metrics, median_metrics
+
+def get_rss_mb():
+    """Returns the resident set size of the current process in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError):
+        # peak rather than current RSS on platforms without /proc (KB on Linux, bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 1024**2 if os.uname().sysname == 'Darwin' else max_rss / 1024
+
+class PeakMemoryMonitor:
+    """
+    Context manager that samples the process RSS in a background thread and records the peak
+    (and, when CUDA is available, the peak allocated GPU memory) while the block runs.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.baseline_mb = None
+        self.peak_mb = None
+        self.peak_cuda_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def peak_delta_mb(self) -> float:
+        return self.peak_mb - self.baseline_mb
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, get_rss_mb())
+
+    def __enter__(self):
+        self.baseline_mb = self.peak_mb = get_rss_mb()
+
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, get_rss_mb())
+
+        if torch.cuda.is_available():
+            self.peak_cuda_mb = torch.cuda.max_memory_allocated() / 1024**2
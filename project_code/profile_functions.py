@@ -0,0 +1,289 @@
+from IPython.display import display
+import json
+import numpy as np
+import os
+import pandas as pd
+
+from project_code import processing_functions as pf
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct count sketch of 2**precision registers (16 KB at the default), used to estimate the
+    number of distinct rows, and so approximate duplicates, of data that never fits in memory at once.
+    The standard error is about 1.04 / sqrt(2**precision), i.e. 0.8% at the default.
+    """
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(2**precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        p = np.uint64(self.precision)
+        buckets = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        remaining = hashes << p
+
+        # number of leading zeros of the remaining bits, by binary search
+        leading_zeros = np.zeros(len(hashes), dtype=np.int64)
+        for shift in [32, 16, 8, 4, 2, 1]:
+            is_small = remaining < np.uint64(1 << (64 - shift))
+            leading_zeros += shift * is_small
+            remaining = np.where(is_small, remaining << np.uint64(shift), remaining)
+
+        ranks = (np.minimum(leading_zeros, 64 - self.precision) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def add_rows(self, df: pd.DataFrame):
+        self.add_hashes(pd.util.hash_pandas_object(df, index=False).to_numpy())
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m**2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+        n_empty = np.count_nonzero(self.registers == 0)
+
+        # linear counting is more accurate for small cardinalities
+        if estimate <= 2.5 * m and n_empty:
+            estimate = m * np.log(m / n_empty)
+
+        return float(estimate)
+
+class StreamingProfile:
+    """
+    One-pass, mergeable profile of tabular data fed in chunks (e.g. the hourly archive, one station or file
+    chunk at a time): row count, null counts, min/max, mean, variance, pairwise covariance and correlation
+    of the numeric columns, and approximate duplicate rows. Moments are kept per column pair over the rows
+    where both are present, as df.corr does, and combined across chunks with Chan et al.'s parallel update of
+    Welford's algorithm, so merging the profiles of chunks or stations matches a profile of all of their rows.
+    """
+    def __init__(self, precision=14):
+        self.columns = None
+        self.numeric_columns = None
+        self.n_rows = 0
+        self.null_counts = None
+        self.minimum = None
+        self.maximum = None
+
+        # [i, j]: over the rows where columns i and j are both present
+        self.pair_counts = None
+        self.pair_means = None
+        self.pair_m2 = None
+        self.comoments = None
+
+        self.distinct_rows = HyperLogLog(precision)
+
+    def _initialize(self, columns, numeric_columns):
+        self.columns = list(columns)
+        self.numeric_columns = list(numeric_columns)
+        k = len(self.numeric_columns)
+
+        self.null_counts = np.zeros(len(self.columns), dtype=np.int64)
+        self.minimum = np.full(k, np.inf)
+        self.maximum = np.full(k, -np.inf)
+        self.pair_counts = np.zeros((k, k))
+        self.pair_means = np.zeros((k, k))
+        self.pair_m2 = np.zeros((k, k))
+        self.comoments = np.zeros((k, k))
+
+    def update(self, df: pd.DataFrame):
+        """Adds a chunk of rows; every chunk must have the same columns."""
+        if self.columns is None:
+            self._initialize(df.columns, [column for column in df.columns if pd.api.types.is_numeric_dtype(df[column])
+                                          and not pd.api.types.is_bool_dtype(df[column])])
+        elif list(df.columns) != self.columns:
+            raise ValueError(f'Expected columns {self.columns}, got {list(df.columns)}')
+
+        if len(df) == 0:
+            return
+
+        self.n_rows += len(df)
+        self.null_counts += df.isna().to_numpy().sum(axis=0)
+        self.distinct_rows.add_rows(df)
+
+        values = df[self.numeric_columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+
+        self.minimum = np.minimum(self.minimum, np.where(present, values, np.inf).min(axis=0))
+        self.maximum = np.maximum(self.maximum, np.where(present, values, -np.inf).max(axis=0))
+
+        # chunk moments by matrix products over the pairwise present rows, shifted by the column means for stability
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shift = np.nan_to_num(np.nanmean(np.where(present, values, np.nan), axis=0))
+        centered = np.where(present, values - shift, 0.0)
+        mask = present.astype(np.float64)
+
+        counts = mask.T @ mask
+        sums = centered.T @ mask
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, 0.0)
+
+        chunk = {
+            'pair_counts': counts,
+            'pair_means': means + shift[:, np.newaxis],
+            'pair_m2': (centered**2).T @ mask - means * sums,
+            'comoments': centered.T @ centered - means * sums.T
+        }
+        self._combine(chunk)
+
+    def _combine(self, other: dict):
+        n_a, n_b = self.pair_counts, other['pair_counts']
+        n = n_a + n_b
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = other['pair_means'] - self.pair_means
+            weight = np.where(n > 0, n_a * n_b / n, 0.0)
+            fraction = np.where(n > 0, n_b / n, 0.0)
+
+        self.comoments = self.comoments + other['comoments'] + delta * delta.T * weight
+        self.pair_m2 = self.pair_m2 + other['pair_m2'] + delta**2 * weight
+        self.pair_means = self.pair_means + delta * fraction
+        self.pair_counts = n
+
+    def merge(self, other):
+        """Adds the rows profiled by another StreamingProfile (e.g. of another chunk or station)."""
+        if other.columns is None:
+            return
+        if self.columns is None:
+            self._initialize(other.columns, other.numeric_columns)
+        elif other.columns != self.columns:
+            raise ValueError(f'Expected columns {self.columns}, got {other.columns}')
+
+        self.n_rows += other.n_rows
+        self.null_counts += other.null_counts
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.distinct_rows.merge(other.distinct_rows)
+        self._combine({name: getattr(other, name) for name in ['pair_counts', 'pair_means', 'pair_m2', 'comoments']})
+
+    @property
+    def approximate_duplicates(self) -> int:
+        return max(0, self.n_rows - int(round(self.distinct_rows.count())))
+
+    def get_summary(self) -> pd.DataFrame:
+        """Returns count, null %, mean, std, min and max per column, like describe().transpose()."""
+        counts = np.diag(self.pair_counts)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            numeric = pd.DataFrame({
+                'count': counts.astype(np.int64),
+                'mean': np.where(counts > 0, np.diag(self.pair_means), np.nan),
+                'std': np.sqrt(np.where(counts > 1, np.diag(self.pair_m2) / (counts - 1), np.nan)),
+                'min': np.where(counts > 0, self.minimum, np.nan),
+                'max': np.where(counts > 0, self.maximum, np.nan)
+            }, index=self.numeric_columns)
+
+        summary = pd.DataFrame({'null_pct': self.null_counts / max(self.n_rows, 1) * 100}, index=self.columns)
+
+        return summary.join(numeric)[['count', 'null_pct', 'mean', 'std', 'min', 'max']]
+
+    def get_covariance(self) -> pd.DataFrame:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariance = np.where(self.pair_counts > 1, self.comoments / (self.pair_counts - 1), np.nan)
+
+        return pd.DataFrame(covariance, index=self.numeric_columns, columns=self.numeric_columns)
+
+    def get_correlation(self) -> pd.DataFrame:
+        """Returns the Pearson correlation matrix, matching df.corr() of all rows profiled."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = np.clip(self.comoments / np.sqrt(self.pair_m2 * self.pair_m2.T), -1, 1)
+        correlation[self.pair_counts < 2] = np.nan
+
+        return pd.DataFrame(correlation, index=self.numeric_columns, columns=self.numeric_columns)
+
+    def print_summary(self, name=None):
+        if name:
+            print(f'Dataframe: {name}\n')
+
+        print('------ Column Summaries: ------')
+        display(self.get_summary())
+        print('\n')
+
+        print('------ Counts: ------\n')
+        print(f'Rows: {self.n_rows:,}')
+        print(f'Columns: {len(self.columns):,}')
+        print(f'Approximate Duplicate Rows = {self.approximate_duplicates} | '
+              f'% of Total Rows = {self.approximate_duplicates/max(self.n_rows, 1):.1%}')
+
+    def save(self, file):
+        data = {
+            'columns': self.columns,
+            'numeric_columns': self.numeric_columns,
+            'n_rows': self.n_rows,
+            'precision': self.distinct_rows.precision,
+            'registers': self.distinct_rows.registers.tolist()
+        }
+        for name in ['null_counts', 'minimum', 'maximum', 'pair_counts', 'pair_means', 'pair_m2', 'comoments']:
+            data[name] = getattr(self, name).tolist()
+
+        with open(file, 'w') as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, file):
+        with open(file) as f:
+            data = json.load(f)
+
+        profile = cls(data['precision'])
+        profile.columns = data['columns']
+        profile.numeric_columns = data['numeric_columns']
+        profile.n_rows = data['n_rows']
+        profile.distinct_rows.registers = np.asarray(data['registers'], dtype=np.uint8)
+        profile.null_counts = np.asarray(data['null_counts'], dtype=np.int64)
+
+        for name in ['minimum', 'maximum', 'pair_counts', 'pair_means', 'pair_m2', 'comoments']:
+            setattr(profile, name, np.asarray(data[name], dtype=np.float64))
+
+        return profile
+
+def iter_file_chunks(file, chunksize=100_000, columns=None):
+    """
+    Yields DataFrame chunks of a .parquet or .csv file without reading it whole. Raw .json weather downloads
+    (see pf.df_from_json) can only be parsed whole, so they are read one file at a time and then chunked.
+    """
+    extension = os.path.splitext(file)[1].lower()
+
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    elif extension == '.csv':
+        yield from pd.read_csv(file, chunksize=chunksize, usecols=columns)
+
+    elif extension == '.json':
+        df = pf.df_from_json(file)
+        df = df[columns] if columns is not None else df
+
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+
+    else:
+        raise ValueError(f'Unsupported file type {extension}')
+
+def profile_chunks(chunks, precision=14) -> StreamingProfile:
+    """Profiles an iterable of DataFrame chunks in one pass."""
+    profile = StreamingProfile(precision)
+
+    for chunk in chunks:
+        profile.update(chunk)
+
+    return profile
+
+def profile_files(files: dict, chunksize=100_000, columns=None, precision=14) -> dict:
+    """
+    Profiles each file of {name: file} (e.g. one per station) chunk by chunk, and returns
+    {name: StreamingProfile} plus the merged profile of all files under the key 'all'. Only one chunk is in
+    memory at a time.
+    """
+    profiles = {name: profile_chunks(iter_file_chunks(file, chunksize, columns), precision)
+                for name, file in files.items()}
+
+    profiles['all'] = StreamingProfile(precision)
+    for name, profile in list(profiles.items())[:-1]:
+        profiles['all'].merge(profile)
+
+    return profiles
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+
+# physically possible ranges by column prefix, longest prefix first; sunshine is capped by the step length
+physical_bounds = {
+    'temp_range': (0.0, 80.0),
+    'temp': (-90.0, 60.0),
+    'humidity': (0.0, 100.0),
+    'sunshine': (0.0, None)
+}
+
+def get_step(freq) -> pd.Timedelta:
+    """Returns the length of one step of a fixed frequency such as 'D' or 'h'."""
+    return pd.Timedelta(np.diff(pd.date_range('2000-01-01', periods=2, freq=freq))[0])
+
+def get_physical_bounds(columns, freq='D', bounds=None) -> pd.DataFrame:
+    """
+    Returns the lower and upper bound of each column (NaN if unbounded) from physical_bounds, updated with
+    bounds ({column or prefix: (lower, upper)}). Sunshine can last at most the step length of freq, in hours.
+    """
+    bounds = {**physical_bounds, **(bounds or {})}
+    step_hours = min(get_step(freq) / pd.Timedelta(hours=1), 24)
+    rows = {}
+
+    for column in columns:
+        prefix = max((prefix for prefix in bounds if column.startswith(prefix)), key=len, default=None)
+        lower, upper = bounds[prefix] if prefix is not None else (None, None)
+
+        if prefix == 'sunshine' and upper is None:
+            upper = step_hours
+
+        rows[column] = (np.nan if lower is None else lower, np.nan if upper is None else upper)
+
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['lower', 'upper'])
+
+def check_quality(frames: dict, freq='D', bounds=None) -> pd.DataFrame:
+    """
+    Checks every frame of {name: DataFrame with a date index} (e.g. the outlier and clean data, or one per
+    station) in one vectorized pass over their concatenation: duplicated and unsorted timestamps, missing steps
+    (gaps of freq), missing values, non-finite or physically impossible values (see get_physical_bounds) and
+    temperatures out of order (temp_min <= temp_mean <= temp_max). Returns one row per frame, column and check
+    with the number of problems and the first date affected; an empty report means the data is clean.
+    """
+    data = pd.concat(frames, names=['frame', 'date'])
+    names = data.index.get_level_values('frame')
+    dates = pd.Series(data.index.get_level_values('date'), index=data.index)
+    step = get_step(freq)
+
+    date_differences = dates.groupby(level='frame', sort=False).diff()
+    row_checks = pd.DataFrame({
+        'duplicate_timestamp': data.index.duplicated(),
+        'unsorted_timestamp': (date_differences < pd.Timedelta(0)).to_numpy(),
+        'missing_step': (date_differences > step).to_numpy()
+    }, index=data.index)
+    missing_steps = ((date_differences / step).where(row_checks['missing_step'], 1) - 1).to_numpy()
+
+    numeric = data.select_dtypes('number')
+    values = numeric.to_numpy(dtype=np.float64)
+    column_bounds = get_physical_bounds(numeric.columns, freq, bounds)
+    is_missing = np.isnan(values)
+
+    with np.errstate(invalid='ignore'):
+        is_impossible = (np.isinf(values) | (values < column_bounds['lower'].to_numpy())
+                         | (values > column_bounds['upper'].to_numpy()))
+
+    value_checks = {
+        'missing_value': pd.DataFrame(is_missing, index=data.index, columns=numeric.columns),
+        'impossible_value': pd.DataFrame(is_impossible, index=data.index, columns=numeric.columns)
+    }
+
+    temperature_columns = [column for column in ['temp_min', 'temp_mean', 'temp_max'] if column in numeric]
+    if len(temperature_columns) > 1:
+        temperatures = numeric[temperature_columns].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            row_checks['temperature_order'] = np.any(temperatures[:, 1:] < temperatures[:, :-1], axis=1)
+
+    # one row per flagged (frame, date, check, column)
+    flags = pd.concat([pd.concat(value_checks, axis=1),
+                       pd.concat({'*': row_checks}, axis=1).swaplevel(axis=1)], axis=1)
+    row_positions, flag_positions = np.nonzero(flags.to_numpy(dtype=bool))
+
+    if len(row_positions) == 0:
+        return pd.DataFrame(columns=['frame', 'column', 'check', 'count', 'first_date'])
+
+    flags = pd.DataFrame({
+        'frame': names[row_positions],
+        'date': dates.to_numpy()[row_positions],
+        'check': flags.columns.get_level_values(0)[flag_positions],
+        'column': flags.columns.get_level_values(1)[flag_positions]
+    })
+
+    report = flags.groupby(['frame', 'column', 'check'], sort=False).agg(count=('date', 'size'),
+                                                                      first_date=('date', 'min')).reset_index()
+
+    # a missing_step flag stands for all the steps missing before it
+    missing_step_counts = pd.Series(missing_steps[row_checks['missing_step'].to_numpy()],
+                                    index=names[row_checks['missing_step'].to_numpy()]).groupby(level=0).sum()
+    is_missing_step = report['check'] == 'missing_step'
+    report.loc[is_missing_step, 'count'] = report.loc[is_missing_step, 'frame'].map(missing_step_counts).astype(int)
+
+    return report.sort_values(['frame', 'check', 'column'], ignore_index=True)
+
+def fill_missing(series: pd.Series, fill, max_fill_steps=None, seasonal_period=365) -> pd.Series:
+    """
+    Fills the missing values of a series on a regular index: 'interpolate' (linear in time), 'ffill', 'mean',
+    'seasonal' (the value seasonal_period steps earlier, else later) or None to leave them; max_fill_steps
+    limits interpolation and forward fills to gaps of that many steps.
+    """
+    if fill is None:
+        return series
+    if fill == 'interpolate':
+        return series.interpolate(method='time', limit=max_fill_steps, limit_area='inside')
+    if fill == 'ffill':
+        return series.ffill(limit=max_fill_steps)
+    if fill == 'mean':
+        return series.fillna(series.mean())
+    if fill == 'seasonal':
+        return series.fillna(series.shift(seasonal_period)).fillna(series.shift(-seasonal_period))
+
+    raise ValueError(f"Invalid fill {fill}, expected 'interpolate', 'ffill', 'mean', 'seasonal' or None")
+
+def repair_frame(df: pd.DataFrame, freq='D', fills='interpolate', duplicates='mean', impossible='nan', bounds=None,
+                 max_fill_steps=None, seasonal_period=365) -> pd.DataFrame:
+    """
+    Returns a repaired copy of df: sorted, duplicated timestamps merged ('mean', 'first' or 'last'), impossible
+    values set to NaN ('nan') or clipped to their bounds ('clip'), temperatures of days out of order set to NaN,
+    missing steps inserted on a regular freq index and missing values filled (fills is a fill_missing method
+    for all columns or {column: method}), with temp_range recomputed from the filled extremes.
+    """
+    df = df.sort_index()
+
+    if df.index.has_duplicates:
+        df = df.groupby(level=0).mean() if duplicates == 'mean' else df[~df.index.duplicated(keep=duplicates)]
+
+    numeric_columns = df.select_dtypes('number').columns
+    column_bounds = get_physical_bounds(numeric_columns, freq, bounds)
+    values = df[numeric_columns].replace([np.inf, -np.inf], np.nan)
+    lower, upper = column_bounds['lower'], column_bounds['upper']
+
+    if impossible == 'clip':
+        values = values.clip(lower, upper, axis=1)
+    elif impossible == 'nan':
+        values = values.mask(values.lt(lower, axis=1) | values.gt(upper, axis=1))
+    else:
+        raise ValueError(f"Invalid impossible {impossible}, expected 'nan' or 'clip'")
+
+    temperature_columns = [column for column in ['temp_min', 'temp_mean', 'temp_max', 'temp_range']
+                           if column in numeric_columns]
+    ordered_columns = [column for column in temperature_columns if column != 'temp_range']
+    if len(ordered_columns) > 1:
+        temperatures = values[ordered_columns].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            is_unordered = np.any(temperatures[:, 1:] < temperatures[:, :-1], axis=1)
+        values.loc[is_unordered, temperature_columns] = np.nan
+
+    df = df.assign(**{column: values[column] for column in numeric_columns})
+    df = df.reindex(pd.date_range(df.index.min(), df.index.max(), freq=freq, name=df.index.name))
+    was_missing = df[temperature_columns].isna().any(axis=1) if temperature_columns else None
+
+    for column in numeric_columns:
+        fill = fills.get(column, 'interpolate') if isinstance(fills, dict) else fills
+        df[column] = fill_missing(df[column], fill, max_fill_steps, seasonal_period)
+
+    # filled temperature ranges must match the filled extremes
+    if {'temp_min', 'temp_max', 'temp_range'} <= set(numeric_columns):
+        df.loc[was_missing, 'temp_range'] = df.loc[was_missing, 'temp_max'] - df.loc[was_missing, 'temp_min']
+
+    return df
+
+def print_quality_report(report: pd.DataFrame, title='Data quality'):
+    if report.empty:
+        print(f'{title}: no issues found')
+        return
+
+    print(f"{title}: {report['count'].sum():,} problems in {report['frame'].nunique()} frame(s)")
+    print(report.to_string(index=False))
+
+def validate_frames(frames: dict, freq='D', bounds=None, repair=False, raise_errors=True, verbose=True,
+                    **repair_kwargs) -> tuple:
+    """
+    Checks frames (see check_quality) and, if repair, repairs them with repair_frame(**repair_kwargs) and
+    checks them again. Raises a ValueError with the report if problems remain and raise_errors, so bad inputs
+    fail before any model is fitted. Returns (frames, report), the frames repaired if repair.
+    """
+    report = check_quality(frames, freq, bounds)
+
+    if repair and not report.empty:
+        if verbose:
+            print_quality_report(report, 'Data quality before repair')
+
+        frames = {name: repair_frame(df, freq, bounds=bounds, **repair_kwargs) for name, df in frames.items()}
+        report = check_quality(frames, freq, bounds)
+
+    if verbose:
+        print_quality_report(report)
+
+    if raise_errors and not report.empty:
+        raise ValueError(f'Data quality check failed:\n{report.to_string(index=False)}')
+
+    return frames, report
@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor, wait
+import hashlib
+import matplotlib
+import multiprocessing
+import os
+import pickle
+
+
+def _init_render_worker():
+    # headless: workers never open windows or need a display
+    matplotlib.use('Agg')
+
+def render_figure(output_file, function, args=(), kwargs=None):
+    """
+    Calls a plotting function and saves the figure it returns (plotly or matplotlib), or the current matplotlib
+    figure if it returns None, to output_file. Plotly figures are exported through kaleido.
+    """
+    import matplotlib.pyplot as plt
+
+    figure = function(*args, **(kwargs or {}))
+
+    output_directory = os.path.dirname(output_file)
+    if output_directory and not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    if hasattr(figure, 'write_image'):
+        figure.write_image(output_file)
+    else:
+        (figure if figure is not None else plt.gcf()).savefig(output_file, bbox_inches='tight')
+        plt.close('all')
+
+    return output_file
+
+def return_figure(figure):
+    return figure
+
+def get_figure_hash(function, args=(), kwargs=None) -> str:
+    """Returns a sha256 digest of a plotting function's name and its pickled arguments (the figure's input data)."""
+    digest = hashlib.sha256(f'{function.__module__}.{function.__qualname__}'.encode())
+    digest.update(pickle.dumps((args, kwargs or {}), protocol=4))
+
+    return digest.hexdigest()
+
+class FigureQueue:
+    """
+    Renders figure jobs in a pool of headless worker processes so that plotting and image export never block
+    the caller. A job is skipped if its output file was rendered before from the same function and input
+    data, as recorded in an {output_file}.sha256 sidecar. Use as a context manager, or call close, to wait for
+    the queued jobs.
+    """
+    def __init__(self, n_workers=None, mp_context='spawn'):
+        self.executor = ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(),
+                                            mp_context=multiprocessing.get_context(mp_context),
+                                            initializer=_init_render_worker)
+        self.futures = {}
+        self.outcomes = {'rendered': 0, 'skipped': 0, 'failed': 0}
+
+    def submit(self, output_file, function, *args, **kwargs) -> bool:
+        """
+        Queues function(*args, **kwargs) to be rendered to output_file; function must be importable by the
+        workers (a module-level function) and return the figure or draw on the current matplotlib figure.
+        Returns False if the figure is up to date and was skipped.
+        """
+        figure_hash = get_figure_hash(function, args, kwargs)
+        hash_file = f'{output_file}.sha256'
+
+        if os.path.exists(output_file) and os.path.exists(hash_file):
+            with open(hash_file) as f:
+                if f.read() == figure_hash:
+                    self.outcomes['skipped'] += 1
+                    return False
+
+        future = self.executor.submit(render_figure, output_file, function, args, kwargs)
+        self.futures[future] = (output_file, figure_hash)
+
+        return True
+
+    def submit_figure(self, output_file, figure) -> bool:
+        """Queues the export of an already built (e.g. plotly) figure."""
+        return self.submit(output_file, return_figure, figure)
+
+    def wait(self) -> dict:
+        """Waits for the queued jobs and returns the number of rendered, skipped and failed figures so far."""
+        futures, self.futures = self.futures, {}
+        wait(futures)
+
+        for future, (output_file, figure_hash) in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f'Unable to render {output_file}: {e!r}')
+                self.outcomes['failed'] += 1
+                continue
+
+            with open(f'{output_file}.sha256', 'w') as f:
+                f.write(figure_hash)
+            self.outcomes['rendered'] += 1
+
+        return dict(self.outcomes)
+
+    def close(self) -> dict:
+        outcomes = self.wait()
+        self.executor.shutdown()
+
+        return outcomes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,155 @@
+import json
+import numpy as np
+import os
+import pandas as pd
+
+
+# scaled int16 encodings of the daily and hourly columns: value = stored * scale, stored -32768 = missing.
+# The scales keep the rounding error (half a scale step) well below the sensor resolution, e.g. 0.005 °C.
+int16_scales = {
+    'sunshine': 0.001,
+    'humidity': 0.01,
+    'temp': 0.01
+}
+
+int16_missing = np.iinfo(np.int16).min
+
+def get_schema(df: pd.DataFrame, encoding='float32', scales=None) -> dict:
+    """
+    Returns the on-disk schema of df's numeric columns, {column: {'dtype', 'scale'}}: 'float32' for all, or
+    'int16' for the columns with an int16_scales prefix (updated with scales) whose values fit, others float32.
+    """
+    scales = {**int16_scales, **(scales or {})}
+    schema = {}
+
+    for column in df.select_dtypes('number').columns:
+        if pd.api.types.is_integer_dtype(df[column]):
+            schema[column] = {'dtype': str(df[column].dtype), 'scale': None}
+            continue
+
+        prefix = max((prefix for prefix in scales if column.startswith(prefix)), key=len, default=None)
+        schema[column] = {'dtype': 'float32', 'scale': None}
+
+        if encoding == 'int16' and prefix is not None:
+            with np.errstate(invalid='ignore'):
+                stored = np.round(df[column].to_numpy(dtype=np.float64) / scales[prefix])
+
+            if np.nanmax(np.abs(stored), initial=0) < np.iinfo(np.int16).max:
+                schema[column] = {'dtype': 'int16', 'scale': scales[prefix]}
+
+        elif encoding not in ['float32', 'int16']:
+            raise ValueError(f"Invalid encoding {encoding}, expected 'float32' or 'int16'")
+
+    return schema
+
+def encode_frame(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Returns df with its columns stored as in schema, scaled int16 columns rounded to their scale."""
+    encoded = {}
+
+    for column, column_schema in schema.items():
+        if column_schema['scale'] is None:
+            encoded[column] = df[column].astype(column_schema['dtype'])
+            continue
+
+        values = df[column].to_numpy(dtype=np.float64)
+        is_missing = np.isnan(values)
+        stored = np.round(np.where(is_missing, 0, values) / column_schema['scale'])
+        encoded[column] = np.where(is_missing, int16_missing, stored).astype(np.int16)
+
+    return df.assign(**encoded)
+
+def decode_frame(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Returns the float32 (and integer) columns of a frame stored with schema."""
+    decoded = {}
+
+    for column, column_schema in schema.items():
+        if column_schema['scale'] is None:
+            decoded[column] = df[column].astype(column_schema['dtype'])
+            continue
+
+        values = df[column].to_numpy()
+        decoded[column] = np.where(values == int16_missing, np.nan,
+                                   values.astype(np.float32) * np.float32(column_schema['scale'])).astype(np.float32)
+
+    return df.assign(**decoded)
+
+def get_schema_file(file) -> str:
+    return f'{file}.schema.json'
+
+def save_frame(df: pd.DataFrame, file, encoding='float32', scales=None) -> dict:
+    """
+    Saves a data frame with a date index as .parquet (typed columns) or .csv (float32 values written with
+    their shortest round-trip digits, e.g. 29.833334 instead of 29.833333333333332), with its schema (see
+    get_schema) in a {file}.schema.json sidecar for read_frame. Returns the schema.
+    """
+    schema = get_schema(df, encoding, scales)
+    encoded = encode_frame(df, schema)
+    extension = os.path.splitext(file)[1].lower()
+
+    output_directory = os.path.dirname(file)
+    if output_directory and not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    if extension == '.parquet':
+        encoded.to_parquet(file)
+    elif extension == '.csv':
+        encoded.to_csv(file)
+    else:
+        raise ValueError(f'Unsupported file type {extension}')
+
+    with open(get_schema_file(file), 'w') as f:
+        json.dump({'index': df.index.name, 'columns': schema}, f, indent=2)
+
+    return schema
+
+def read_frame(file, index_column='date') -> pd.DataFrame:
+    """
+    Reads a frame saved by save_frame, decoding its columns to float32. Files without a schema sidecar, such
+    as the existing processed CSVs, are read with their float columns downcast to float32.
+    """
+    schema_file = get_schema_file(file)
+    extension = os.path.splitext(file)[1].lower()
+
+    if os.path.exists(schema_file):
+        with open(schema_file) as f:
+            stored_schema = json.load(f)
+        index_column = stored_schema['index'] or index_column
+        schema = stored_schema['columns']
+        dtypes = {column: column_schema['dtype'] for column, column_schema in schema.items()}
+    else:
+        schema, dtypes = None, None
+
+    if extension == '.parquet':
+        df = pd.read_parquet(file)
+    elif extension == '.csv':
+        df = pd.read_csv(file, dtype=dtypes, parse_dates=[index_column], index_col=index_column)
+    else:
+        raise ValueError(f'Unsupported file type {extension}')
+
+    if schema is not None:
+        return decode_frame(df, schema)
+
+    float_columns = df.select_dtypes('float').columns
+    return df.astype({column: np.float32 for column in float_columns})
+
+def get_memory_report(frames: dict) -> pd.DataFrame:
+    """
+    Returns the rows, columns, dtypes and in-memory size (MB, including the index) of each frame of
+    {name: DataFrame}, and its size relative to the same frame with float64 columns.
+    """
+    rows = []
+
+    for name, df in frames.items():
+        memory_mb = df.memory_usage(index=True, deep=True).sum() / 1024**2
+        float64_mb = (df.index.memory_usage(deep=True) + 8 * df.shape[0] * df.shape[1]) / 1024**2
+
+        rows.append({
+            'frame': name,
+            'rows': len(df),
+            'columns': df.shape[1],
+            'dtypes': ', '.join(f'{dtype}: {count}' for dtype, count in df.dtypes.astype(str).value_counts().items()),
+            'memory_mb': round(memory_mb, 3),
+            'vs_float64': round(memory_mb / float64_mb, 3) if float64_mb else np.nan
+        })
+
+    return pd.DataFrame(rows).set_index('frame')
@@ -0,0 +1,448 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import ctypes
+import datetime
+import gc
+import json
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import socket
+import time
+import torch
+import traceback
+
+from project_code import cache_functions as cf
+from project_code import processing_functions as pf
+from project_code import quality_functions as qf
+from project_code import telemetry_functions as tf
+
+
+def get_sweep_cells(model_names: dict, forecast_horizons: list, cutoff_dates: list, outlier_flags=(True, False),
+                    model_types=('default', 'tuned'), nbeats_versions=('generic', 'interpretable')) -> list:
+    """
+    Returns the experiment grid as a list of cells, one per (model, version, type, fh, outlier flag, cutoff).
+    model_names maps each model name to its proper name, e.g. {'nbeats': 'N-BEATS', 'lgbm': 'LightGBM'}.
+    Non-ML models only have a default type.
+    """
+    cells = []
+
+    for cutoff_date in cutoff_dates:
+        for model_name, model_name_proper in model_names.items():
+            versions = nbeats_versions if model_name == 'nbeats' else [None]
+            types = ['default'] if model_name in pf.non_ml_models else model_types
+
+            for version in versions:
+                for model_type in types:
+                    for fh in forecast_horizons:
+                        for has_outliers in outlier_flags:
+                            cells.append({
+                                'model_name': model_name,
+                                'model_name_proper': model_name_proper,
+                                'version': version,
+                                'model_type': model_type,
+                                'fh': fh,
+                                'has_outliers': has_outliers,
+                                'cutoff_date': cutoff_date
+                            })
+
+    return cells
+
+def get_cell_id(cell: dict) -> str:
+    """Returns a file-name-safe identifier for a sweep cell."""
+    return (f"{cell['model_name']}_{cell['version']}_{cell['model_type']}_fh{cell['fh']}"
+            f"_outliers-{cell['has_outliers']}_cutoff-{cell['cutoff_date']}")
+
+def get_cell_status(manifest_directory, cell: dict):
+    """Returns the manifest marker of a cell, or None if the cell has not been started."""
+    marker_file = os.path.join(manifest_directory, f'{get_cell_id(cell)}.json')
+
+    if not os.path.exists(marker_file):
+        return None
+
+    with open(marker_file) as f:
+        return json.load(f)
+
+def mark_cell(manifest_directory, cell: dict, status: str, **details):
+    """Atomically records the status ('in_progress', 'completed' or 'failed') of a cell in the manifest."""
+    if not os.path.exists(manifest_directory):
+        os.makedirs(manifest_directory)
+
+    marker = {
+        'cell': cell,
+        'status': status,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'updated': datetime.datetime.now().isoformat(),
+        **details
+    }
+
+    cf.write_json_atomic(marker, os.path.join(manifest_directory, f'{get_cell_id(cell)}.json'))
+
+def get_manifest_summary(manifest_directory) -> pd.DataFrame:
+    """Returns one row per recorded cell with its status and last update time."""
+    rows = []
+
+    if os.path.exists(manifest_directory):
+        for file in sorted(os.listdir(manifest_directory)):
+            if not file.endswith('.json'):
+                continue
+
+            with open(os.path.join(manifest_directory, file)) as f:
+                marker = json.load(f)
+
+            rows.append({**marker['cell'], 'status': marker['status'], 'updated': marker['updated'],
+                         **{key: marker.get(key) for key in ['peak_rss_mb', 'peak_rss_delta_mb', 'peak_cuda_mb']}})
+
+    return pd.DataFrame(rows)
+
+def get_cell_results(manifest_directory, cells: list) -> pd.DataFrame:
+    """Returns one row per completed cell with the cell fields and its recorded results row, plus its model id."""
+    rows = []
+
+    for cell in cells:
+        marker = get_cell_status(manifest_directory, cell)
+        if marker is not None and marker['status'] == 'completed':
+            rows.append({**marker['row'], **cell})
+
+    cell_results = pd.DataFrame(rows)
+    if not cell_results.empty:
+        cell_results['model_id'] = cell_results['model_name_fh'].str.rsplit('_fh', n=1).str[0]
+
+    return cell_results
+
+def get_ranking_intervals(cell_results: pd.DataFrame, metric='rmse', confidence=0.95, n_bootstrap=2000,
+                          seed=None) -> pd.DataFrame:
+    """
+    Returns, per forecast horizon, outlier flag and model id, the mean metric over the cutoffs where every model
+    of the group completed, and bootstrap confidence intervals of that mean and of the model's rank. Cutoffs are
+    resampled jointly for all models (a paired bootstrap), all n_bootstrap resamples at once.
+    """
+    rng = np.random.default_rng(seed)
+    alpha = (1 - confidence) / 2
+    intervals = []
+
+    for (fh, has_outliers), group in cell_results.groupby(['fh', 'has_outliers']):
+        scores = group.pivot_table(index='cutoff_date', columns='model_id', values=metric).dropna()
+        values = scores.to_numpy(dtype=np.float64)
+        n_cutoffs = len(values)
+
+        if n_cutoffs == 0:
+            continue
+
+        resamples = values[rng.integers(0, n_cutoffs, size=(n_bootstrap, n_cutoffs))].mean(axis=1)
+        ranks = resamples.argsort(axis=1).argsort(axis=1) + 1
+
+        intervals.append(pd.DataFrame({
+            'fh': fh,
+            'has_outliers': has_outliers,
+            'model_id': scores.columns,
+            'n_cutoffs': n_cutoffs,
+            metric: values.mean(axis=0),
+            f'{metric}_lower': np.quantile(resamples, alpha, axis=0),
+            f'{metric}_upper': np.quantile(resamples, 1 - alpha, axis=0),
+            'rank': values.mean(axis=0).argsort().argsort() + 1,
+            'rank_lower': np.quantile(ranks, alpha, axis=0, method='lower'),
+            'rank_upper': np.quantile(ranks, 1 - alpha, axis=0, method='higher')
+        }))
+
+    if not intervals:
+        return pd.DataFrame()
+
+    return pd.concat(intervals, ignore_index=True).sort_values(['fh', 'has_outliers', 'rank'], ignore_index=True)
+
+def is_ranking_stable(previous: pd.DataFrame, current: pd.DataFrame) -> bool:
+    """Returns True if the models, their ranks and their rank confidence intervals are unchanged."""
+    if previous is None or previous.empty or current.empty:
+        return False
+
+    columns = ['fh', 'has_outliers', 'model_id', 'rank', 'rank_lower', 'rank_upper']
+    previous = previous[columns].sort_values(columns[:3], ignore_index=True)
+    current = current[columns].sort_values(columns[:3], ignore_index=True)
+
+    return previous.equals(current)
+
+def run_adaptive_sweep(model_names: dict, forecast_horizons: list, start_date, end_date, hyperparameters: dict,
+                       df_outliers, df_clean, results: dict, models_directory, results_directory, manifest_directory,
+                       batch_size=2, min_cutoffs=4, max_cutoffs=24, patience=2, metric='rmse', confidence=0.95,
+                       n_bootstrap=2000, seed=None, within='season', cell_kwargs=None, **sweep_kwargs) -> dict:
+    """
+    Runs the experiment grid over stratified cutoff dates (pf.generate_stratified_cutoff_dates) batch_size
+    cutoffs at a time, and stops adding cutoffs once the model rankings and their bootstrap confidence
+    intervals (get_ranking_intervals, from the results recorded so far) are unchanged after patience
+    consecutive batches, with at least min_cutoffs and at most max_cutoffs. cell_kwargs are passed on to
+    get_sweep_cells and sweep_kwargs to run_sweep; a rerun resumes from the manifest. Returns the cutoff dates
+    run, the final ranking intervals and whether the sweep stopped before max_cutoffs.
+    """
+    planned_cutoffs = pf.generate_stratified_cutoff_dates(start_date, end_date, max_cutoffs, seed, within)
+    cells, intervals = [], None
+    n_stable = 0
+    n_cutoffs = 0
+
+    while n_cutoffs < len(planned_cutoffs):
+        batch_cutoffs = planned_cutoffs[n_cutoffs:n_cutoffs + batch_size]
+        n_cutoffs += len(batch_cutoffs)
+
+        batch_cells = get_sweep_cells(model_names, forecast_horizons, batch_cutoffs, **(cell_kwargs or {}))
+        run_sweep(batch_cells, hyperparameters, df_outliers, df_clean, results, models_directory, results_directory,
+                  manifest_directory, seed=seed, **sweep_kwargs)
+        cells.extend(batch_cells)
+
+        current = get_ranking_intervals(get_cell_results(manifest_directory, cells), metric, confidence,
+                                        n_bootstrap, seed)
+        n_stable = n_stable + 1 if is_ranking_stable(intervals, current) else 0
+        intervals = current
+
+        print(f'{n_cutoffs} cutoffs: rankings unchanged for {n_stable} of {patience} batches')
+
+        if n_cutoffs >= min_cutoffs and n_stable >= patience:
+            break
+
+    return {'cutoff_dates': planned_cutoffs[:n_cutoffs], 'intervals': intervals,
+            'stopped_early': n_cutoffs < len(planned_cutoffs)}
+
+def release_model(model):
+    """Drops a fitted darts model's references to its Lightning trainer, network or estimator and training data."""
+    for attribute in ['trainer', 'model', 'training_series', 'past_covariate_series', 'future_covariate_series',
+                      'train_sample']:
+        if hasattr(model, attribute):
+            setattr(model, attribute, None)
+
+def release_memory():
+    """Collects garbage, empties the CUDA cache and, on glibc, returns freed heap memory to the OS."""
+    gc.collect()
+
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def record_sweep_progress(telemetry, outcomes: dict, n_left: int, start_time: float, offsets=None):
+    """
+    Publishes the cell counts per outcome, the cells left (the sweep's queue depth) and cells per second since
+    start_time (a time.time()). offsets are added to the counts, e.g. the cells completed by earlier workers.
+    """
+    registry = telemetry.registry
+    counts = {outcome: outcomes[outcome] + (offsets or {}).get(outcome, 0)
+              for outcome in ['completed', 'skipped', 'failed']}
+    for outcome, count in counts.items():
+        registry.set('sweep_cells', count, 'Sweep cells by outcome', outcome=outcome)
+
+    elapsed = time.time() - start_time
+    registry.set('sweep_cells_per_second', counts['completed'] / elapsed if elapsed > 0 else 0.0,
+                 'Cells run per second since the sweep started')
+    telemetry.report_pool('sweep', 1, n_left)
+
+def run_sweep(cells: list, hyperparameters: dict, df_outliers, df_clean, results: dict, models_directory,
+              results_directory, manifest_directory, seed=None, n_epochs_override=None, retry_failed=True,
+              model_kwargs=None, experiment_kwargs=None, aggregator=None, memory_ceiling_mb=None, telemetry=None,
+              validate_inputs=True, quality_kwargs=None, progress_offsets=None) -> dict:
+    """
+    Runs run_experiment for every cell, recording progress in a manifest of per-cell markers. Re-running the
+    same sweep after an interruption skips completed cells (their recorded rows are restored into results)
+    and reruns cells that were in flight or, if retry_failed, that failed. hyperparameters is the raw
+    hyperparameter search output; model_kwargs and experiment_kwargs are passed on to pf.get_model and
+    pf.run_experiment. Rows of completed and restored cells are also added to aggregator, an
+    evaluation_functions.ResultsAggregator, if given. Every cell's model, trainer and torch caches are released
+    after it runs and its peak memory is recorded in the manifest. If the process RSS still exceeds
+    memory_ceiling_mb after a cell, the sweep stops and reports the cells left in 'remaining', to be continued in a
+    fresh process (see run_sweep_recycled). A telemetry_functions.TelemetryExporter receives the cell outcomes,
+    the number of cells left, cells per second and the get_model and run_experiment latencies. Unless
+    validate_inputs is False, df_outliers and df_clean are first checked (and repaired, with quality_kwargs
+    {'repair': True, ...}) by quality_functions.validate_frames, so bad data fails before any model is fitted;
+    pass {'freq': 'h'} for hourly data. progress_offsets ({outcome: count, 'start_time': time.time()}) carry the
+    published progress over from earlier workers of run_sweep_recycled. Returns the number of cells per outcome.
+    """
+    model_kwargs = model_kwargs or {}
+    experiment_kwargs = experiment_kwargs or {}
+
+    if validate_inputs:
+        frames, _ = qf.validate_frames({'outliers': df_outliers, 'clean': df_clean}, **(quality_kwargs or {}))
+        df_outliers, df_clean = frames['outliers'], frames['clean']
+
+    forecast_horizons = sorted({cell['fh'] for cell in cells})
+    reformatted_hyperparams = pf.get_reformatted_hyperparams(hyperparameters, forecast_horizons)
+
+    outcomes = {'completed': 0, 'skipped': 0, 'failed': 0, 'remaining': 0}
+    start_time = (progress_offsets or {}).get('start_time', time.time())
+
+    for i, cell in enumerate(cells):
+        if telemetry is not None:
+            record_sweep_progress(telemetry, outcomes, len(cells) - i, start_time, progress_offsets)
+
+        marker = get_cell_status(manifest_directory, cell)
+
+        if marker is not None and marker['status'] == 'completed':
+            for key, value in marker['row'].items():
+                results[key].append(value)
+            if aggregator is not None:
+                aggregator.update([marker['row']])
+            outcomes['skipped'] += 1
+            continue
+
+        if marker is not None and marker['status'] == 'failed' and not retry_failed:
+            outcomes['failed'] += 1
+            continue
+
+        mark_cell(manifest_directory, cell, 'in_progress')
+        model = None
+
+        try:
+            with pf.PeakMemoryMonitor(interval=0.1) as monitor:
+                with tf.stage(telemetry, 'get_model', model_name=cell['model_name']):
+                    model, model_name_fh, cell_n_epochs_override = pf.get_model(
+                        cell['model_name'], cell['fh'], reformatted_hyperparams, seed, version=cell['version'],
+                        model_type=cell['model_type'], n_epochs_override=n_epochs_override, **model_kwargs)
+
+                model_names = [cell['model_name'], cell['model_name_proper'], model_name_fh]
+
+                with tf.stage(telemetry, 'run_experiment', model_name=cell['model_name']):
+                    row = pf.run_experiment(model, model_names, cell_n_epochs_override, hyperparameters,
+                                            cell['cutoff_date'], cell['fh'], df_outliers, df_clean,
+                                            cell['has_outliers'], results, models_directory, results_directory,
+                                            seed=seed, **experiment_kwargs)
+
+        except Exception as e:
+            mark_cell(manifest_directory, cell, 'failed', error=repr(e), traceback=traceback.format_exc())
+            print(f'Experiment {get_cell_id(cell)} failed: {e!r}')
+            outcomes['failed'] += 1
+            if telemetry is not None:
+                telemetry.log_event('cell_failed', cell=get_cell_id(cell), error=repr(e))
+
+        else:
+            mark_cell(manifest_directory, cell, 'completed', row=row, peak_rss_mb=round(monitor.peak_mb, 1),
+                      peak_rss_delta_mb=round(monitor.peak_delta_mb, 1),
+                      peak_cuda_mb=round(monitor.peak_cuda_mb, 1) if monitor.peak_cuda_mb is not None else None)
+            if aggregator is not None:
+                aggregator.update([row])
+            outcomes['completed'] += 1
+            if telemetry is not None:
+                telemetry.log_event('cell_completed', cell=get_cell_id(cell), rmse=row['rmse'],
+                                    peak_rss_mb=round(monitor.peak_mb, 1))
+
+        if model is not None:
+            release_model(model)
+        del model
+        release_memory()
+
+        rss_mb = pf.get_rss_mb()
+        if memory_ceiling_mb is not None and rss_mb > memory_ceiling_mb:
+            outcomes['remaining'] = len(cells) - i - 1
+            print(f'RSS {rss_mb:,.0f} MB exceeds the ceiling of {memory_ceiling_mb:,} MB after {get_cell_id(cell)}, '
+                  f"stopping with {outcomes['remaining']} cells remaining")
+            break
+
+    if telemetry is not None:
+        record_sweep_progress(telemetry, outcomes, outcomes['remaining'], start_time, progress_offsets)
+        telemetry.log_event('sweep_finished', **outcomes)
+
+    print(f"\nSweep finished: {outcomes['completed']} completed, {outcomes['skipped']} skipped (already completed), "
+          f"{outcomes['failed']} failed, {outcomes['remaining']} remaining.")
+
+    return outcomes
+
+_telemetry_queue = None
+
+def _set_telemetry_queue(queue):
+    global _telemetry_queue
+    _telemetry_queue = queue
+
+def _run_sweep_worker(cells, sweep_args, sweep_kwargs):
+    results = {key: [] for key in sweep_args['results']}
+    if _telemetry_queue is not None:
+        sweep_kwargs['telemetry'] = tf.QueueTelemetry(_telemetry_queue)
+    outcomes = run_sweep(cells, **{**sweep_args, 'results': results}, **sweep_kwargs)
+
+    return outcomes, results, sweep_kwargs.get('aggregator')
+
+def run_sweep_recycled(cells: list, hyperparameters: dict, df_outliers, df_clean, results: dict, models_directory,
+                       results_directory, manifest_directory, memory_ceiling_mb, mp_context='spawn', max_workers=None,
+                       **sweep_kwargs) -> dict:
+    """
+    Runs run_sweep in a worker process that is replaced whenever its RSS exceeds memory_ceiling_mb, so memory
+    that darts, torch or the allocator never return cannot accumulate over a long sweep. Each new worker resumes
+    from the manifest (failed cells are only retried by the first). The final worker's results rows, which
+    include the restored rows of all completed cells, are added to results and to aggregator (an
+    evaluation_functions.ResultsAggregator, if given). max_workers caps the number of workers started.
+    A worker that dies (e.g. killed by the OOM killer) marks its cell in flight failed with the error and is
+    replaced; if it was the last allowed worker, a RuntimeError is raised and a rerun resumes the sweep.
+    sweep_kwargs are the remaining run_sweep arguments; a telemetry exporter stays in this process, records each
+    worker as a 'sweep_worker' stage and publishes the workers' cell metrics and events, forwarded through a
+    queue (see telemetry_functions.QueueTelemetry). Peak memory per cell is in
+    get_manifest_summary(manifest_directory).
+    """
+    sweep_args = {'hyperparameters': hyperparameters, 'df_outliers': df_outliers, 'df_clean': df_clean,
+                  'results': results, 'models_directory': models_directory, 'results_directory': results_directory,
+                  'manifest_directory': manifest_directory}
+    aggregator = sweep_kwargs.pop('aggregator', None)
+    telemetry = sweep_kwargs.pop('telemetry', None)
+    context = multiprocessing.get_context(mp_context)
+    n_workers = 0
+
+    def get_n_completed():
+        return sum((get_cell_status(manifest_directory, cell) or {}).get('status') == 'completed' for cell in cells)
+
+    # published progress covers the whole sweep: later workers skip the cells earlier ones completed
+    start_time, n_completed_before = time.time(), get_n_completed()
+
+    with tf.forward_telemetry(telemetry, context) as telemetry_queue:
+        while True:
+            # every worker restores the completed rows, so each starts from an empty aggregator
+            if aggregator is not None:
+                sweep_kwargs['aggregator'] = type(aggregator)(aggregator.metrics, aggregator.relative_accuracy)
+
+            if telemetry is not None:
+                n_completed = get_n_completed() - n_completed_before
+                sweep_kwargs['progress_offsets'] = {'completed': n_completed, 'skipped': -n_completed,
+                                                    'start_time': start_time}
+
+            try:
+                with tf.stage(telemetry, 'sweep_worker'):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_set_telemetry_queue,
+                                             initargs=(telemetry_queue,)) as executor:
+                        outcomes, worker_results, worker_aggregator = executor.submit(
+                            _run_sweep_worker, cells, sweep_args,
+                            {**sweep_kwargs, 'memory_ceiling_mb': memory_ceiling_mb}).result()
+
+            except BrokenProcessPool as e:
+                n_workers += 1
+                # cells run in order, so the first one in flight is the one the worker died on
+                cell = next((cell for cell in cells
+                             if (get_cell_status(manifest_directory, cell) or {}).get('status') == 'in_progress'), None)
+                if cell is None:
+                    raise
+
+                mark_cell(manifest_directory, cell, 'failed', error=f'Sweep worker died: {e!r}')
+                print(f'The sweep worker died running {get_cell_id(cell)}, marked it failed')
+                if telemetry is not None:
+                    telemetry.log_event('sweep_worker_died', worker=n_workers, cell=get_cell_id(cell), error=repr(e))
+                # a cell that killed its worker would likely kill the next one too
+                sweep_kwargs['retry_failed'] = False
+
+                if max_workers is not None and n_workers >= max_workers:
+                    raise RuntimeError(f'The last of {max_workers} sweep workers died, '
+                                       'rerun the sweep to resume') from e
+
+                continue
+
+            n_workers += 1
+            if telemetry is not None:
+                telemetry.log_event('sweep_worker_finished', worker=n_workers, **outcomes)
+            sweep_kwargs['retry_failed'] = False
+
+            if outcomes['remaining'] == 0 or (max_workers is not None and n_workers >= max_workers):
+                break
+
+            print(f'Recycling the sweep worker ({n_workers} used so far)')
+
+    for key, values in worker_results.items():
+        results[key].extend(values)
+
+    if aggregator is not None:
+        aggregator.merge(worker_aggregator)
+
+    return {**outcomes, 'workers': n_workers}
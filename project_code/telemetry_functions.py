@@ -0,0 +1,287 @@
+import contextlib
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import optuna
+import os
+import threading
+import time
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counters, gauges and summaries (count and sum, e.g. of stage latencies) keyed by metric
+    name and labels, rendered in the Prometheus text exposition format.
+    """
+    def __init__(self, prefix='forecast'):
+        self.prefix = prefix
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_values(self, name, metric_type, help_text):
+        name = f'{self.prefix}_{name}' if self.prefix else name
+
+        if name not in self.metrics:
+            self.metrics[name] = {'type': metric_type, 'help': help_text, 'values': {}}
+        elif self.metrics[name]['type'] != metric_type:
+            raise ValueError(f"Metric {name} is a {self.metrics[name]['type']}, not a {metric_type}")
+
+        return self.metrics[name]['values']
+
+    def inc(self, name, value=1.0, help_text='', **labels):
+        with self.lock:
+            values = self._get_values(name, 'counter', help_text)
+            key = tuple(sorted(labels.items()))
+            values[key] = values.get(key, 0.0) + value
+
+    def set(self, name, value, help_text='', **labels):
+        with self.lock:
+            self._get_values(name, 'gauge', help_text)[tuple(sorted(labels.items()))] = float(value)
+
+    def observe(self, name, value, help_text='', **labels):
+        with self.lock:
+            values = self._get_values(name, 'summary', help_text)
+            key = tuple(sorted(labels.items()))
+            count, total = values.get(key, (0, 0.0))
+            values[key] = (count + 1, total + value)
+
+    def get(self, name, **labels):
+        """Returns the value of a counter or gauge, or the (count, sum) of a summary; None if never recorded."""
+        name = f'{self.prefix}_{name}' if self.prefix else name
+        with self.lock:
+            return self.metrics.get(name, {'values': {}})['values'].get(tuple(sorted(labels.items())))
+
+    def render(self) -> str:
+        lines = []
+
+        with self.lock:
+            for name, metric in sorted(self.metrics.items()):
+                if metric['help']:
+                    lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['type']}")
+
+                for key, value in metric['values'].items():
+                    labels = ','.join(f'{label}="{escape_label_value(label_value)}"' for label, label_value in key)
+                    labels = f'{{{labels}}}' if labels else ''
+
+                    if metric['type'] == 'summary':
+                        lines.append(f'{name}_count{labels} {value[0]}')
+                        lines.append(f'{name}_sum{labels} {value[1]!r}')
+                    else:
+                        lines.append(f'{name}{labels} {value!r}')
+
+        return '\n'.join(lines) + '\n'
+
+class TelemetryExporter:
+    """
+    Publishes live metrics of long sweeps and hyperparameter searches: in the Prometheus text format at
+    http://host:port/metrics (port=0 picks a free port, None serves nothing) and as a JSON line per event in
+    event_log. Pass it as telemetry to hs.hyperparameter_search and sf.run_sweep. Use as a context manager, or
+    call close, to stop the server.
+    """
+    def __init__(self, port=None, event_log=None, host='127.0.0.1', prefix='forecast'):
+        self.registry = MetricsRegistry(prefix)
+        self.event_log = event_log
+        self.log_lock = threading.Lock()
+        self.server = None
+        self.port = None
+
+        if event_log is not None:
+            log_directory = os.path.dirname(event_log)
+            if log_directory and not os.path.exists(log_directory):
+                os.makedirs(log_directory)
+
+        if port is not None:
+            registry = self.registry
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ['/', '/metrics']:
+                        self.send_error(404)
+                        return
+
+                    body = registry.render().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.daemon_threads = True
+            self.port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f'Serving metrics at http://{host}:{self.port}/metrics')
+
+    def log_event(self, event, **fields):
+        """Appends {'time', 'event', **fields} to the event log and updates the last event time gauge."""
+        now = time.time()
+        self.registry.set('last_event_timestamp_seconds', now, 'Unix time of the last telemetry event')
+
+        if self.event_log is None:
+            return
+
+        line = json.dumps({'time': datetime.datetime.fromtimestamp(now).isoformat(), 'event': event, **fields},
+                          default=str)
+        with self.log_lock:
+            with open(self.event_log, 'a') as f:
+                f.write(line + '\n')
+
+    @contextlib.contextmanager
+    def stage(self, stage, **labels):
+        """Times the enclosed block into the stage_seconds summary and logs it as a 'stage' event."""
+        start_time = time.perf_counter()
+        status = 'ok'
+
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.perf_counter() - start_time
+            self.registry.observe('stage_seconds', seconds, 'Latency of pipeline stages', stage=stage, **labels)
+            self.registry.set('stage_last_seconds', seconds, 'Latency of the last run of each stage',
+                              stage=stage, **labels)
+            self.log_event('stage', stage=stage, seconds=round(seconds, 4), status=status, **labels)
+
+    def report_pool(self, pool, n_workers, n_pending):
+        """Records the utilization and queue depth of a pool of n_workers with n_pending unfinished tasks."""
+        n_busy = min(n_workers, n_pending)
+        self.registry.set('pool_workers', n_workers, 'Worker processes per pool', pool=pool)
+        self.registry.set('pool_utilization', n_busy / max(n_workers, 1), 'Share of busy pool workers', pool=pool)
+        self.registry.set('pool_queue_depth', max(0, n_pending - n_workers), 'Tasks waiting for a pool worker',
+                          pool=pool)
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ForwardingRegistry(MetricsRegistry):
+    """MetricsRegistry that also puts every counter, gauge and summary update on a multiprocessing queue."""
+    def __init__(self, queue, prefix='forecast'):
+        super().__init__(prefix)
+        self.queue = queue
+
+    def inc(self, name, value=1.0, help_text='', **labels):
+        super().inc(name, value, help_text, **labels)
+        self.queue.put(('metric', 'inc', (name, value, help_text), labels))
+
+    def set(self, name, value, help_text='', **labels):
+        super().set(name, value, help_text, **labels)
+        self.queue.put(('metric', 'set', (name, value, help_text), labels))
+
+    def observe(self, name, value, help_text='', **labels):
+        super().observe(name, value, help_text, **labels)
+        self.queue.put(('metric', 'observe', (name, value, help_text), labels))
+
+class QueueTelemetry(TelemetryExporter):
+    """
+    Telemetry of a worker process: records metrics locally like a TelemetryExporter without a server or event
+    log, and forwards every metric update and event through queue to the parent's exporter (see
+    forward_telemetry).
+    """
+    def __init__(self, queue, prefix='forecast'):
+        super().__init__(prefix=prefix)
+        self.registry = ForwardingRegistry(queue, prefix)
+        self.queue = queue
+
+    def log_event(self, event, **fields):
+        # the parent's log_event sets its own last event time
+        MetricsRegistry.set(self.registry, 'last_event_timestamp_seconds', time.time(),
+                            'Unix time of the last telemetry event')
+        self.queue.put(('event', event, fields))
+
+@contextlib.contextmanager
+def forward_telemetry(telemetry, context):
+    """
+    Yields a queue of the multiprocessing context for worker processes to pass to QueueTelemetry, or None if
+    telemetry is None. A thread replays the metric updates and events put on it on telemetry, so that its
+    server and event log publish them, until the block exits.
+    """
+    if telemetry is None:
+        yield None
+        return
+
+    queue = context.Queue()
+
+    def forward():
+        while True:
+            message = queue.get()
+            if message is None:
+                return
+
+            if message[0] == 'metric':
+                _, method, args, labels = message
+                getattr(telemetry.registry, method)(*args, **labels)
+            else:
+                _, event, fields = message
+                telemetry.log_event(event, **fields)
+
+    thread = threading.Thread(target=forward, daemon=True)
+    thread.start()
+
+    try:
+        yield queue
+    finally:
+        queue.put(None)
+        thread.join()
+
+def stage(telemetry, stage, **labels):
+    """Returns telemetry.stage(stage, **labels), or a no-op context if telemetry is None."""
+    return telemetry.stage(stage, **labels) if telemetry is not None else contextlib.nullcontext()
+
+class OptunaTelemetryCallback:
+    """
+    Optuna study callback that publishes the number of trials per state, trials per second, the pruned and
+    completed ratios and the best value, and logs a 'trial' event per finished trial (the best value over time).
+    """
+    def __init__(self, telemetry: TelemetryExporter, study_name):
+        self.telemetry = telemetry
+        self.study_name = study_name
+        self.start_time = time.perf_counter()
+
+    def __call__(self, study: optuna.Study, trial: optuna.trial.FrozenTrial):
+        registry = self.telemetry.registry
+        state = trial.state.name.lower()
+        registry.inc('trials_total', 1, 'Finished Optuna trials by state', study=self.study_name, state=state)
+
+        counts = {state: registry.get('trials_total', study=self.study_name, state=state) or 0
+                  for state in ['complete', 'pruned', 'fail']}
+        n_finished = sum(counts.values())
+        elapsed = time.perf_counter() - self.start_time
+
+        registry.set('trials_per_second', n_finished / elapsed if elapsed > 0 else 0.0,
+                     'Finished trials per second since the study started', study=self.study_name)
+        registry.set('trials_pruned_ratio', counts['pruned'] / n_finished, 'Share of finished trials pruned',
+                     study=self.study_name)
+        registry.set('trials_completed_ratio', counts['complete'] / n_finished, 'Share of finished trials completed',
+                     study=self.study_name)
+
+        if trial.duration is not None:
+            registry.observe('trial_seconds', trial.duration.total_seconds(), 'Latency of Optuna trials',
+                             study=self.study_name, state=state)
+
+        best_value = None
+        if counts['complete']:
+            best_value = study.best_value
+            registry.set('best_value', best_value, 'Best objective value so far', study=self.study_name)
+
+        self.telemetry.log_event('trial', study=self.study_name, number=trial.number, state=state, value=trial.value,
+                                 best_value=best_value, n_finished=n_finished,
+                                 seconds=trial.duration.total_seconds() if trial.duration is not None else None,
+                                 params=trial.params)
@@ -1,17 +1,23 @@
 
+import calendar
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 import seaborn as sns
-from statsmodels.tsa.seasonal import STL
 
+from project_code import feature_functions as ff
 
-def correlation_matrix(df, figsize=(18,6), cmap='coolwarm', mask=True, name=None, fig_directory='eda_figures/'):
+
+def correlation_matrix(df, figsize=(18,6), cmap='coolwarm', mask=True, name=None, fig_directory='eda_figures/',
+                       corr=None):
     """Accepts a dataframe and generates a correlation matrix. If
-    a name is provided, the image is saved."""
-    corr = df.corr()
+    a name is provided, the image is saved. A precomputed correlation matrix, e.g.
+    profile_functions.StreamingProfile.get_correlation() of data too large to load, can be
+    passed as corr instead (df is then ignored)."""
+    if corr is None:
+        corr = df.corr()
 
     plt.subplots(figsize=figsize)
 
@@ -31,23 +37,32 @@ def correlation_matrix(df, figsize=(18,6), cmap='coolwarm', mask=True, name=None
 
     plt.show()
 
-def plot_seasonal_decomposition(df, column, period, color, name=None, fig_directory='eda_figures/'):
-    """Provides styled decomposition plots for a given dataframe and column."""
-    decomposition = STL(df[column], period=period).fit()
+def plot_seasonal_decomposition(df, column, period, color, name=None, fig_directory='eda_figures/',
+                                cache_directory=None, max_points=None):
+    """
+    Provides styled decomposition plots for a given dataframe and column. The STL decomposition is read from
+    cache_directory if it was computed before (see feature_functions.get_decompositions). max_points
+    downsamples each component to its min/max envelope for long series.
+    """
+    decomposition = ff.get_decomposition(df, column, period, cache_directory)
+
+    if max_points is not None:
+        decomposition = {component: downsample_series(decomposition[component], max_points)
+                         for component in ['observed', 'trend', 'seasonal', 'resid']}
 
     fig, (ax1, ax2, ax3, ax4) = plt.subplots(nrows=4, ncols=1, sharex=True,
                                         figsize=(10,8))
 
-    ax1.plot(decomposition.observed, color=color)
+    ax1.plot(decomposition['observed'], color=color)
     ax1.set_ylabel('Observed')
 
-    ax2.plot(decomposition.trend, color=color)
+    ax2.plot(decomposition['trend'], color=color)
     ax2.set_ylabel('Trend')
 
-    ax3.plot(decomposition.seasonal, color=color)
+    ax3.plot(decomposition['seasonal'], color=color)
     ax3.set_ylabel('Seasonal')
 
-    ax4.plot(decomposition.resid, color=color)
+    ax4.plot(decomposition['resid'], color=color)
     ax4.set_ylabel('Residuals')
 
     fig.autofmt_xdate()
@@ -58,6 +73,143 @@ def plot_seasonal_decomposition(df, column, period, color, name=None, fig_direct
 
     plt.show()
 
+def minmax_downsample_indices(y, n_out):
+    """Returns the sorted indices of the minimum and maximum of n_out // 2 equal buckets, keeping the envelope of y."""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+
+    if n <= n_out:
+        return np.arange(n)
+
+    n_buckets = max(1, n_out // 2)
+    bucket_size = int(np.ceil(n / n_buckets))
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = y
+    buckets = padded.reshape(n_buckets, bucket_size)
+
+    offsets = np.arange(n_buckets) * bucket_size
+    min_indices = offsets + np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1)
+    max_indices = offsets + np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1)
+
+    indices = np.unique(np.concatenate([[0, n - 1], min_indices, max_indices]))
+    return indices[indices < n]
+
+def lttb_downsample_indices(x, y, n_out):
+    """Returns the indices of n_out points chosen by Largest-Triangle-Three-Buckets, which preserves the visual shape."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the always kept first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        a = selected[i]
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        selected[i + 1] = start + np.argmax(areas)
+
+    return selected
+
+def get_downsample_indices(x, y, n_out, method='minmax'):
+    if method == 'minmax':
+        return minmax_downsample_indices(y, n_out)
+    elif method == 'lttb':
+        return lttb_downsample_indices(x, y, n_out)
+
+    raise ValueError(f"Invalid downsampling method {method}, expected 'minmax' or 'lttb'")
+
+def _get_numeric_x(x):
+    return x.asi8.astype(np.float64) if isinstance(x, pd.DatetimeIndex) else np.asarray(x, dtype=np.float64)
+
+def downsample_series(series: pd.Series, n_out=2000, method='minmax') -> pd.Series:
+    """Returns at most about n_out points of series, chosen by min/max envelope or LTTB."""
+    return series.iloc[get_downsample_indices(_get_numeric_x(series.index), series.to_numpy(), n_out, method)]
+
+def plot_resampled_series(series: dict, decomposition: pd.DataFrame = None, n_out=2000, method='minmax',
+                          title=None, height=600):
+    """
+    Interactive chart of long time series, e.g. {'Observed': ..., 'N-BEATS': ...} as pd.Series with a date index,
+    with the trend, seasonal and resid columns of a decomposition in a second panel. Every trace is downsampled
+    to about n_out points ('minmax' envelopes or 'lttb'). Returned as a plotly FigureWidget, the visible x range
+    is resampled from the full data on every zoom, so the chart stays responsive at any data size; without
+    anywidget installed a static downsampled figure is returned.
+    """
+    panels = [series]
+    if decomposition is not None:
+        panels.append({component: decomposition[component] for component in ['trend', 'seasonal', 'resid']
+                       if component in decomposition})
+
+    fig = make_subplots(rows=len(panels), cols=1, shared_xaxes=True, vertical_spacing=0.05)
+    full_data = []
+
+    for row, panel in enumerate(panels, start=1):
+        for trace_name, trace_series in panel.items():
+            trace_series = trace_series.dropna()
+            x, y = trace_series.index, trace_series.to_numpy(dtype=np.float64)
+            full_data.append((x, _get_numeric_x(x), y))
+
+            indices = get_downsample_indices(full_data[-1][1], y, n_out, method)
+            fig.add_trace(go.Scattergl(x=x[indices], y=y[indices], name=trace_name, mode='lines'), row=row, col=1)
+
+    fig.update_layout(title=title, height=height, hovermode='x unified', plot_bgcolor='white')
+    fig.update_xaxes(showline=True, gridcolor='lightgrey')
+    fig.update_yaxes(showline=True, gridcolor='lightgrey')
+
+    try:
+        widget = go.FigureWidget(fig)
+    except ImportError as e:
+        print(f'Returning a static downsampled figure ({e})')
+        return fig
+
+    def resample(layout, x_range):
+        with widget.batch_update():
+            for trace, (x, x_numeric, y) in zip(widget.data, full_data):
+                if x_range is None:
+                    start, end = 0, len(x)
+                elif isinstance(x, pd.DatetimeIndex):
+                    # plotly sends date ranges as ISO strings, with or without a time part
+                    start, end = x.searchsorted(pd.to_datetime(list(x_range), format='ISO8601'))
+                else:
+                    start, end = np.searchsorted(x_numeric, x_range)
+
+                if x_range is not None:
+                    # one point beyond each edge so lines run to the border of the plot
+                    start, end = max(start - 1, 0), min(end + 1, len(x))
+
+                indices = start + get_downsample_indices(x_numeric[start:end], y[start:end], n_out, method)
+                trace.x, trace.y = x[indices], y[indices]
+
+    for axis in [name for name in widget.layout if name.startswith('xaxis')]:
+        widget.layout.on_change(resample, f'{axis}.range')
+
+    return widget
+
+def get_monthly_trends(monthly_data: dict, x='year', y='sunshine_hr') -> dict:
+    """Returns the least squares (slope, intercept) of y on x for every month, fitted together in closed form."""
+    months = list(monthly_data.keys())
+    groups = np.repeat(np.arange(len(months)), [len(monthly_data[month]) for month in months])
+    x_values = np.concatenate([monthly_data[month][x].to_numpy(dtype=np.float64) for month in months])
+    y_values = np.concatenate([monthly_data[month][y].to_numpy(dtype=np.float64) for month in months])
+
+    counts = np.bincount(groups)
+    x_means = np.bincount(groups, x_values) / counts
+    y_means = np.bincount(groups, y_values) / counts
+    x_centered = x_values - x_means[groups]
+
+    slopes = np.bincount(groups, x_centered * y_values) / np.bincount(groups, x_centered ** 2)
+    intercepts = y_means - slopes * x_means
+
+    return {month: (slopes[i], intercepts[i]) for i, month in enumerate(months)}
+
 def plot_monthly_charts(monthly_data: dict,  num_yrs_rolling_avg, column='sunshine_hr', 
                         figsize=(20,20), x_label='', x_font_size=12,
                         y_label='Hours', y_font_size=14, ylim_start=0, name=None, fig_directory='eda_figures/'):
@@ -67,210 +219,38 @@ def plot_monthly_charts(monthly_data: dict,  num_yrs_rolling_avg, column='sunshi
     YEAR = 'year'
     COLUMN = column
     ROLLING_AVG = f'{num_yrs_rolling_avg}yr_rolling_avg'
-    JANUARY = 'January'
-    FEBRUARY = 'February'
-    MARCH = 'March'
-    APRIL = 'April'
-    MAY = 'May'
-    JUNE = 'June'
-    JULY = 'July'
-    AUGUST = 'August'
-    SEPTEMBER = 'September'
-    OCTOBER = 'October'
-    NOVEMBER = 'November'
-    DECEMBER = 'December'
-
-    # Monthly Subsets
-
-    y_max = float('-inf')
-
-    for month in monthly_data.keys():
-        monthly_max = monthly_data[month][column].max()
-        if monthly_max > y_max:
-            y_max = monthly_max
-
-    y_max = np.ceil(y_max) # will use to set consistent upper limit for charts
+    MONTHS = list(calendar.month_name[1:])
+    LEGEND_MONTHS = ['January', 'June', 'October']
+
+    y_max = np.ceil(max(monthly_data[month][column].max() for month in monthly_data.keys())) # will use to set consistent upper limit for charts
+
+    trends = get_monthly_trends(monthly_data, YEAR, COLUMN)
 
     fig, axes = plt.subplots(4, 3, figsize=figsize)
-    
-    # January
-
-    # plot trend line
-    z = np.polyfit(monthly_data[JANUARY][YEAR], monthly_data[JANUARY][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[0, 0].plot(monthly_data[JANUARY][YEAR], p(monthly_data[JANUARY][YEAR]), 'r--',
-                    label='Annual Trend')
-
-    # plot monthly annual data and 3-year rolling average
-    sns.lineplot(ax=axes[0, 0], data=monthly_data[JANUARY], x=YEAR, y=COLUMN, label='Monthly Mean')
-    sns.lineplot(ax=axes[0, 0], data=monthly_data[JANUARY], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--', label=f'{num_yrs_rolling_avg}-Year Rolling Average')
-    axes[0, 0].text(0.85, 0.07, JANUARY, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[0, 0].transAxes, fontsize=x_font_size)
-    axes[0, 0].set_ylabel(y_label, fontsize=y_font_size)
-    axes[0, 0].set(ylim=(ylim_start, y_max))
-    axes[0, 0].set_xlabel('')
-
-    # February
-    z = np.polyfit(monthly_data[FEBRUARY][YEAR], monthly_data[FEBRUARY][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[0, 1].plot(monthly_data[FEBRUARY][YEAR], p(monthly_data[JANUARY][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[0, 1], data=monthly_data[FEBRUARY], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[0, 1], data=monthly_data[FEBRUARY], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[0, 1].text(0.85, 0.07, FEBRUARY, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[0, 1].transAxes, fontsize=x_font_size)
-    axes[0, 1].set_ylabel('')
-    axes[0, 1].set(ylim=(ylim_start, y_max))
-    axes[0, 1].set_xlabel('')
-
-
-    # March
-    z = np.polyfit(monthly_data[MARCH][YEAR], monthly_data[MARCH][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[0, 2].plot(monthly_data[MARCH][YEAR], p(monthly_data[MARCH][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[0, 2], data=monthly_data[MARCH], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[0, 2], data=monthly_data[MARCH], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[0, 2].text(0.85, 0.07, MARCH, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[0, 2].transAxes, fontsize=x_font_size)
-    axes[0, 2].set_ylabel('')
-    axes[0, 2].set(ylim=(ylim_start, y_max))
-    axes[0, 2].set_xlabel('')
-
-
-    # April
-    z = np.polyfit(monthly_data[APRIL][YEAR], monthly_data[APRIL][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[1, 0].plot(monthly_data[APRIL][YEAR], p(monthly_data[APRIL][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[1, 0], data=monthly_data[APRIL], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[1, 0], data=monthly_data[APRIL], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[1, 0].text(0.85, 0.07, APRIL, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[1, 0].transAxes, fontsize=x_font_size)
-    axes[1, 0].set_ylabel(y_label, fontsize=y_font_size)
-    axes[1, 0].set(ylim=(ylim_start, y_max))
-    axes[1, 0].set_xlabel('')
-
-    # May
-    z = np.polyfit(monthly_data[MAY][YEAR], monthly_data[MAY][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[1, 1].plot(monthly_data[MAY][YEAR], p(monthly_data[MAY][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[1, 1], data=monthly_data[MAY], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[1, 1], data=monthly_data[MAY], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[1, 1].text(0.85, 0.07, MAY, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[1, 1].transAxes, fontsize=x_font_size)
-    axes[1, 1].set_ylabel('')
-    axes[1, 1].set(ylim=(ylim_start, y_max))
-    axes[1, 1].set_xlabel('')
-
-
-    # June
-    z = np.polyfit(monthly_data[JUNE][YEAR], monthly_data[JUNE][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[1, 2].plot(monthly_data[JUNE][YEAR], p(monthly_data[JUNE][YEAR]), 'r--',
-                    label='Annual Trend')
-
-    sns.lineplot(ax=axes[1, 2], data=monthly_data[JUNE], x=YEAR, y=COLUMN, label='Monthly Mean')
-    sns.lineplot(ax=axes[1, 2], data=monthly_data[JUNE], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--', label=f'{num_yrs_rolling_avg}-Year Rolling Average')
-    axes[1, 2].text(0.85, 0.07, JUNE, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[1, 2].transAxes, fontsize=x_font_size)
-    axes[1, 2].set_ylabel('')
-    axes[1, 2].set(ylim=(ylim_start, y_max))
-    axes[1, 2].set_xlabel('')
-
-    # July
-    z = np.polyfit(monthly_data[JULY][YEAR], monthly_data[JULY][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[2, 0].plot(monthly_data[JULY][YEAR], p(monthly_data[JULY][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[2, 0], data=monthly_data[JULY], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[2, 0], data=monthly_data[JULY], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-
-    axes[2, 0].text(0.85, 0.07, JULY, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[2, 0].transAxes, fontsize=x_font_size)
-    axes[2, 0].set_ylabel(y_label, fontsize=y_font_size)
-    axes[2, 0].set(ylim=(ylim_start, y_max))
-    axes[2, 0].set_xlabel('')
-
-    # August
-    z = np.polyfit(monthly_data[AUGUST][YEAR], monthly_data[AUGUST][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[2, 1].plot(monthly_data[AUGUST][YEAR], p(monthly_data[AUGUST][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[2, 1], data=monthly_data[AUGUST], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[2, 1], data=monthly_data[AUGUST], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-
-    axes[2, 1].text(0.85, 0.07, AUGUST, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[2, 1].transAxes, fontsize=x_font_size)
-    axes[2, 1].set_ylabel('')
-    axes[2, 1].set(ylim=(ylim_start, y_max))
-    axes[2, 1].set_xlabel('')
-
-    # September
-    z = np.polyfit(monthly_data[SEPTEMBER][YEAR], monthly_data[SEPTEMBER][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[2, 2].plot(monthly_data[SEPTEMBER][YEAR], p(monthly_data[SEPTEMBER][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[2, 2], data=monthly_data[SEPTEMBER], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[2, 2], data=monthly_data[SEPTEMBER], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[2, 2].text(0.85, 0.07, SEPTEMBER, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[2, 2].transAxes, fontsize=x_font_size)
-    axes[2, 2].set_ylabel('')
-    axes[2, 2].set(ylim=(ylim_start, y_max))
-    axes[2, 2].set_xlabel('')
-
-    # October
-    z = np.polyfit(monthly_data[OCTOBER][YEAR], monthly_data[OCTOBER][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[3, 0].plot(monthly_data[OCTOBER][YEAR], p(monthly_data[OCTOBER][YEAR]), 'r--',
-                    label='Annual Trend')
-
-    sns.lineplot(ax=axes[3, 0], data=monthly_data[OCTOBER], x=YEAR, y=COLUMN, label='Monthly Mean')
-    sns.lineplot(ax=axes[3, 0], data=monthly_data[OCTOBER], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--', label=f'{num_yrs_rolling_avg}-Year Rolling Average')
-    axes[3, 0].text(0.85, 0.07, OCTOBER, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[3, 0].transAxes, fontsize=x_font_size)
-    axes[3, 0].set_ylabel(y_label, fontsize=y_font_size)
-    axes[3, 0].set(ylim=(ylim_start, y_max))
-    axes[3, 0].set_xlabel('')
-
-    # November
-    z = np.polyfit(monthly_data[NOVEMBER][YEAR], monthly_data[NOVEMBER][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[3, 1].plot(monthly_data[NOVEMBER][YEAR], p(monthly_data[NOVEMBER][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[3, 1], data=monthly_data[NOVEMBER], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[3, 1], data=monthly_data[NOVEMBER], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[3, 1].text(0.85, 0.07, NOVEMBER, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[3, 1].transAxes, fontsize=x_font_size)
-    axes[3, 1].set_ylabel('')
-    axes[3, 1].set(ylim=(ylim_start, y_max))
-    axes[3, 1].set_xlabel('')
-
-    # December
-    z = np.polyfit(monthly_data[DECEMBER][YEAR], monthly_data[DECEMBER][COLUMN], deg=1)
-    p = np.poly1d(z)
-    axes[3, 2].plot(monthly_data[DECEMBER][YEAR], p(monthly_data[DECEMBER][YEAR]), 'r--')
-
-    sns.lineplot(ax=axes[3, 2], data=monthly_data[DECEMBER], x=YEAR, y=COLUMN)
-    sns.lineplot(ax=axes[3, 2], data=monthly_data[DECEMBER], x=YEAR, y=ROLLING_AVG,
-                color='black', linestyle='--')
-    axes[3, 2].text(0.85, 0.07, DECEMBER, horizontalalignment='center', verticalalignment='center', 
-                    transform=axes[3, 2].transAxes, fontsize=x_font_size)
-    axes[3, 2].set_ylabel('')
-    axes[3, 2].set(ylim=(ylim_start, y_max))
-    axes[3, 2].set_xlabel('')
+
+    for i, month in enumerate(MONTHS):
+        ax = axes[i // 3, i % 3]
+        with_legend = month in LEGEND_MONTHS
+
+        # plot trend line
+        slope, intercept = trends[month]
+        ax.plot(monthly_data[month][YEAR], slope * monthly_data[month][YEAR] + intercept, 'r--',
+                label='Annual Trend' if with_legend else None)
+
+        # plot monthly annual data and rolling average
+        sns.lineplot(ax=ax, data=monthly_data[month], x=YEAR, y=COLUMN,
+                     label='Monthly Mean' if with_legend else None)
+        sns.lineplot(ax=ax, data=monthly_data[month], x=YEAR, y=ROLLING_AVG, color='black', linestyle='--',
+                     label=f'{num_yrs_rolling_avg}-Year Rolling Average' if with_legend else None)
+        ax.text(0.85, 0.07, month, horizontalalignment='center', verticalalignment='center', 
+                transform=ax.transAxes, fontsize=x_font_size)
+
+        if i % 3 == 0:
+            ax.set_ylabel(y_label, fontsize=y_font_size)
+        else:
+            ax.set_ylabel('')
+        ax.set(ylim=(ylim_start, y_max))
+        ax.set_xlabel('')
 
     fig.tight_layout()
 
@@ -321,26 +301,47 @@ def dual_bar_chart(df, x, y1, y2, y1_label, y2_label, y1_color, y2_color,
 
     fig.show()
 
+def plot_boxplot(data, col, y_label, alternate_x_labels=None, granularity='month', figsize=(15,3),
+                 tick_font_size=10, label_font_size=10):
+
+    """Plots a monthly or seasonal boxplot for one column and returns the figure."""
+
+    fig, ax = plt.subplots(figsize=figsize)
+
+    if granularity == 'month':
+        boxplot = sns.boxplot(data=data, x='month', y=col, ax=ax, color='lightblue')
+    elif granularity == 'season':
+        boxplot = sns.boxplot(data=data, x='season_str', y=col, ax=ax, color='lightblue')
+
+    ax.set_ylabel(y_label, fontsize=label_font_size)
+    ax.set_xlabel('')
+    plt.yticks(fontsize=tick_font_size)
+
+    if alternate_x_labels:
+        ax.set_xticklabels(alternate_x_labels, fontsize=tick_font_size)
+    else:
+        plt.xticks(fontsize=tick_font_size)
+
+    return fig
+
 def generate_boxplots(data, columns, y_labels, alternate_x_labels=None, 
                       granularity='month', figsize=(15,3), 
                       tick_font_size=10, label_font_size=10,
-                      name=None):
+                      name=None, figure_queue=None, fig_directory='eda_figures/'):
 
-    """Generates monthly or seasonal boxplots for the given columns."""
+    """
+    Generates monthly or seasonal boxplots for the given columns. With a render_functions.FigureQueue the
+    boxplots are rendered in parallel to {fig_directory}{name}_{col}.png instead of being drawn inline.
+    """
 
     for col in columns:
-        fig, ax = plt.subplots(figsize=figsize)
-
-        if granularity == 'month':
-            boxplot = sns.boxplot(data=data, x='month', y=col, ax=ax, color='lightblue')
-        elif granularity == 'season':
-            boxplot = sns.boxplot(data=data, x='season_str', y=col, ax=ax, color='lightblue')
-
-        ax.set_ylabel(y_labels[col], fontsize=label_font_size)
-        ax.set_xlabel('')
-        plt.yticks(fontsize=tick_font_size)
-
-        if alternate_x_labels:
-            ax.set_xticklabels(alternate_x_labels, fontsize=tick_font_size)
+        plot_kwargs = {'alternate_x_labels': alternate_x_labels, 'granularity': granularity, 'figsize': figsize,
+                       'tick_font_size': tick_font_size, 'label_font_size': label_font_size}
+
+        if figure_queue is not None:
+            # only ship the plotted columns to the workers
+            x_col = 'month' if granularity == 'month' else 'season_str'
+            figure_queue.submit(f'{fig_directory}{name}_{col}.png', plot_boxplot, data[[x_col, col]],
+                                col, y_labels[col], **plot_kwargs)
         else:
-            plt.xticks(fontsize=tick_font_size)
+            plot_boxplot(data, col, y_labels[col], **plot_kwargs)